@@ -1,14 +1,17 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from bson import ObjectId
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional, Set
 import uuid
 from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
@@ -16,9 +19,34 @@ from passlib.context import CryptContext
 import jwt
 import random
 import shutil
-import subprocess
+import tempfile
+import base64
+import time
+import io
+import re
+import hashlib
+import hmac
+import zipfile
+import mimetypes
+import shlex
+import socket
+from urllib.parse import parse_qs, quote, urlencode, urlsplit
+from xml.sax.saxutils import escape as xml_escape
 from docx import Document
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+from docx.shared import Inches
+from reportlab.pdfgen import canvas as pdf_canvas
+from reportlab.lib.pagesizes import A4, LETTER, landscape, portrait
+from reportlab.lib.colors import HexColor
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import SimpleDocTemplate, Paragraph as PdfParagraph, Spacer, Table as PdfTable, TableStyle, PageBreak, Image as PdfImage
+from reportlab.lib.styles import getSampleStyleSheet
+from PIL import Image, ImageOps, features as PIL_features
 from emergentintegrations.llm.chat import LlmChat, UserMessage
+from cachetools import TTLCache
+import boto3
+from botocore.exceptions import ClientError
 import json
 import asyncio
 
@@ -342,6 +370,9 @@ class Attendance(BaseModel):
     date: str
     clock_in: Optional[str] = None
     clock_out: Optional[str] = None
+    status: Optional[str] = None  # coordinator mark for the day: "present" or "absent"
+    marked_by: Optional[str] = None
+    marked_at: Optional[str] = None
     created_at: datetime = Field(default_factory=get_malaysia_time)
 
 class AttendanceClockIn(BaseModel):
@@ -350,42 +381,15 @@ class AttendanceClockIn(BaseModel):
 class AttendanceClockOut(BaseModel):
     session_id: str
 
-# Helper function to convert DOCX to PDF
-def convert_docx_to_pdf(docx_path: Path, pdf_path: Path) -> bool:
-    """Convert DOCX to PDF using LibreOffice"""
-    try:
-        # Verify input file exists
-        if not docx_path.exists():
-            logging.error(f"DOCX file not found: {docx_path}")
-            return False
-        
-        # Use LibreOffice in headless mode to convert DOCX to PDF
-        result = subprocess.run([
-            'libreoffice',
-            '--headless',
-            '--convert-to', 'pdf',
-            '--outdir', str(pdf_path.parent),
-            str(docx_path)
-        ], check=True, capture_output=True, timeout=30)
-        
-        # Verify output file was created
-        if not pdf_path.exists():
-            logging.error(f"PDF file was not created: {pdf_path}")
-            logging.error(f"LibreOffice output: {result.stdout.decode()}")
-            logging.error(f"LibreOffice errors: {result.stderr.decode()}")
-            return False
-        
-        return True
-    except subprocess.TimeoutExpired:
-        logging.error("PDF conversion timed out after 30 seconds")
-        return False
-    except subprocess.CalledProcessError as e:
-        logging.error(f"LibreOffice conversion failed: {e.stderr.decode() if e.stderr else str(e)}")
-        return False
-    except Exception as e:
-        logging.error(f"PDF conversion failed: {str(e)}")
-        return False
+class AttendanceMark(BaseModel):
+    participant_id: str
+    status: str  # "present" or "absent"
 
+class BulkAttendanceMark(BaseModel):
+    records: List[AttendanceMark] = []
+    mark_all_present: bool = False  # Shortcut: mark every enrolled participant present
+
+# Helper function to convert DOCX to PDF
 class ChecklistItem(BaseModel):
     item: str
     status: str  # "good", "needs_repair"
@@ -437,6 +441,26 @@ class Certificate(BaseModel):
     issue_date: datetime = Field(default_factory=get_malaysia_time)
     certificate_url: Optional[str] = None
 
+class CertificateField(BaseModel):
+    key: Optional[str] = None  # participant_name, ic_number, company_name, program_name, venue, date
+    text: Optional[str] = None  # static text when no key is given
+    x: float  # points from the left edge
+    y: float  # points from the bottom edge
+    font: str = "Helvetica-Bold"  # any standard PDF font
+    size: float = 18
+    align: str = "center"  # "left", "center" or "right" of x
+    color: str = "#000000"
+    max_width: Optional[float] = None  # shrink the font to fit
+
+class CertificateLayout(BaseModel):
+    page_size: str = "A4"  # "A4" or "LETTER"
+    orientation: str = "landscape"
+    background_url: Optional[str] = None
+    fields: List[CertificateField] = []
+
+class CertificateBatchRequest(BaseModel):
+    participant_ids: List[str] = []  # empty = everyone enrolled in the session
+
 class Settings(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = "app_settings"
@@ -446,6 +470,9 @@ class Settings(BaseModel):
     secondary_color: str = "#6366f1"
     footer_text: str = ""
     certificate_template_url: Optional[str] = None
+    certificate_renderer: str = "docx"  # default engine: "docx" (template + LibreOffice) or "pdf" (layout)
+    certificate_renderers: Dict[str, str] = {}  # per-program override: program_id -> engine
+    certificate_layout: Optional[CertificateLayout] = None
     max_certificate_file_size_mb: int = 5  # Max certificate file size in MB
     updated_at: datetime = Field(default_factory=get_malaysia_time)
 
@@ -453,6 +480,9 @@ class SettingsUpdate(BaseModel):
     company_name: Optional[str] = None
     primary_color: Optional[str] = None
     secondary_color: Optional[str] = None
+    certificate_renderer: Optional[str] = None
+    certificate_renderers: Optional[Dict[str, str]] = None
+    certificate_layout: Optional[CertificateLayout] = None
 
 
 # Coordinator and Chief Trainer Feedback Models
@@ -575,8 +605,11 @@ def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=7)
     return encoded_jwt
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await get_user_from_token(credentials.credentials)
+
+async def get_user_from_token(token: str) -> User:
+    """Resolve a JWT to its user (also used where the token arrives as a query parameter)"""
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
         if user_id is None:
@@ -612,6 +645,28 @@ async def get_or_create_participant_access(participant_id: str, session_id: str)
     
     return ParticipantAccess(**access_doc)
 
+async def bump_session_version(session_id: str):
+    """Increment the session's data version so cached analytics for it are recomputed"""
+    await db.sessions.update_one({"id": session_id}, {"$inc": {"data_version": 1}})
+
+async def bump_user_session_versions(user_id: str):
+    """bump_session_version for every session the user takes part in (reports and analytics show their name)"""
+    await db.sessions.update_many(
+        {"$or": [
+            {"participant_ids": user_id},
+            {"supervisor_ids": user_id},
+            {"trainer_assignments.trainer_id": user_id}
+        ]},
+        {"$inc": {"data_version": 1}}
+    )
+
+async def get_session_version(session_id: str) -> Optional[int]:
+    """Get the session's data version (None if the session does not exist)"""
+    session = await db.sessions.find_one({"id": session_id}, {"_id": 0, "id": 1, "data_version": 1})
+    if not session:
+        return None
+    return session.get("data_version", 0)
+
 async def find_or_create_user(user_data: dict, role: str, company_id: str) -> dict:
     """
     Find existing user by fullname OR email OR id_number (any match)
@@ -657,6 +712,8 @@ async def find_or_create_user(user_data: dict, role: str, company_id: str) -> di
             {"id": existing_user["id"]},
             {"$set": update_data}
         )
+        if "id_number" in update_data and update_data["id_number"] != existing_user.get("id_number"):
+            await bump_user_session_versions(existing_user["id"])
         
         # Return updated user data
         updated_user = await db.users.find_one({"id": existing_user["id"]}, {"_id": 0})
@@ -704,192 +761,2069 @@ async def find_or_create_user(user_data: dict, role: str, company_id: str) -> di
             "user": new_user
         }
 
-# Training Report Models
-class TrainingReport(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    session_id: str
-    program_id: str
-    company_id: str
-    generated_by: str  # coordinator_id
-    content: str  # Markdown content
-    status: str  # "draft" or "published"
-    created_at: datetime = Field(default_factory=get_malaysia_time)
-    published_at: Optional[datetime] = None
-    published_to_supervisors: List[str] = []  # List of supervisor IDs
+# ============ DOCUMENT CONVERSION ============
+# DOCX -> PDF through a small pool of LibreOffice slots, each with its own user profile so
+# concurrent conversions never fight over one profile (or leave .~lock files next to outputs).
+# Every slot keeps a warm soffice behind unoserver (requirements.txt; the server side needs the
+# python3-uno system package) and conversions go through unoconvert (sub-second). Only if no
+# unoserver comes up does the pool fall back to a one-shot headless soffice per document.
+# Profiles live under a per-process directory and ports are picked free by the OS, so several
+# uvicorn workers on one host never share a profile or collide on a port.
 
-class ReportGenerateRequest(BaseModel):
-    session_id: str
+LIBREOFFICE_BINARY = os.environ.get('LIBREOFFICE_BINARY', 'libreoffice')
+LIBREOFFICE_POOL_SIZE = int(os.environ.get('LIBREOFFICE_POOL_SIZE', '2'))
+CONVERSION_TIMEOUT_SECONDS = int(os.environ.get('CONVERSION_TIMEOUT_SECONDS', '60'))
+# e.g. "/usr/bin/python3 -m unoserver.server" when the app's Python cannot import uno
+UNOSERVER_COMMAND = shlex.split(os.environ.get('UNOSERVER_COMMAND', 'unoserver'))
+CONVERTER_START_TIMEOUT_SECONDS = int(os.environ.get('CONVERTER_START_TIMEOUT_SECONDS', '30'))
+CONVERTER_HEALTH_INTERVAL_SECONDS = 30
 
-class ReportUpdateRequest(BaseModel):
-    content: str
 
-# ============ ROUTES ============
+class ConversionError(Exception):
+    pass
 
-@api_router.get("/")
-async def root():
-    return {"message": "Defensive Driving Training API"}
 
-# Auth Routes
-@api_router.post("/auth/register", response_model=User)
-async def register_user(user_data: UserCreate, current_user: User = Depends(get_current_user)):
-    # Role-based access control:
-    # - Admins can create any user
-    # - Coordinators can only create participants
-    # - Assistant Admins can only create participants
-    if current_user.role == "coordinator" or current_user.role == "assistant_admin":
-        if user_data.role != "participant":
-            raise HTTPException(status_code=403, detail="You can only create participants")
-    elif current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # For participants: use default password if not provided
-    password = user_data.password
-    email = user_data.email
-    
-    if user_data.role == "participant":
-        # Default password: mddrc1
-        if not password:
-            password = "mddrc1"
-        # Auto-generate email if not provided (for unique constraint)
-        if not email or email.strip() == "":
-            if user_data.id_number:
-                email = f"{user_data.id_number.replace('-', '').replace(' ', '')}@temp.mddrc.local"
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def _port_accepts(port: int) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout=2)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+class ConverterSlot:
+    def __init__(self, index: int, work_dir: Path):
+        self.index = index
+        self.port = 0
+        self.uno_port = 0
+        self.profile_dir = work_dir / f"profile_{index}"
+        self.process: Optional[asyncio.subprocess.Process] = None
+    
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+
+class DocumentConverter:
+    """Pooled DOCX -> PDF conversion: await document_converter.convert(docx_bytes) -> pdf_bytes"""
+    
+    def __init__(self, size: int, timeout: int):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.work_root = Path(tempfile.gettempdir()) / "mddrc_converter"
+        self.work_dir = self.work_root / str(os.getpid())
+        self.slots: List[ConverterSlot] = []
+        self.idle: Optional[asyncio.Queue] = None
+        self.use_server = False
+        self._health_task: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+    
+    async def start(self):
+        async with self._start_lock:
+            if self.idle is not None:
+                return
+            await asyncio.to_thread(self._remove_stale_work_dirs)
+            self.work_dir.mkdir(parents=True, exist_ok=True)
+            self.slots = [ConverterSlot(i, self.work_dir) for i in range(self.size)]
+            self.idle = asyncio.Queue()
+            self.use_server = bool(shutil.which(UNOSERVER_COMMAND[0]) and shutil.which("unoconvert"))
+            if self.use_server:
+                started = 0
+                for slot in self.slots:
+                    try:
+                        await self._launch(slot)
+                        started += 1
+                    except ConversionError as e:
+                        logging.error(f"Converter slot {slot.index} failed to start: {str(e)}")
+                self.use_server = started > 0
             else:
-                email = f"user_{uuid.uuid4().hex[:8]}@temp.mddrc.local"
-    
-    # Check if user exists by email OR IC number
-    existing = await db.users.find_one({
-        "$or": [
-            {"id_number": user_data.id_number},
-            {"email": email}
+                logging.error("❌ unoserver/unoconvert not found; PDF conversion falls back to one-shot soffice")
+            for slot in self.slots:
+                self.idle.put_nowait(slot)
+            if self.use_server:
+                self._health_task = asyncio.create_task(self._health_loop())
+            mode = "warm unoserver" if self.use_server else "one-shot soffice"
+            logging.info(f"✅ Document converter ready: {self.size} {mode} slot(s)")
+    
+    async def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+        for slot in self.slots:
+            await self._terminate(slot)
+        await asyncio.to_thread(shutil.rmtree, self.work_dir, True)
+    
+    def _remove_stale_work_dirs(self):
+        """Profiles left behind by worker processes that no longer exist"""
+        if not self.work_root.is_dir():
+            return
+        for entry in self.work_root.iterdir():
+            if not entry.name.isdigit() or int(entry.name) == os.getpid():
+                continue
+            try:
+                os.kill(int(entry.name), 0)
+            except ProcessLookupError:
+                shutil.rmtree(entry, True)
+            except PermissionError:
+                pass
+    
+    async def convert(self, docx_bytes: bytes) -> bytes:
+        if self.idle is None:
+            await self.start()
+        slot = await self.idle.get()
+        try:
+            if self.use_server:
+                return await self._convert_with_server(slot, docx_bytes)
+            return await self._convert_with_cli(slot, docx_bytes)
+        finally:
+            self.idle.put_nowait(slot)
+    
+    async def _launch(self, slot: ConverterSlot):
+        """Start unoserver for the slot and return once it accepts connections"""
+        slot.port, slot.uno_port = _free_port(), _free_port()
+        slot.process = await asyncio.create_subprocess_exec(
+            *UNOSERVER_COMMAND,
+            "--interface", "127.0.0.1",
+            "--port", str(slot.port),
+            "--uno-port", str(slot.uno_port),
+            "--user-installation", slot.profile_dir.as_uri(),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        # soffice takes a few seconds to come up; a conversion sent before then would fail
+        deadline = time.monotonic() + CONVERTER_START_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            if not slot.alive:
+                raise ConversionError(f"unoserver exited with code {slot.process.returncode}")
+            if await _port_accepts(slot.port):
+                return
+            await asyncio.sleep(0.25)
+        await self._terminate(slot)
+        raise ConversionError(f"unoserver not ready after {CONVERTER_START_TIMEOUT_SECONDS} seconds")
+    
+    async def _terminate(self, slot: ConverterSlot):
+        if not slot.alive:
+            return
+        slot.process.terminate()
+        try:
+            await asyncio.wait_for(slot.process.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            slot.process.kill()
+    
+    async def _restart(self, slot: ConverterSlot):
+        logging.warning(f"Restarting converter slot {slot.index}")
+        await self._terminate(slot)
+        await self._launch(slot)
+    
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(CONVERTER_HEALTH_INTERVAL_SECONDS)
+            # Only idle slots are checked, and they are taken out of the pool while that happens
+            for _ in range(self.idle.qsize()):
+                slot = self.idle.get_nowait()
+                try:
+                    if not slot.alive:
+                        await self._launch(slot)
+                    elif not await _port_accepts(slot.port):
+                        await self._restart(slot)
+                except Exception as e:
+                    logging.error(f"Converter slot {slot.index} failed to start: {str(e)}")
+                finally:
+                    self.idle.put_nowait(slot)
+    
+    async def _run(self, args: List[str], stdin_data: Optional[bytes] = None) -> bytes:
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(stdin_data), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise ConversionError(f"PDF conversion timed out after {self.timeout} seconds")
+        if process.returncode != 0:
+            raise ConversionError(f"LibreOffice conversion failed: {stderr.decode(errors='replace')[:500]}")
+        return stdout
+    
+    async def _convert_with_server(self, slot: ConverterSlot, docx_bytes: bytes) -> bytes:
+        if not slot.alive:
+            await self._launch(slot)
+        args = [
+            "unoconvert", "--host", "127.0.0.1", "--port", str(slot.port),
+            "--convert-to", "pdf", "-", "-"
         ]
-    }, {"_id": 0})
-    
-    if existing:
-        if existing.get('id_number') == user_data.id_number:
-            raise HTTPException(status_code=400, detail="User already exists with this IC number")
-        else:
-            raise HTTPException(status_code=400, detail="User already exists with this email")
-    
-    hashed_pw = hash_password(password)
-    user_obj = User(
-        email=email,  # Now always has a value (auto-generated if needed)
-        full_name=user_data.full_name,
-        id_number=user_data.id_number,
-        role=user_data.role,
-        company_id=user_data.company_id,
-        location=user_data.location
+        try:
+            pdf_bytes = await self._run(args, docx_bytes)
+        except ConversionError:
+            # A hung or crashed soffice fails every later conversion; give the slot a fresh one
+            await self._restart(slot)
+            raise
+        if not pdf_bytes.startswith(b"%PDF"):
+            raise ConversionError("LibreOffice returned an invalid PDF")
+        return pdf_bytes
+    
+    async def _convert_with_cli(self, slot: ConverterSlot, docx_bytes: bytes) -> bytes:
+        job_dir = Path(tempfile.mkdtemp(dir=self.work_dir))
+        try:
+            docx_path = job_dir / "document.docx"
+            await asyncio.to_thread(docx_path.write_bytes, docx_bytes)
+            await self._run([
+                LIBREOFFICE_BINARY,
+                "--headless",
+                f"-env:UserInstallation={slot.profile_dir.as_uri()}",
+                "--convert-to", "pdf",
+                "--outdir", str(job_dir),
+                str(docx_path)
+            ])
+            pdf_path = job_dir / "document.pdf"
+            if not pdf_path.exists():
+                raise ConversionError("PDF file was not created")
+            return await asyncio.to_thread(pdf_path.read_bytes)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, job_dir, True)
+
+
+document_converter = DocumentConverter(LIBREOFFICE_POOL_SIZE, CONVERSION_TIMEOUT_SECONDS)
+
+
+# ============ SESSION EVENTS ============
+# Live feed for the coordinator/trainer session screens. Write handlers call
+# publish_session_event(); subscribers of /sessions/{id}/events get the events pushed over SSE.
+# With a single API worker events are fanned out in-process. With several workers set
+# SESSION_EVENTS_BACKEND=mongo: events are inserted into db.session_events and every worker
+# relays them from a change stream (requires a replica set).
+
+SESSION_EVENTS_BACKEND = os.environ.get('SESSION_EVENTS_BACKEND', 'memory')
+SESSION_EVENTS_HEARTBEAT_SECONDS = 15
+SESSION_EVENTS_QUEUE_SIZE = 256
+
+
+class SessionEventBroker:
+    """In-process pub/sub: one bounded queue per connected subscriber"""
+    
+    def __init__(self):
+        self._subscribers = {}  # session_id -> set of asyncio.Queue
+    
+    def subscribe(self, session_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SESSION_EVENTS_QUEUE_SIZE)
+        self._subscribers.setdefault(session_id, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, session_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(session_id)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                self._subscribers.pop(session_id, None)
+    
+    def deliver(self, event: dict):
+        for queue in list(self._subscribers.get(event["session_id"], ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow client: drop the event rather than block the writer; it can resync via /status
+                logging.warning(f"Dropping session event for slow subscriber on {event['session_id']}")
+
+
+session_event_broker = SessionEventBroker()
+
+
+async def publish_session_event(session_id: str, event_type: str, data: Optional[dict] = None):
+    """Push an event to everyone watching the session. Never fails the calling request."""
+    event = {
+        "id": str(uuid.uuid4()),
+        "session_id": session_id,
+        "type": event_type,
+        "data": data or {},
+        "at": get_malaysia_time().isoformat()
+    }
+    if SESSION_EVENTS_BACKEND != 'mongo':
+        session_event_broker.deliver(event)
+        return
+    try:
+        # Delivered (to this worker too) by watch_session_events
+        await db.session_events.insert_one({**event, "created_at": datetime.now(timezone.utc)})
+    except Exception as e:
+        logging.warning(f"Could not persist session event {event_type}: {str(e)}")
+        session_event_broker.deliver(event)
+
+
+async def watch_session_events():
+    """Relay db.session_events inserts from all workers to this worker's subscribers"""
+    delay = 1
+    while True:
+        try:
+            pipeline = [{"$match": {"operationType": "insert"}}]
+            async with db.session_events.watch(pipeline) as stream:
+                delay = 1
+                async for change in stream:
+                    event = change["fullDocument"]
+                    event.pop("_id", None)
+                    event.pop("created_at", None)
+                    session_event_broker.deliver(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Session event change stream stopped, retrying in {delay}s: {str(e)}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+def format_sse(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+# ============ BACKGROUND JOBS ============
+# Slow work (document rendering, PDF conversion) runs off the request path. A route enqueues a
+# job and returns its id; per-type worker tasks with bounded concurrency claim jobs atomically
+# from db.jobs, retry failures with backoff and record the result for GET /jobs/{job_id}.
+# A claim is a lease: the claiming process stamps its JOB_WORKER_ID and lease_expires_at and keeps
+# extending the lease while the job runs. Every process periodically requeues jobs whose lease ran
+# out (their process died) and queued jobs nobody has picked up, so a restart or a sibling worker
+# never runs a job that is still alive elsewhere. A queued job is not claimed before its
+# available_at (retry backoff), and each process holds a job id at most once in its queue or
+# retry timers. Finished jobs expire after JOB_RETENTION_DAYS.
+
+JOB_RETRY_BASE_SECONDS = 5
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '60'))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+JOB_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobHandler:
+    def __init__(self, func, concurrency: int, max_attempts: int):
+        self.func = func
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.queue: Optional[asyncio.Queue] = None
+        # Ids waiting in queue or on a retry timer in this process
+        self.pending: Set[str] = set()
+
+
+job_handlers: Dict[str, JobHandler] = {}
+job_worker_tasks: List[asyncio.Task] = []
+job_retry_tasks: Set[asyncio.Task] = set()
+
+
+def register_job_handler(job_type: str, func, concurrency: int = 2, max_attempts: int = 3):
+    """func(payload: dict) -> dict result. Raise HTTPException for permanent (non-retried) failures."""
+    job_handlers[job_type] = JobHandler(func, concurrency, max_attempts)
+
+
+def _job_queue(job_type: str) -> asyncio.Queue:
+    handler = job_handlers[job_type]
+    if handler.queue is None:
+        handler.queue = asyncio.Queue()
+    return handler.queue
+
+
+async def _requeue_later(job_type: str, job_id: str, delay: float):
+    await asyncio.sleep(delay)
+    _job_queue(job_type).put_nowait(job_id)
+
+
+def _queue_job(job_type: str, job_id: str, available_at: Optional[datetime] = None):
+    """Hand job_id to this process's workers, once it is available; no-op if it is already held here"""
+    pending = job_handlers[job_type].pending
+    if job_id in pending:
+        return
+    pending.add(job_id)
+    delay = 0
+    if available_at is not None:
+        if available_at.tzinfo is None:
+            available_at = available_at.replace(tzinfo=timezone.utc)
+        delay = (available_at - datetime.now(timezone.utc)).total_seconds()
+    if delay <= 0:
+        _job_queue(job_type).put_nowait(job_id)
+        return
+    retry = asyncio.create_task(_requeue_later(job_type, job_id, delay))
+    job_retry_tasks.add(retry)
+    retry.add_done_callback(job_retry_tasks.discard)
+
+
+async def enqueue_job(job_type: str, payload: dict, created_by: str) -> dict:
+    if job_type not in job_handlers:
+        raise ValueError(f"Unknown job type: {job_type}")
+    now = get_malaysia_time().isoformat()
+    job = {
+        "id": str(uuid.uuid4()),
+        "type": job_type,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": job_handlers[job_type].max_attempts,
+        "result": None,
+        "error": None,
+        "created_by": created_by,
+        "created_at": now,
+        "updated_at": now,
+        "available_at": datetime.now(timezone.utc)
+    }
+    await db.jobs.insert_one(job)
+    job.pop("_id", None)
+    job.pop("available_at")
+    _queue_job(job_type, job["id"])
+    return job
+
+
+def job_response(job: dict) -> dict:
+    """What routes return right after enqueueing"""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/api/jobs/{job['id']}"
+    }
+
+
+def _lease_deadline() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=JOB_LEASE_SECONDS)
+
+
+async def _heartbeat_job(job_id: str):
+    """Keep extending this process's lease on a running job"""
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        await db.jobs.update_one(
+            {"id": job_id, "status": "running", "worker_id": JOB_WORKER_ID},
+            {"$set": {"lease_expires_at": _lease_deadline()}}
+        )
+
+
+async def _finish_job(job_id: str, fields: dict) -> bool:
+    """Record the outcome, unless the lease was lost and the job handed to someone else"""
+    fields = {**fields, "updated_at": get_malaysia_time().isoformat()}
+    if fields["status"] in ("succeeded", "failed"):
+        fields["finished_at"] = datetime.now(timezone.utc)
+    outcome = await db.jobs.update_one(
+        {"id": job_id, "status": "running", "worker_id": JOB_WORKER_ID},
+        {"$set": fields, "$unset": {"worker_id": "", "lease_expires_at": ""}}
     )
-    
-    doc = user_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['password'] = hashed_pw
-    
-    await db.users.insert_one(doc)
-    return user_obj
+    return outcome.modified_count == 1
 
-@api_router.post("/auth/login", response_model=TokenResponse)
-async def login(user_data: UserLogin):
-    # Allow login with email OR IC number
-    # Build query dynamically to handle users without email
-    query_conditions = [{"id_number": user_data.email}]  # Always allow IC as username
-    
-    # Only check email if the input looks like an email (contains @)
-    if "@" in user_data.email:
-        query_conditions.append({"email": user_data.email})
-    
-    user_doc = await db.users.find_one({
-        "$or": query_conditions
-    }, {"_id": 0})
-    if not user_doc:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    
-    # Check for both 'password' and 'hashed_password' field names
-    password_hash = user_doc.get('password') or user_doc.get('hashed_password')
-    if not password_hash:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    
-    if not verify_password(user_data.password, password_hash):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    
-    if not user_doc.get('is_active', True):
-        raise HTTPException(status_code=401, detail="Account is inactive")
-    
-    token = create_access_token({"sub": user_doc['id']})
-    
-    if isinstance(user_doc.get('created_at'), str):
-        user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
+
+async def _run_job(job_type: str, job_id: str):
+    handler = job_handlers[job_type]
+    # Atomic claim: only one worker (in any process) gets to run a queued job, once it is due
+    job = await db.jobs.find_one_and_update(
+        {
+            "id": job_id,
+            "status": "queued",
+            "$or": [{"available_at": {"$lte": datetime.now(timezone.utc)}}, {"available_at": {"$exists": False}}]
+        },
+        {
+            "$set": {
+                "status": "running",
+                "worker_id": JOB_WORKER_ID,
+                "lease_expires_at": _lease_deadline(),
+                "updated_at": get_malaysia_time().isoformat()
+            },
+            "$inc": {"attempts": 1}
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not job:
+        return
     
-    user_doc.pop('password', None)
-    user_doc.pop('hashed_password', None)
-    user = User(**user_doc)
+    heartbeat = asyncio.create_task(_heartbeat_job(job_id))
+    try:
+        result = await handler.func(job["payload"])
+    except HTTPException as e:
+        await _finish_job(job_id, {"status": "failed", "error": e.detail})
+        return
+    except Exception as e:
+        logging.error(f"Job {job_type} {job_id} attempt {job['attempts']} failed: {str(e)}")
+        if job["attempts"] < job["max_attempts"]:
+            delay = JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+            available_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+            requeued = await _finish_job(job_id, {"status": "queued", "error": str(e), "available_at": available_at})
+            if requeued:
+                _queue_job(job_type, job_id, available_at)
+        else:
+            await _finish_job(job_id, {"status": "failed", "error": str(e)})
+        return
+    finally:
+        heartbeat.cancel()
     
-    return TokenResponse(access_token=token, token_type="bearer", user=user)
+    await _finish_job(job_id, {"status": "succeeded", "result": result, "error": None})
 
-@api_router.get("/auth/me", response_model=User)
-async def get_me(current_user: User = Depends(get_current_user)):
-    return current_user
 
-class ForgotPasswordRequest(BaseModel):
-    email: EmailStr
+async def _job_worker(job_type: str):
+    queue = _job_queue(job_type)
+    while True:
+        job_id = await queue.get()
+        job_handlers[job_type].pending.discard(job_id)
+        try:
+            await _run_job(job_type, job_id)
+        except Exception as e:
+            logging.error(f"Job worker {job_type} error on {job_id}: {str(e)}")
+        finally:
+            queue.task_done()
 
-class ResetPasswordRequest(BaseModel):
-    email: EmailStr
-    new_password: str
 
-@api_router.post("/auth/forgot-password")
-async def forgot_password(request: ForgotPasswordRequest):
+async def recover_jobs(include_fresh: bool = False):
     """
-    Simple forgot password endpoint that checks if user exists
-    In production, this would send an email with reset link
+    Requeue running jobs whose lease expired (their process died) and pick up queued jobs that are
+    overdue, i.e. whose retry timer or enqueueing process is gone. include_fresh takes every queued
+    job, as on startup, each queued for its available_at so retry backoff survives a restart. Claims
+    stay atomic, so a job queued in several processes still runs once.
     """
-    user_doc = await db.users.find_one({"email": request.email}, {"_id": 0})
-    
-    # Always return success to prevent email enumeration
-    if not user_doc:
-        return {"message": "If an account exists with this email, password reset instructions have been sent"}
+    now = datetime.now(timezone.utc)
+    expired = db.jobs.find(
+        {"status": "running", "$or": [{"lease_expires_at": {"$lt": now}}, {"lease_expires_at": {"$exists": False}}]},
+        {"_id": 0, "id": 1, "lease_expires_at": 1}
+    )
+    async for job in expired:
+        # Only the lease that was seen expiring is taken over, so a fresh heartbeat wins the race
+        await db.jobs.update_one(
+            {"id": job["id"], "status": "running", "lease_expires_at": job.get("lease_expires_at")},
+            {"$set": {"status": "queued", "available_at": now, "updated_at": get_malaysia_time().isoformat()},
+             "$unset": {"worker_id": "", "lease_expires_at": ""}}
+        )
     
-    # For MVP: Return success message
-    # In production: Generate token, send email with reset link
-    return {"message": "If an account exists with this email, password reset instructions have been sent"}
+    queued = {"status": "queued"}
+    if not include_fresh:
+        overdue = now - timedelta(seconds=JOB_LEASE_SECONDS)
+        queued["$or"] = [{"available_at": {"$lt": overdue}}, {"available_at": {"$exists": False}}]
+    async for job in db.jobs.find(queued, {"_id": 0, "id": 1, "type": 1, "available_at": 1}):
+        if job["type"] in job_handlers:
+            _queue_job(job["type"], job["id"], job.get("available_at"))
 
-class ChangePasswordRequest(BaseModel):
-    current_password: str
-    new_password: str
 
-@api_router.post("/auth/change-password")
-async def change_password(request: ChangePasswordRequest, current_user: User = Depends(get_current_user)):
-    """
-    Change password for logged-in user
-    """
-    # Verify current password
-    user_doc = await db.users.find_one({"id": current_user.id}, {"_id": 0})
-    if not user_doc:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if not verify_password(request.current_password, user_doc["password"]):
-        raise HTTPException(status_code=400, detail="Current password is incorrect")
+async def _job_recovery_loop():
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS)
+        try:
+            await recover_jobs()
+        except Exception as e:
+            logging.error(f"Job recovery failed: {str(e)}")
+
+
+async def start_job_workers():
+    for job_type, handler in job_handlers.items():
+        for _ in range(handler.concurrency):
+            job_worker_tasks.append(asyncio.create_task(_job_worker(job_type)))
     
-    # Minimum password length
-    if len(request.new_password) < 6:
-        raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
+    await recover_jobs(include_fresh=True)
+    job_worker_tasks.append(asyncio.create_task(_job_recovery_loop()))
+
+
+# ============ ATTENDANCE STORE ============
+# Single home for attendance. Every row lives in db.attendance, one per participant per
+# session per day (unique index), and carries both the participant's own clock-in/out
+# times and the coordinator's explicit present/absent mark for that day.
+
+ATTENDANCE_STATUSES = ["present", "absent"]
+
+# Supervisors poll their attendance screen all day; rows only change on clock-in/out or marks,
+# and every write below drops the session's entry.
+supervisor_attendance_cache = TTLCache(maxsize=512, ttl=30)
+
+
+def invalidate_attendance_cache(session_id: str):
+    supervisor_attendance_cache.pop(session_id, None)
+
+
+async def get_participant_map(participant_ids: List[str], fields: tuple = ("full_name", "email")) -> Dict[str, dict]:
+    """id -> {id, <fields>} for the given participants, in one query"""
+    if not participant_ids:
+        return {}
+    participants = await db.users.find(
+        {"id": {"$in": list(participant_ids)}},
+        {"_id": 0, "id": 1, **{field: 1 for field in fields}}
+    ).to_list(None)
+    return {p['id']: p for p in participants}
+
+
+def _attendance_key(participant_id: str, session_id: str, date: str) -> dict:
+    return {"participant_id": participant_id, "session_id": session_id, "date": date}
+
+
+def _attendance_insert_defaults(participant_id: str, session_id: str, date: str) -> dict:
+    """Fields for a brand-new row; never overwrite data already on an existing row"""
+    row = Attendance(participant_id=participant_id, session_id=session_id, date=date)
+    return {"id": row.id, "created_at": row.created_at.isoformat()}
+
+
+async def attendance_clock_in(participant_id: str, session_id: str) -> str:
+    """Record today's clock-in. Returns the time, raises 400 if already clocked in."""
+    today = get_malaysia_date().isoformat()
+    now = get_malaysia_time_str()
     
-    # Hash and update new password
-    hashed_password = hash_password(request.new_password)
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$set": {"password": hashed_password}}
+    # Single atomic upsert: only matches today's row if it has no clock_in yet. If the row
+    # already has one, the upsert collides with the unique (participant, session, date) index.
+    defaults = _attendance_insert_defaults(participant_id, session_id, today)
+    defaults["clock_out"] = None
+    try:
+        await db.attendance.find_one_and_update(
+            {**_attendance_key(participant_id, session_id, today), "clock_in": None},
+            {"$set": {"clock_in": now}, "$setOnInsert": defaults},
+            upsert=True,
+            projection={"_id": 0, "id": 1}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Already clocked in today")
+    invalidate_attendance_cache(session_id)
+    await publish_session_event(session_id, "clock_in", {"participant_id": participant_id, "time": now})
+    return now
+
+
+async def attendance_clock_out(participant_id: str, session_id: str) -> str:
+    """Record today's clock-out. Returns the time, raises 400 if not clocked in or already out."""
+    today = get_malaysia_date().isoformat()
+    now = get_malaysia_time_str()
+    key = _attendance_key(participant_id, session_id, today)
+    
+    # Only matches when clocked in and not yet clocked out
+    updated = await db.attendance.find_one_and_update(
+        {**key, "clock_in": {"$ne": None}, "clock_out": None},
+        {"$set": {"clock_out": now}},
+        projection={"_id": 0, "id": 1},
+        return_document=ReturnDocument.AFTER
     )
     
-    return {"message": "Password changed successfully"}
+    if not updated:
+        # Slow path only on failure: work out which precondition was not met
+        existing = await db.attendance.find_one(key, {"_id": 0, "clock_in": 1, "clock_out": 1})
+        if not existing or not existing.get('clock_in'):
+            raise HTTPException(status_code=400, detail="Please clock in first")
+        raise HTTPException(status_code=400, detail="Already clocked out today")
+    invalidate_attendance_cache(session_id)
+    await publish_session_event(session_id, "clock_out", {"participant_id": participant_id, "time": now})
+    return now
 
-@api_router.post("/auth/reset-password")
-async def reset_password(request: ResetPasswordRequest):
+
+async def _bulk_upsert(collection, operations: List[UpdateOne]) -> Dict[int, str]:
     """
-    Reset password for a user
-    In production, this would require a valid reset token from email
-    For MVP: Allow direct reset with email verification
+    Unordered bulk write of upserts on a unique key; returns {operation index: error} for the rows
+    that failed. A duplicate-key error means a concurrent upsert (e.g. a clock-in) inserted the same
+    row first, so those operations are retried once and now update that row.
+    """
+    try:
+        await collection.bulk_write(operations, ordered=False)
+        return {}
+    except BulkWriteError as e:
+        errors = {err["index"]: err for err in e.details.get("writeErrors", [])}
+    
+    retry = [i for i, err in errors.items() if err.get("code") == 11000]
+    if retry:
+        try:
+            await collection.bulk_write([operations[i] for i in retry], ordered=False)
+            still_failing = set()
+        except BulkWriteError as e:
+            still_failing = {retry[err["index"]] for err in e.details.get("writeErrors", [])}
+        for i in retry:
+            if i not in still_failing:
+                errors.pop(i)
+    return {i: err.get("errmsg", "Write failed") for i, err in errors.items()}
+
+
+async def attendance_mark_status(
+    session_id: str,
+    marks: List[tuple],
+    marked_by: str,
+    date: Optional[str] = None
+) -> Dict[int, str]:
+    """
+    Write coordinator present/absent marks ((participant_id, status) pairs) onto the day's rows.
+    Returns {index into marks: error} for marks that could not be saved.
+    """
+    if not marks:
+        return {}
+    date = date or get_malaysia_date().isoformat()
+    marked_at = get_malaysia_time().isoformat()
+    operations = []
+    for participant_id, status in marks:
+        defaults = _attendance_insert_defaults(participant_id, session_id, date)
+        defaults.update({"clock_in": None, "clock_out": None})
+        operations.append(UpdateOne(
+            _attendance_key(participant_id, session_id, date),
+            {
+                "$set": {"status": status, "marked_by": marked_by, "marked_at": marked_at},
+                "$setOnInsert": defaults
+            },
+            upsert=True
+        ))
+    failed = await _bulk_upsert(db.attendance, operations)
+    written = [mark for i, mark in enumerate(marks) if i not in failed]
+    if not written:
+        return failed
+    invalidate_attendance_cache(session_id)
+    await publish_session_event(session_id, "attendance_marked", {
+        "date": date,
+        "marks": [{"participant_id": pid, "status": status} for pid, status in written]
+    })
+    return failed
+
+
+async def get_attendance_rows(session_id: str, participant_id: Optional[str] = None) -> List[dict]:
+    """Raw per-day rows for a session (optionally one participant), oldest day first"""
+    query = {"session_id": session_id}
+    if participant_id:
+        query["participant_id"] = participant_id
+    return await db.attendance.find(query, {"_id": 0}).sort("date", 1).to_list(1000)
+
+
+async def get_attendance_summary(session_id: str, participant_ids: Optional[List[str]] = None) -> Dict[str, dict]:
+    """
+    Per-participant roll-up for a session, keyed by participant_id.
+    status is the latest explicit coordinator mark, otherwise "present" once the participant
+    has clocked in on any day; participants with no rows at all are omitted.
+    """
+    match = {"session_id": session_id}
+    if participant_ids is not None:
+        match["participant_id"] = {"$in": participant_ids}
+    
+    # $gt null is true for any real value and false for both null and a missing field
+    has_clock_in = {"$gt": ["$clock_in", None]}
+    has_clock_out = {"$gt": ["$clock_out", None]}
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"date": 1}},
+        {"$group": {
+            "_id": "$participant_id",
+            "days_present": {"$sum": {"$cond": [has_clock_in, 1, 0]}},
+            "days_clocked_out": {"$sum": {"$cond": [has_clock_out, 1, 0]}},
+            "marks": {"$push": {"date": "$date", "status": "$status"}},
+            "first_date": {"$first": "$date"},
+            "last_date": {"$last": "$date"}
+        }}
+    ]
+    
+    summary = {}
+    async for row in db.attendance.aggregate(pipeline):
+        explicit = [m["status"] for m in row["marks"] if m.get("status")]
+        if explicit:
+            status = explicit[-1]
+        else:
+            status = "present" if row["days_present"] else None
+        summary[row["_id"]] = {
+            "status": status,
+            "days_present": row["days_present"],
+            "clocked_in": row["days_present"] > 0,
+            "clocked_out": row["days_clocked_out"] > 0,
+            "first_date": row["first_date"],
+            "last_date": row["last_date"]
+        }
+    return summary
+
+
+async def has_clocked_out(participant_id: str, session_id: str) -> bool:
+    """True once the participant has clocked out on any day of the session"""
+    row = await db.attendance.find_one(
+        {"participant_id": participant_id, "session_id": session_id, "clock_out": {"$ne": None}},
+        {"_id": 0, "id": 1}
+    )
+    return bool(row)
+
+
+ATTENDANCE_MATRIX_MAX_DAYS = 62
+
+
+def _session_days(start_date: Optional[str], end_date: Optional[str]) -> List[str]:
+    """ISO dates from start to end inclusive; empty when the session dates are missing or invalid"""
+    try:
+        start = datetime.fromisoformat(str(start_date)[:10]).date()
+        end = datetime.fromisoformat(str(end_date)[:10]).date()
+    except (TypeError, ValueError):
+        return []
+    span = min((end - start).days, ATTENDANCE_MATRIX_MAX_DAYS - 1)
+    return [(start + timedelta(days=i)).isoformat() for i in range(span + 1)]
+
+
+async def build_attendance_matrix(session: dict) -> dict:
+    """
+    Participants x days presence grid for a session.
+    Each participant's presence is a string of "0"/"1" parallel to days (a string rather than an
+    integer bitset, which JavaScript cannot hold beyond 53 days), with clock_in/clock_out arrays
+    alongside. A day counts as present when the participant clocked in or was marked present,
+    unless the coordinator marked them absent. At most ATTENDANCE_MATRIX_MAX_DAYS days are returned,
+    session days first, then days of any out-of-range rows.
+    """
+    session_id = session["id"]
+    rows = await db.attendance.find(
+        {"session_id": session_id},
+        {"_id": 0, "participant_id": 1, "date": 1, "clock_in": 1, "clock_out": 1, "status": 1}
+    ).to_list(None)
+    
+    days = _session_days(session.get("start_date"), session.get("end_date"))
+    extra_days = {r["date"] for r in rows if r.get("date")} - set(days)
+    if extra_days:
+        days = sorted(days + sorted(extra_days)[:ATTENDANCE_MATRIX_MAX_DAYS - len(days)])
+    day_index = {day: i for i, day in enumerate(days)}
+    
+    participant_ids = list(session.get("participant_ids", []))
+    known = set(participant_ids)
+    for r in rows:
+        if r["participant_id"] not in known:
+            known.add(r["participant_id"])
+            participant_ids.append(r["participant_id"])
+    
+    names = {pid: u.get("full_name", "Unknown") for pid, u in (await get_participant_map(participant_ids)).items()}
+    
+    grid = {
+        pid: {"presence": [False] * len(days), "clock_in": [None] * len(days), "clock_out": [None] * len(days)}
+        for pid in participant_ids
+    }
+    for r in rows:
+        i = day_index.get(r.get("date"))
+        if i is None:
+            continue
+        cell = grid[r["participant_id"]]
+        cell["clock_in"][i] = r.get("clock_in")
+        cell["clock_out"][i] = r.get("clock_out")
+        status = r.get("status")
+        if status != "absent" and (r.get("clock_in") or status == "present"):
+            cell["presence"][i] = True
+    
+    daily_totals = [0] * len(days)
+    participants = []
+    for pid in participant_ids:
+        cell = grid[pid]
+        for i, present in enumerate(cell["presence"]):
+            if present:
+                daily_totals[i] += 1
+        participants.append({
+            "participant_id": pid,
+            "participant_name": names.get(pid, f"Participant {pid}"),
+            "presence": "".join("1" if present else "0" for present in cell["presence"]),
+            "days_present": sum(cell["presence"]),
+            "clock_in": cell["clock_in"],
+            "clock_out": cell["clock_out"]
+        })
+    
+    return {
+        "session_id": session_id,
+        "days": days,
+        "daily_totals": daily_totals,
+        "participants": participants
+    }
+
+
+async def merge_duplicate_attendance_rows() -> int:
+    """
+    Collapse duplicate (participant, session, date) rows into one; returns the number removed.
+    The kept row gets the earliest clock-in, the latest clock-out and the latest coordinator mark.
+    """
+    merged_duplicates = 0
+    duplicates = db.attendance.aggregate([
+        {"$group": {
+            "_id": {"participant_id": "$participant_id", "session_id": "$session_id", "date": "$date"},
+            "ids": {"$push": "$_id"},
+            "clock_in": {"$min": "$clock_in"},
+            "clock_out": {"$max": "$clock_out"},
+            "marks": {"$push": {"status": "$status", "marked_by": "$marked_by", "marked_at": "$marked_at"}},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+    async for dup in duplicates:
+        keep_id, *drop_ids = dup["ids"]
+        merged = {"clock_in": dup.get("clock_in"), "clock_out": dup.get("clock_out")}
+        marks = [mark for mark in dup["marks"] if mark.get("status")]
+        if marks:
+            latest = max(marks, key=lambda mark: str(mark.get("marked_at") or ""))
+            merged.update({"status": latest["status"], "marked_by": latest.get("marked_by"), "marked_at": latest.get("marked_at")})
+        await db.attendance.update_one({"_id": keep_id}, {"$set": merged})
+        await db.attendance.delete_many({"_id": {"$in": drop_ids}})
+        merged_duplicates += len(drop_ids)
+    return merged_duplicates
+
+
+async def migrate_attendance_collections():
+    """
+    One-time merge of the legacy attendance collections into db.attendance:
+    - collapses duplicate (participant, session, date) rows so the unique index can be built
+    - folds db.participant_attendance marks onto the day they were marked
+    - folds db.attendance_records clock times, never overwriting existing canonical rows
+    Legacy collections are left untouched. Completion is recorded in db.migrations.
+    """
+    migration_id = "attendance_unified_v1"
+    if await db.migrations.find_one({"id": migration_id}, {"_id": 0, "id": 1}):
+        return
+    
+    merged_duplicates = await merge_duplicate_attendance_rows()
+    
+    operations = []
+    async for mark in db.participant_attendance.find({}, {"_id": 0}):
+        if not mark.get("session_id") or not mark.get("participant_id") or not mark.get("status"):
+            continue
+        marked_at = mark.get("marked_at") or get_malaysia_time().isoformat()
+        date = str(marked_at)[:10]
+        defaults = _attendance_insert_defaults(mark["participant_id"], mark["session_id"], date)
+        defaults.update({"clock_in": None, "clock_out": None})
+        operations.append(UpdateOne(
+            _attendance_key(mark["participant_id"], mark["session_id"], date),
+            {
+                "$set": {"status": mark["status"], "marked_by": mark.get("marked_by"), "marked_at": marked_at},
+                "$setOnInsert": defaults
+            },
+            upsert=True
+        ))
+    
+    async for record in db.attendance_records.find({}, {"_id": 0}):
+        if not record.get("session_id") or not record.get("participant_id"):
+            continue
+        date = record.get("date") or str(record.get("created_at") or get_malaysia_time().isoformat())[:10]
+        defaults = _attendance_insert_defaults(record["participant_id"], record["session_id"], str(date))
+        defaults.update({
+            "clock_in": record.get("clock_in") or record.get("clock_in_time"),
+            "clock_out": record.get("clock_out") or record.get("clock_out_time")
+        })
+        operations.append(UpdateOne(
+            _attendance_key(record["participant_id"], record["session_id"], str(date)),
+            {"$setOnInsert": defaults},
+            upsert=True
+        ))
+    
+    if operations:
+        await db.attendance.bulk_write(operations, ordered=False)
+    
+    await db.migrations.insert_one({
+        "id": migration_id,
+        "merged_duplicates": merged_duplicates,
+        "legacy_rows_merged": len(operations),
+        "completed_at": get_malaysia_time().isoformat()
+    })
+    logging.info(f"✅ Attendance unified: {merged_duplicates} duplicate rows merged, {len(operations)} legacy rows folded in")
+
+
+# Training Report Models
+class TrainingReport(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    session_id: str
+    program_id: str
+    company_id: str
+    generated_by: str  # coordinator_id
+    content: str  # Markdown content
+    status: str  # "draft" or "published"
+    created_at: datetime = Field(default_factory=get_malaysia_time)
+    published_at: Optional[datetime] = None
+    published_to_supervisors: List[str] = []  # List of supervisor IDs
+
+class ReportGenerateRequest(BaseModel):
+    session_id: str
+
+class ReportUpdateRequest(BaseModel):
+    content: str
+
+# ============ IMAGE VARIANTS ============
+# Phone photos are decoded once and stored as downscaled JPEG variants named by the hash of
+# the original bytes, so the same photo is never processed twice and variant files can be
+# cached forever. Sources are checklist photo URLs or the data: URLs training reports store.
+
+CHECKLIST_PHOTO_VARIANTS_DIR = CHECKLIST_PHOTOS_DIR / "variants"
+CHECKLIST_PHOTO_VARIANTS_DIR.mkdir(exist_ok=True)
+
+IMAGE_VARIANT_WIDTHS = {"thumbnail": 160, "medium": 400, "report": 800}
+IMAGE_VARIANT_QUALITY = 80
+WEBP_SUPPORTED = PIL_features.check("webp")
+CHECKLIST_PHOTO_URL_PREFIX = "/api/static/checklist-photos/"
+
+# Upload filenames are UUIDs and variant filenames are content hashes: neither ever changes
+IMMUTABLE_CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+# (filename, mtime, size) -> content hash, so unchanged files are not re-read just to hash them
+image_source_hashes = TTLCache(maxsize=4096, ttl=3600)
+# content hash -> variant info, so serving ?w= does not reopen variant files
+image_variant_info = TTLCache(maxsize=4096, ttl=3600)
+
+
+def _read_image_source(source: str) -> Optional[tuple]:
+    """(cache key, bytes loader) for a photo reference, or None if it is not one we can read"""
+    if source.startswith("data:image/") and ";base64," in source:
+        data = base64.b64decode(source.split(";base64,", 1)[1])
+        return hashlib.sha256(data).hexdigest(), lambda: data
+    
+    if source.startswith(CHECKLIST_PHOTO_URL_PREFIX):
+        filename = source[len(CHECKLIST_PHOTO_URL_PREFIX):].split("?")[0]
+        file_path = CHECKLIST_PHOTOS_DIR / filename
+        if Path(filename).name != filename or not file_path.is_file():
+            return None
+        stat = file_path.stat()
+        key = (filename, stat.st_mtime_ns, stat.st_size)
+        digest = image_source_hashes.get(key)
+        if digest is None:
+            digest = hashlib.sha256(file_path.read_bytes()).hexdigest()
+            image_source_hashes[key] = digest
+        return digest, file_path.read_bytes
+    return None
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def _save_image_variant(image, path: Path, image_format: str):
+    buffer = io.BytesIO()
+    if image_format == "WEBP":
+        image.save(buffer, "WEBP", quality=IMAGE_VARIANT_QUALITY, method=4)
+    else:
+        image.save(buffer, "JPEG", quality=IMAGE_VARIANT_QUALITY, optimize=True, progressive=True)
+    _write_atomic(path, buffer.getvalue())
+
+
+def ensure_image_variants(source: str) -> Optional[dict]:
+    """Create any missing variants of a photo; blocking, so call it via asyncio.to_thread.
+    
+    Returns {"hash", "variants": {name: {"filename", "webp_filename", "width", "height"}}} or
+    None when the source is missing or not a decodable image. webp_filename is None when
+    Pillow was built without WebP.
+    """
+    try:
+        resolved = _read_image_source(source)
+        if not resolved:
+            return None
+        digest, load = resolved
+        
+        cached = image_variant_info.get(digest)
+        if cached and all(image_variant_path(v["filename"]).exists() for v in cached["variants"].values()):
+            return cached
+        
+        variants = {}
+        image = None
+        for name, width in IMAGE_VARIANT_WIDTHS.items():
+            filename = f"{digest[:32]}_{width}.jpg"
+            webp_filename = f"{digest[:32]}_{width}.webp" if WEBP_SUPPORTED else None
+            path = image_variant_path(filename)
+            if not path.exists() or (webp_filename and not image_variant_path(webp_filename).exists()):
+                if image is None:
+                    image = ImageOps.exif_transpose(Image.open(io.BytesIO(load()))).convert("RGB")
+                variant = image.copy()
+                variant.thumbnail((width, width * 10), Image.LANCZOS)
+                _save_image_variant(variant, path, "JPEG")
+                if webp_filename:
+                    _save_image_variant(variant, image_variant_path(webp_filename), "WEBP")
+                size = variant.size
+            else:
+                with Image.open(path) as existing:
+                    size = existing.size
+            variants[name] = {"filename": filename, "webp_filename": webp_filename, "width": size[0], "height": size[1]}
+        
+        info = {"hash": digest, "variants": variants}
+        image_variant_info[digest] = info
+        return info
+    except Exception as e:
+        logging.warning(f"Could not create image variants: {str(e)}")
+        return None
+
+
+def pick_image_variant(info: dict, width: int) -> dict:
+    """Smallest variant at least `width` pixels wide, else the largest one"""
+    variants = sorted(info["variants"].values(), key=lambda v: v["width"])
+    for variant in variants:
+        if variant["width"] >= width:
+            return variant
+    return variants[-1]
+
+
+async def get_image_variants(sources: List[str]) -> Dict[str, dict]:
+    """source -> variant info for every usable photo in sources, processed concurrently"""
+    unique = [s for s in dict.fromkeys(sources) if s]
+    results = await asyncio.gather(*(asyncio.to_thread(ensure_image_variants, s) for s in unique))
+    return {source: info for source, info in zip(unique, results) if info}
+
+
+def image_variant_path(filename: str) -> Path:
+    return CHECKLIST_PHOTO_VARIANTS_DIR / filename
+
+
+def image_variant_url(filename: str) -> str:
+    return f"{CHECKLIST_PHOTO_URL_PREFIX}variants/{filename}"
+
+
+# ============ STATIC FILES ============
+# static_file_response() serves a file from STATIC_DIR with a strong ETag (mtime + size), answers
+# If-None-Match with 304 and a single-range Range header with 206. Files named by a UUID or a
+# content hash never change, so browsers may keep them for a year; everything else (the logo,
+# templates, regenerated certificates) is revalidated against the ETag on each use.
+# The body goes out through FileResponse, which hands the path to the server (ASGI pathsend,
+# i.e. sendfile) when the server supports it. Behind nginx, set STATIC_ACCEL_REDIRECT_PREFIX to
+# an internal location aliased to STATIC_DIR and nginx sends the file itself via X-Accel-Redirect.
+
+STATIC_ACCEL_REDIRECT_PREFIX = os.environ.get('STATIC_ACCEL_REDIRECT_PREFIX', '')
+STATIC_RANGE_CHUNK = 256 * 1024
+IMMUTABLE_NAME_PATTERN = re.compile(
+    r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{32,64}(_\d+)?)\.[a-z0-9]+$"
+)
+REVALIDATE_CACHE_HEADERS = {"Cache-Control": "no-cache"}
+
+
+def static_file_path(directory: Path, filename: str, not_found: str = "File not found") -> Path:
+    """directory/filename; HTTP 404 unless filename is a plain, visible file directly in directory"""
+    file_path = directory / filename
+    if Path(filename).name != filename or filename.startswith(".") or not file_path.is_file():
+        raise HTTPException(status_code=404, detail=not_found)
+    return file_path
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for it)"""
+    if header.strip() == "*":
+        return True
+    return etag.strip('"') in {tag.strip().removeprefix("W/").strip('"') for tag in header.split(",")}
+
+
+def _parse_range(header: str, size: int) -> Optional[tuple]:
+    """Inclusive (first, last) for a single "bytes=" range; None means ignore it and send everything"""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if not start:
+            suffix = int(end)
+            return (max(size - suffix, 0) if suffix > 0 else size), size - 1
+        return int(start), (min(int(end), size - 1) if end else size - 1)
+    except ValueError:
+        return None
+
+
+def _read_file_range(path: Path, first: int, last: int):
+    with open(path, "rb") as source:
+        source.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = source.read(min(STATIC_RANGE_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def static_file_response(
+    path: Path,
+    request: Request,
+    media_type: Optional[str] = None,
+    immutable: Optional[bool] = None,
+    headers: Optional[dict] = None,
+    etag: Optional[str] = None
+) -> Response:
+    """Conditional, range-aware response for a file under STATIC_DIR.
+    
+    immutable defaults to whether the file name is a UUID or content hash; etag defaults to one
+    built from mtime and size (pass a content hash when there is one).
+    """
+    stat = await asyncio.to_thread(path.stat)
+    media_type = media_type or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    if immutable is None:
+        immutable = bool(IMMUTABLE_NAME_PATTERN.match(path.name))
+    etag = etag or f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        **(IMMUTABLE_CACHE_HEADERS if immutable else REVALIDATE_CACHE_HEADERS),
+        **(headers or {}),
+        "ETag": etag,
+        "Accept-Ranges": "bytes"
+    }
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    if STATIC_ACCEL_REDIRECT_PREFIX:
+        # nginx serves the body (and any Range) from its internal location
+        headers["X-Accel-Redirect"] = STATIC_ACCEL_REDIRECT_PREFIX + quote(path.relative_to(STATIC_DIR).as_posix())
+        return Response(media_type=media_type, headers=headers)
+    
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, stat.st_size)
+        if byte_range:
+            first, last = byte_range
+            if first >= stat.st_size or last < first:
+                return Response(status_code=416, headers={"Content-Range": f"bytes */{stat.st_size}"})
+            headers.update({"Content-Range": f"bytes {first}-{last}/{stat.st_size}", "Content-Length": str(last - first + 1)})
+            return StreamingResponse(_read_file_range(path, first, last), status_code=206, media_type=media_type, headers=headers)
+    
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
+
+
+# ============ UPLOADS ============
+# Every upload goes through save_upload: the body is read in chunks, the size cap is enforced
+# as bytes arrive, the type is checked against the file's magic bytes (not its name or the
+# client's content type), a SHA-256 is computed on the way through, and the file only appears
+# at its final path once it is complete (temp file + rename). Disk writes run in a thread.
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# kind -> (extension, matcher on the first bytes of the file)
+UPLOAD_KINDS = {
+    "pdf": ("pdf", lambda head: head.startswith(b"%PDF-")),
+    "docx": ("docx", lambda head: head.startswith(b"PK\x03\x04")),
+    "jpeg": ("jpg", lambda head: head.startswith(b"\xff\xd8\xff")),
+    "png": ("png", lambda head: head.startswith(b"\x89PNG\r\n\x1a\n")),
+    "gif": ("gif", lambda head: head[:6] in (b"GIF87a", b"GIF89a")),
+    "webp": ("webp", lambda head: head[:4] == b"RIFF" and head[8:12] == b"WEBP"),
+}
+# No HEIC: nothing here decodes it (variants, DOCX embedding) and most browsers cannot show it
+IMAGE_UPLOAD_KINDS = ("jpeg", "png", "gif", "webp")
+
+MB = 1024 * 1024
+CHECKLIST_PHOTO_MAX_BYTES = 15 * MB
+LOGO_MAX_BYTES = 5 * MB
+TEMPLATE_MAX_BYTES = 10 * MB
+REPORT_UPLOAD_MAX_BYTES = 20 * MB
+
+
+def detect_upload_kind(head: bytes) -> Optional[str]:
+    for kind, (_, matches) in UPLOAD_KINDS.items():
+        if matches(head):
+            return kind
+    return None
+
+
+def upload_extension(kind: str) -> str:
+    return UPLOAD_KINDS[kind][0]
+
+
+async def save_upload(file: UploadFile, directory: Path, stem: str, allowed_kinds: tuple, max_bytes: int) -> dict:
+    """Stream an upload to directory/<stem>.<ext of detected type>.
+    
+    Returns {"filename", "path", "kind", "size", "sha256"}.
+    
+    Raises HTTPException 400 for oversize, empty or wrong-type files, leaving nothing on disk.
+    """
+    size_error = HTTPException(
+        status_code=400,
+        detail=f"File size exceeds maximum allowed size of {max_bytes / MB:g}MB"
+    )
+    # Starlette knows the size of the spooled part; skip reading it at all when it is too big
+    if file.size is not None and file.size > max_bytes:
+        raise size_error
+    
+    tmp_path = directory / f".{stem}.{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
+    kind = None
+    handle = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if kind is None:
+                kind = detect_upload_kind(chunk[:16])
+                if kind not in allowed_kinds:
+                    allowed = ", ".join(upload_extension(k).upper() for k in allowed_kinds)
+                    raise HTTPException(status_code=400, detail=f"File content is not a valid {allowed} file")
+            size += len(chunk)
+            if size > max_bytes:
+                raise size_error
+            digest.update(chunk)
+            await asyncio.to_thread(handle.write, chunk)
+    
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Uploaded file is empty")
+        await asyncio.to_thread(handle.close)
+        filename = f"{stem}.{upload_extension(kind)}"
+        await asyncio.to_thread(os.replace, tmp_path, directory / filename)
+    except BaseException:
+        handle.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    
+    return {"filename": filename, "path": directory / filename, "kind": kind, "size": size, "sha256": digest.hexdigest()}
+
+
+# ============ BLOB STORE ============
+# Generated and uploaded documents (training reports, certificates) are stored once per distinct
+# content under the key "<sha256>.<ext>": regenerating an unchanged document writes nothing, and
+# identical uploads share one copy. Mongo documents reference blobs by key or by blob_url(), and
+# collect_garbage() deletes blobs nothing references any more, together with leftover temp files
+# and superseded files from before the blob store. BLOB_STORE_BACKEND=s3 keeps blobs in an
+# S3-compatible bucket (AWS, MinIO, ...) so every worker and host sees the same files.
+
+BLOB_STORE_BACKEND = os.environ.get('BLOB_STORE_BACKEND', 'local')
+BLOB_DIR = STATIC_DIR / "blobs"
+BLOB_URL_PREFIX = "/api/blobs/"
+BLOB_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]{1,8}$")
+BLOB_READ_CHUNK = 256 * 1024
+# Nothing younger than this is collected, so a blob whose Mongo reference is still being written is safe
+BLOB_GC_GRACE_HOURS = float(os.environ.get('BLOB_GC_GRACE_HOURS', '24'))
+# 0 disables the periodic sweep (POST /maintenance/storage-gc still works)
+BLOB_GC_INTERVAL_HOURS = float(os.environ.get('BLOB_GC_INTERVAL_HOURS', '24'))
+UPLOAD_STAGING_DIR = STATIC_DIR / "uploads_tmp"
+UPLOAD_STAGING_DIR.mkdir(exist_ok=True)
+
+BLOB_CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+
+class LocalBlobStore:
+    """Files under root; blob keys are sharded into root/<first two hex chars>/<key>"""
+    
+    def __init__(self, root: Path, sharded: bool = True):
+        self.root = root
+        self.sharded = sharded
+        self.root.mkdir(exist_ok=True)
+    
+    def local_path(self, key: str) -> Path:
+        return self.root / key[:2] / key if self.sharded else self.root / key
+    
+    def exists(self, key: str) -> bool:
+        return self.local_path(key).is_file()
+    
+    def stat(self, key: str) -> Optional[tuple]:
+        """(size, modified timestamp), or None if there is no such file"""
+        try:
+            stat = self.local_path(key).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime
+    
+    def put_bytes(self, key: str, data: bytes, content_type: str):
+        path = self.local_path(key)
+        path.parent.mkdir(exist_ok=True)
+        _write_atomic(path, data)
+    
+    def put_file(self, key: str, source: Path, content_type: str):
+        """Move source (on the same filesystem as root) into the store"""
+        path = self.local_path(key)
+        path.parent.mkdir(exist_ok=True)
+        os.replace(source, path)
+    
+    def open_chunks(self, key: str):
+        """Iterator over the file's bytes; raises FileNotFoundError up front if it is missing"""
+        source = open(self.local_path(key), "rb")
+    
+        def chunks():
+            with source:
+                while True:
+                    chunk = source.read(BLOB_READ_CHUNK)
+                    if not chunk:
+                        break
+                    yield chunk
+        return chunks()
+    
+    def delete(self, key: str):
+        self.local_path(key).unlink(missing_ok=True)
+
+
+class S3BlobStore:
+    """Objects under prefix in an S3-compatible bucket; credentials come from the usual AWS_* env vars"""
+    
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None):
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+        self.bucket = bucket
+        self.prefix = prefix
+    
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+    
+    def local_path(self, key: str) -> Optional[Path]:
+        return None
+    
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+    
+    def stat(self, key: str) -> Optional[tuple]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return head["ContentLength"], head["LastModified"].timestamp()
+    
+    def put_bytes(self, key: str, data: bytes, content_type: str):
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data, ContentType=content_type)
+    
+    def put_file(self, key: str, source: Path, content_type: str):
+        self.client.upload_file(str(source), self.bucket, self._object_key(key), ExtraArgs={"ContentType": content_type})
+        source.unlink(missing_ok=True)
+    
+    def open_chunks(self, key: str):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(key)
+            raise
+        return response["Body"].iter_chunks(BLOB_READ_CHUNK)
+    
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+if BLOB_STORE_BACKEND == 's3':
+    blob_store = S3BlobStore(
+        os.environ['BLOB_S3_BUCKET'],
+        os.environ.get('BLOB_S3_PREFIX', 'blobs/'),
+        os.environ.get('BLOB_S3_ENDPOINT_URL')
+    )
+else:
+    blob_store = LocalBlobStore(BLOB_DIR)
+
+# Reports and certificates written before the blob store, addressed by their path under STATIC_DIR
+legacy_static_files = LocalBlobStore(STATIC_DIR, sharded=False)
+
+
+async def _store_blob(key: str, size: int, content_type: str, write) -> bool:
+    """Register key in db.blobs and call write() unless the content is already stored.
+    
+    The row is written first, so a crash mid-write leaves something the GC can find; bumping
+    last_written_at keeps a re-used blob out of the current GC grace window.
+    """
+    now = datetime.now(timezone.utc)
+    existing = await db.blobs.find_one_and_update(
+        {"key": key},
+        {
+            "$set": {"last_written_at": now},
+            "$setOnInsert": {"key": key, "size": size, "content_type": content_type, "created_at": now}
+        },
+        projection={"_id": 0, "key": 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    if existing and await asyncio.to_thread(blob_store.exists, key):
+        return False
+    await asyncio.to_thread(write)
+    return True
+
+
+async def put_blob(data: bytes, extension: str) -> str:
+    """Store data and return its blob key"""
+    key = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+    content_type = BLOB_CONTENT_TYPES.get(extension, "application/octet-stream")
+    await _store_blob(key, len(data), content_type, lambda: blob_store.put_bytes(key, data, content_type))
+    return key
+
+
+async def save_upload_blob(file: UploadFile, allowed_kinds: tuple, max_bytes: int) -> dict:
+    """save_upload() into the blob store. Returns save_upload's result plus "blob" (the key)."""
+    upload = await save_upload(file, UPLOAD_STAGING_DIR, uuid.uuid4().hex, allowed_kinds, max_bytes)
+    extension = upload_extension(upload["kind"])
+    key = f"{upload['sha256']}.{extension}"
+    content_type = BLOB_CONTENT_TYPES.get(extension, "application/octet-stream")
+    try:
+        await _store_blob(key, upload["size"], content_type, lambda: blob_store.put_file(key, upload["path"], content_type))
+    finally:
+        # Already moved away unless the content was a duplicate (or storing failed)
+        upload["path"].unlink(missing_ok=True)
+    return {**upload, "blob": key}
+
+
+def blob_url(key: str, filename: Optional[str] = None) -> str:
+    url = f"{BLOB_URL_PREFIX}{key}"
+    return f"{url}?name={quote(filename)}" if filename else url
+
+
+def blob_key_from_url(url: Optional[str]) -> Optional[str]:
+    if not url or not url.startswith(BLOB_URL_PREFIX):
+        return None
+    key = urlsplit(url).path[len(BLOB_URL_PREFIX):]
+    return key if BLOB_KEY_PATTERN.match(key) else None
+
+
+def stored_file(blob_key: Optional[str], legacy_path: Optional[Path]) -> Optional[tuple]:
+    """(store, key) of a document kept as a blob or, from before the blob store, as a static file"""
+    if blob_key:
+        return blob_store, blob_key
+    if legacy_path:
+        return legacy_static_files, legacy_path.relative_to(STATIC_DIR).as_posix()
+    return None
+
+
+# URL prefixes of certificates and reports saved before the blob store -> their folders
+STATIC_FILE_URL_DIRS = {
+    "/api/static/certificates_pdf/": CERTIFICATE_PDF_DIR,
+    "/api/static/certificates/": CERTIFICATE_DIR,
+    "/api/static/reports_pdf/": REPORT_PDF_DIR
+}
+
+
+def static_url_file_path(url: Optional[str]) -> Optional[Path]:
+    """Local file behind one of the STATIC_FILE_URL_DIRS URLs (None for anything else)"""
+    for prefix, directory in STATIC_FILE_URL_DIRS.items():
+        if url and url.startswith(prefix):
+            return directory / Path(url[len(prefix):]).name
+    return None
+
+
+def stored_file_source(url: Optional[str]) -> Optional[tuple]:
+    """(store, key, filename) of the file behind a stored certificate/report URL: a blob or a legacy static file"""
+    blob_key = blob_key_from_url(url)
+    if blob_key:
+        name = parse_qs(urlsplit(url).query).get("name", [blob_key])[0]
+        return blob_store, blob_key, name
+    path = static_url_file_path(url)
+    if path:
+        store, key = stored_file(None, path)
+        return store, key, path.name
+    return None
+
+
+def _read_stored_file(store, key: str) -> bytes:
+    return b"".join(store.open_chunks(key))
+
+
+async def read_stored_file(store, key: str) -> bytes:
+    """Whole file as bytes; raises FileNotFoundError if it is gone"""
+    return await asyncio.to_thread(_read_stored_file, store, key)
+
+
+async def stored_file_response(
+    store,
+    key: str,
+    filename: str,
+    inline: bool = False,
+    not_found: str = "File not found",
+    headers: Optional[dict] = None,
+    request: Optional[Request] = None
+) -> Response:
+    """Serve a stored file as a download (or inline); HTTP 404 with not_found if it is missing.
+
+    Passing the request adds ETag/Range handling for files on local disk.
+    """
+    media_type = BLOB_CONTENT_TYPES.get(key.rsplit(".", 1)[-1], "application/octet-stream")
+    safe_name = re.sub(r'[^\w.\- ]+', "_", filename) or "download"
+    headers = {"Content-Disposition": f'{"inline" if inline else "attachment"}; filename="{safe_name}"', **(headers or {})}
+    
+    path = store.local_path(key)
+    if path is not None:
+        if not await asyncio.to_thread(path.is_file):
+            raise HTTPException(status_code=404, detail=not_found)
+        if request is not None:
+            etag = f'"{key.split(".")[0]}"' if store is blob_store else None
+            return await static_file_response(path, request, media_type, immutable=False, headers=headers, etag=etag)
+        return FileResponse(path, media_type=media_type, headers=headers)
+    try:
+        chunks = await asyncio.to_thread(store.open_chunks, key)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=not_found)
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+# ---- Garbage collection ----
+
+# (collection, field) holding blob keys or blob URLs
+BLOB_REFERENCES = [
+    ("training_reports", "docx_blob"),
+    ("training_reports", "edited_docx_blob"),
+    ("training_reports", "pdf_blob"),
+    ("training_reports", "final_pdf_blob"),
+    ("certificates", "certificate_url"),
+    ("participant_access", "certificate_url"),
+]
+# Static folders written before the blob store -> (collection, field) holding their file names or URLs.
+# Files there that nothing references (superseded regenerations, copies) are collected.
+LEGACY_FILE_REFERENCES = {
+    REPORT_DIR: [("training_reports", "docx_filename"), ("training_reports", "edited_docx_filename")],
+    REPORT_PDF_DIR: [("training_reports", "pdf_filename"), ("training_reports", "final_pdf_filename")],
+    CERTIFICATE_DIR: [("certificates", "certificate_url")],
+    CERTIFICATE_PDF_DIR: [("certificates", "certificate_url"), ("participant_access", "certificate_url")],
+}
+# Temp files from save_upload/_write_atomic and LibreOffice lock files left behind by a crash
+LEFTOVER_FILE_PATTERN = re.compile(r"^(\..+\.(part|tmp)|\.~lock\..+#)$")
+
+
+async def _referenced_values(references: list) -> set:
+    values = set()
+    for collection, field in references:
+        for value in await db[collection].distinct(field):
+            if isinstance(value, str):
+                values.add(value)
+    return values
+
+
+def _stale_files(directory: Path, cutoff: float, keep: set, recursive: bool = False) -> List[Path]:
+    """Files in directory last modified before cutoff whose name is not in keep"""
+    candidates = directory.rglob("*") if recursive else directory.iterdir()
+    stale = []
+    for path in candidates:
+        try:
+            if path.is_file() and path.name not in keep and path.stat().st_mtime < cutoff:
+                stale.append(path)
+        except FileNotFoundError:
+            continue
+    return stale
+
+
+def _delete_files(paths: List[Path]) -> int:
+    freed = 0
+    for path in paths:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            continue
+        freed += size
+    return freed
+
+
+async def collect_garbage(dry_run: bool = False) -> dict:
+    """Delete unreferenced blobs, superseded legacy files and leftover temp files.
+    
+    Only things untouched for BLOB_GC_GRACE_HOURS are considered. Returns what was (or with
+    dry_run, would be) removed.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=BLOB_GC_GRACE_HOURS)
+    
+    referenced = {blob_key_from_url(value) or value for value in await _referenced_values(BLOB_REFERENCES)}
+    blob_count = blob_bytes = 0
+    async for blob in db.blobs.find(
+        {"last_written_at": {"$lt": cutoff}, "key": {"$nin": list(referenced)}},
+        {"_id": 0, "key": 1, "size": 1}
+    ):
+        if not dry_run:
+            # Re-check the age atomically: a concurrent put_blob of the same content bumps it
+            result = await db.blobs.delete_one({"key": blob["key"], "last_written_at": {"$lt": cutoff}})
+            if not result.deleted_count:
+                continue
+            await asyncio.to_thread(blob_store.delete, blob["key"])
+        blob_count += 1
+        blob_bytes += blob.get("size") or 0
+    
+    stale = []
+    for directory, references in LEGACY_FILE_REFERENCES.items():
+        keep = {Path(urlsplit(value).path).name for value in await _referenced_values(references)}
+        stale += await asyncio.to_thread(_stale_files, directory, cutoff.timestamp(), keep)
+    leftovers = [
+        path for path in await asyncio.to_thread(_stale_files, STATIC_DIR, cutoff.timestamp(), set(), True)
+        if LEFTOVER_FILE_PATTERN.match(path.name) or path.parent == UPLOAD_STAGING_DIR
+    ]
+    files = list(dict.fromkeys(stale + leftovers))
+    if dry_run:
+        file_bytes = await asyncio.to_thread(lambda: sum(p.stat().st_size for p in files if p.exists()))
+    else:
+        file_bytes = await asyncio.to_thread(_delete_files, files)
+    
+    return {
+        "dry_run": dry_run,
+        "blobs_removed": blob_count,
+        "files_removed": len(files),
+        "bytes_freed": blob_bytes + file_bytes
+    }
+
+
+async def storage_gc_loop():
+    """Run collect_garbage every BLOB_GC_INTERVAL_HOURS on one worker; a lease row in db.maintenance picks it"""
+    interval = timedelta(hours=BLOB_GC_INTERVAL_HOURS)
+    while True:
+        try:
+            now = datetime.now(timezone.utc)
+            claimed = await db.maintenance.find_one_and_update(
+                {"id": "storage_gc", "next_run_at": {"$lte": now}},
+                {"$set": {"next_run_at": now + interval}}
+            )
+            if claimed is None:
+                # No due lease: either none exists yet (first run ever) or it is not due / taken
+                try:
+                    await db.maintenance.insert_one({"id": "storage_gc", "next_run_at": now + interval})
+                    claimed = True
+                except DuplicateKeyError:
+                    pass
+            if claimed:
+                result = await collect_garbage()
+                logging.info(f"Storage GC: {result}")
+        except Exception as e:
+            logging.error(f"Storage GC failed: {str(e)}")
+        await asyncio.sleep(min(interval.total_seconds(), 3600))
+
+
+# ============ SIGNED DOWNLOADS ============
+# Routes that check who may download a certificate or report hand out a signed, expiring
+# /api/files/ URL (HMAC-SHA256 over path, expiry, name and disposition, keyed from SECRET_KEY).
+# GET /api/files/... only verifies the signature and streams the file: no database access, so
+# it is cheap and safe to cache at a reverse proxy until the link expires. Expiry is rounded up
+# to DOWNLOAD_URL_BUCKET_SECONDS so links issued close together are identical and share caches.
+# The older unauthenticated /static/certificates* and /blobs routes answer 403 unless
+# REQUIRE_SIGNED_DOWNLOADS=false, an opt-out for clients still holding unsigned links during migration.
+
+DOWNLOAD_URL_TTL_SECONDS = int(os.environ.get('DOWNLOAD_URL_TTL_SECONDS', '3600'))
+DOWNLOAD_URL_BUCKET_SECONDS = 300
+REQUIRE_SIGNED_DOWNLOADS = os.environ.get('REQUIRE_SIGNED_DOWNLOADS', 'true').lower() == 'true'
+SIGNED_FILE_URL_PREFIX = "/api/files/"
+# Derived rather than SECRET_KEY itself, so a download signature can never pass as a JWT signature
+DOWNLOAD_SIGNING_KEY = hmac.new(SECRET_KEY.encode(), b"signed-download-urls", hashlib.sha256).digest()
+# Top-level folders of legacy_static_files that signed URLs may point into
+SIGNABLE_STATIC_DIRS = {"certificates", "certificates_pdf", "reports", "reports_pdf"}
+
+
+def _download_signature(path: str, expires: int, name: str, inline: bool) -> str:
+    message = f"{path}\n{expires}\n{name}\n{int(inline)}".encode()
+    digest = hmac.new(DOWNLOAD_SIGNING_KEY, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def sign_download(store, key: str, filename: str, inline: bool = False) -> str:
+    """Signed /api/files/ URL for a stored file (see stored_file / stored_file_source)"""
+    path = f"blobs/{key}" if store is blob_store else key
+    deadline = int(time.time()) + DOWNLOAD_URL_TTL_SECONDS
+    expires = (deadline // DOWNLOAD_URL_BUCKET_SECONDS + 1) * DOWNLOAD_URL_BUCKET_SECONDS
+    params = {"expires": expires, "name": filename}
+    if inline:
+        params["inline"] = 1
+    params["sig"] = _download_signature(path, expires, filename, inline)
+    return f"{SIGNED_FILE_URL_PREFIX}{quote(path)}?{urlencode(params)}"
+
+
+def signed_file_url(url: Optional[str], inline: bool = False) -> Optional[str]:
+    """Signed counterpart of a stored certificate/report URL; anything else is returned unchanged"""
+    source = stored_file_source(url)
+    if not source:
+        return url
+    store, key, filename = source
+    return sign_download(store, key, filename, inline)
+
+
+def signed_file_location(path: str) -> Optional[tuple]:
+    """(store, key) a signed URL path points at, or None if it is not a path we ever sign"""
+    folder, _, name = path.partition("/")
+    if folder == "blobs":
+        return (blob_store, name) if BLOB_KEY_PATTERN.match(name) else None
+    if folder in SIGNABLE_STATIC_DIRS and name and Path(name).name == name and not name.startswith("."):
+        return legacy_static_files, path
+    return None
+
+
+def ensure_unsigned_downloads_allowed():
+    if REQUIRE_SIGNED_DOWNLOADS:
+        raise HTTPException(status_code=403, detail="This file is only available through a signed download link")
+
+
+# ============ LLM ============
+# AI report text comes from an LLM provider: EmergentLLMProvider wraps LlmChat, and
+# StubLLMProvider (LLM_PROVIDER=stub) answers offline with a deterministic draft. Generation
+# runs in background jobs with at most LLM_CONCURRENCY completions in flight per worker, and
+# every completion is cached in db.llm_cache under a hash of the prompt's inputs (a snapshot of
+# the session data) plus the provider and model, so regenerating an unchanged report is a lookup.
+# stream_llm() is the incremental variant: providers' stream() yields text as the model writes it.
+# LlmChat only returns whole replies, so the emergent provider streams through litellm (the client
+# LlmChat is built on) against EMERGENT_LLM_API_BASE, the proxy for the emergent key. Startup
+# fails without it rather than quietly sending each streamed report as one late chunk.
+
+LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'emergent')
+LLM_MODEL = os.environ.get('LLM_MODEL', 'openai/gpt-4o')
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', '2'))
+LLM_TIMEOUT_SECONDS = int(os.environ.get('LLM_TIMEOUT_SECONDS', '180'))
+LLM_CACHE_TTL_DAYS = int(os.environ.get('LLM_CACHE_TTL_DAYS', '30'))
+EMERGENT_LLM_API_BASE = os.environ.get('EMERGENT_LLM_API_BASE', '')
+LLM_STUB_STREAM_DELAY = float(os.environ.get('LLM_STUB_STREAM_DELAY', '0.02'))
+
+
+class EmergentLLMProvider:
+    """LlmChat from emergentintegrations; model is "<vendor>/<model name>", e.g. openai/gpt-4o"""
+    name = "emergent"
+    
+    def _api_key(self) -> str:
+        api_key = os.environ.get('EMERGENT_LLM_KEY', '')
+        if not api_key:
+            raise HTTPException(status_code=500, detail="EMERGENT_LLM_KEY not configured")
+        return api_key
+    
+    async def complete(self, system_message: str, prompt: str, model: str) -> str:
+        vendor, model_name = model.split("/", 1)
+        chat = LlmChat(
+            api_key=self._api_key(),
+            session_id=f"llm_{uuid.uuid4()}",
+            system_message=system_message
+        ).with_model(vendor, model_name)
+        return await chat.send_message(UserMessage(text=prompt))
+    
+    def check(self):
+        if not EMERGENT_LLM_API_BASE:
+            raise RuntimeError(
+                "EMERGENT_LLM_API_BASE is not set: streamed AI reports need the LLM proxy URL "
+                "(or set LLM_PROVIDER=stub for offline use)"
+            )
+    
+    async def stream(self, system_message: str, prompt: str, model: str):
+        import litellm
+        response = await litellm.acompletion(
+            model=model,
+            api_key=self._api_key(),
+            api_base=EMERGENT_LLM_API_BASE,
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt}
+            ],
+            stream=True
+        )
+        async for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+
+class StubLLMProvider:
+    """Offline stand-in: a Markdown draft built from the prompt's data lines, same input same output"""
+    name = "stub"
+    
+    def check(self):
+        pass
+    
+    async def complete(self, system_message: str, prompt: str, model: str) -> str:
+        await asyncio.sleep(0)
+        facts = [
+            f"- {line.strip().lstrip('- ')}" for line in prompt.splitlines()
+            if re.match(r"^\s*(-\s+)?[A-Z][\w ()/-]*:\s+[^\[\s]", line)
+        ]
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        return "\n".join([
+            "# TRAINING COMPLETION REPORT",
+            "",
+            f"_Draft generated offline by the stub LLM provider ({digest})._",
+            "",
+            "## Session Data",
+            *facts
+        ])
+    
+    async def stream(self, system_message: str, prompt: str, model: str):
+        text = await self.complete(system_message, prompt, model)
+        for piece in re.findall(r"\S+\s*|\s+", text):
+            await asyncio.sleep(LLM_STUB_STREAM_DELAY)
+            yield piece
+
+
+LLM_PROVIDERS = {"emergent": EmergentLLMProvider, "stub": StubLLMProvider}
+llm_provider = LLM_PROVIDERS[LLM_PROVIDER]()
+llm_slots = asyncio.Semaphore(LLM_CONCURRENCY)
+
+
+def llm_cache_key(kind: str, inputs: dict, model: str = LLM_MODEL) -> str:
+    """Hash of everything a completion depends on; inputs must be the data the prompt is built from"""
+    fields = [llm_provider.name, model, kind, inputs]
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+async def cached_llm_text(cache_key: str) -> Optional[str]:
+    hit = await db.llm_cache.find_one({"key": cache_key}, {"_id": 0, "text": 1})
+    return hit["text"] if hit else None
+
+
+async def complete_llm(cache_key: str, system_message: str, prompt: str, model: str = LLM_MODEL) -> str:
+    """The cached completion for cache_key, or a fresh one (then cached)"""
+    text = await cached_llm_text(cache_key)
+    if text is not None:
+        return text
+    
+    async with llm_slots:
+        text = await asyncio.wait_for(llm_provider.complete(system_message, prompt, model), LLM_TIMEOUT_SECONDS)
+    await store_llm_text(cache_key, text, model)
+    return text
+
+
+async def store_llm_text(cache_key: str, text: str, model: str = LLM_MODEL):
+    await db.llm_cache.update_one(
+        {"key": cache_key},
+        {"$set": {
+            "text": text,
+            "provider": llm_provider.name,
+            "model": model,
+            "created_at": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+
+
+async def stream_llm(cache_key: str, system_message: str, prompt: str, model: str = LLM_MODEL):
+    """Like complete_llm, but yields the text in pieces as it is written (a cache hit is one piece)"""
+    text = await cached_llm_text(cache_key)
+    if text is not None:
+        yield text
+        return
+    
+    pieces = []
+    async with llm_slots:
+        # The deadline applies to each wait on the provider, never to the consumer's work between
+        # pieces, so a timeout always surfaces here as a TimeoutError the caller can handle
+        deadline = time.monotonic() + LLM_TIMEOUT_SECONDS
+        stream = llm_provider.stream(system_message, prompt, model)
+        try:
+            while True:
+                try:
+                    piece = await asyncio.wait_for(stream.__anext__(), deadline - time.monotonic())
+                except StopAsyncIteration:
+                    break
+                pieces.append(piece)
+                yield piece
+        finally:
+            await stream.aclose()
+    await store_llm_text(cache_key, "".join(pieces), model)
+
+
+# ============ ROUTES ============
+
+@api_router.get("/")
+async def root():
+    return {"message": "Defensive Driving Training API"}
+
+# Auth Routes
+@api_router.post("/auth/register", response_model=User)
+async def register_user(user_data: UserCreate, current_user: User = Depends(get_current_user)):
+    # Role-based access control:
+    # - Admins can create any user
+    # - Coordinators can only create participants
+    # - Assistant Admins can only create participants
+    if current_user.role == "coordinator" or current_user.role == "assistant_admin":
+        if user_data.role != "participant":
+            raise HTTPException(status_code=403, detail="You can only create participants")
+    elif current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    # For participants: use default password if not provided
+    password = user_data.password
+    email = user_data.email
+    
+    if user_data.role == "participant":
+        # Default password: mddrc1
+        if not password:
+            password = "mddrc1"
+        # Auto-generate email if not provided (for unique constraint)
+        if not email or email.strip() == "":
+            if user_data.id_number:
+                email = f"{user_data.id_number.replace('-', '').replace(' ', '')}@temp.mddrc.local"
+            else:
+                email = f"user_{uuid.uuid4().hex[:8]}@temp.mddrc.local"
+    
+    # Check if user exists by email OR IC number
+    existing = await db.users.find_one({
+        "$or": [
+            {"id_number": user_data.id_number},
+            {"email": email}
+        ]
+    }, {"_id": 0})
+    
+    if existing:
+        if existing.get('id_number') == user_data.id_number:
+            raise HTTPException(status_code=400, detail="User already exists with this IC number")
+        else:
+            raise HTTPException(status_code=400, detail="User already exists with this email")
+    
+    hashed_pw = hash_password(password)
+    user_obj = User(
+        email=email,  # Now always has a value (auto-generated if needed)
+        full_name=user_data.full_name,
+        id_number=user_data.id_number,
+        role=user_data.role,
+        company_id=user_data.company_id,
+        location=user_data.location
+    )
+    
+    doc = user_obj.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    doc['password'] = hashed_pw
+    
+    await db.users.insert_one(doc)
+    return user_obj
+
+@api_router.post("/auth/login", response_model=TokenResponse)
+async def login(user_data: UserLogin):
+    # Allow login with email OR IC number
+    # Build query dynamically to handle users without email
+    query_conditions = [{"id_number": user_data.email}]  # Always allow IC as username
+    
+    # Only check email if the input looks like an email (contains @)
+    if "@" in user_data.email:
+        query_conditions.append({"email": user_data.email})
+    
+    user_doc = await db.users.find_one({
+        "$or": query_conditions
+    }, {"_id": 0})
+    if not user_doc:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    # Check for both 'password' and 'hashed_password' field names
+    password_hash = user_doc.get('password') or user_doc.get('hashed_password')
+    if not password_hash:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    if not verify_password(user_data.password, password_hash):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    if not user_doc.get('is_active', True):
+        raise HTTPException(status_code=401, detail="Account is inactive")
+    
+    token = create_access_token({"sub": user_doc['id']})
+    
+    if isinstance(user_doc.get('created_at'), str):
+        user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
+    
+    user_doc.pop('password', None)
+    user_doc.pop('hashed_password', None)
+    user = User(**user_doc)
+    
+    return TokenResponse(access_token=token, token_type="bearer", user=user)
+
+@api_router.get("/auth/me", response_model=User)
+async def get_me(current_user: User = Depends(get_current_user)):
+    return current_user
+
+class ForgotPasswordRequest(BaseModel):
+    email: EmailStr
+
+class ResetPasswordRequest(BaseModel):
+    email: EmailStr
+    new_password: str
+
+@api_router.post("/auth/forgot-password")
+async def forgot_password(request: ForgotPasswordRequest):
+    """
+    Simple forgot password endpoint that checks if user exists
+    In production, this would send an email with reset link
+    """
+    user_doc = await db.users.find_one({"email": request.email}, {"_id": 0})
+    
+    # Always return success to prevent email enumeration
+    if not user_doc:
+        return {"message": "If an account exists with this email, password reset instructions have been sent"}
+    
+    # For MVP: Return success message
+    # In production: Generate token, send email with reset link
+    return {"message": "If an account exists with this email, password reset instructions have been sent"}
+
+class ChangePasswordRequest(BaseModel):
+    current_password: str
+    new_password: str
+
+@api_router.post("/auth/change-password")
+async def change_password(request: ChangePasswordRequest, current_user: User = Depends(get_current_user)):
+    """
+    Change password for logged-in user
+    """
+    # Verify current password
+    user_doc = await db.users.find_one({"id": current_user.id}, {"_id": 0})
+    if not user_doc:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    if not verify_password(request.current_password, user_doc["password"]):
+        raise HTTPException(status_code=400, detail="Current password is incorrect")
+    
+    # Minimum password length
+    if len(request.new_password) < 6:
+        raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
+    
+    # Hash and update new password
+    hashed_password = hash_password(request.new_password)
+    await db.users.update_one(
+        {"id": current_user.id},
+        {"$set": {"password": hashed_password}}
+    )
+    
+    return {"message": "Password changed successfully"}
+
+@api_router.post("/auth/reset-password")
+async def reset_password(request: ResetPasswordRequest):
+    """
+    Reset password for a user
+    In production, this would require a valid reset token from email
+    For MVP: Allow direct reset with email verification
     """
     user_doc = await db.users.find_one({"email": request.email}, {"_id": 0})
     
@@ -1024,6 +2958,7 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_use
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    await bump_user_session_versions(user_id)
     
     return {"message": "User deleted successfully"}
 
@@ -1058,6 +2993,7 @@ async def update_user(user_id: str, user_data: dict, current_user: User = Depend
     
     # Update user
     await db.users.update_one({"id": user_id}, {"$set": update_data})
+    await bump_user_session_versions(user_id)
     
     # Fetch and return updated user
     updated_user = await db.users.find_one({"id": user_id}, {"_id": 0})
@@ -1446,6 +3382,7 @@ async def add_participants_to_session(
     # This ensures checklists and tests show up for trainers immediately
     for user_id in newly_added:
         await get_or_create_participant_access(user_id, session_id)
+    await bump_session_version(session_id)
     
     return {
         "message": f"Successfully added {len(added_ids)} participant(s)",
@@ -1483,6 +3420,7 @@ async def update_session(session_id: str, session_data: dict, current_user: User
     # This ensures checklists and tests show up for trainers immediately
     for user_id in newly_added_participants:
         await get_or_create_participant_access(user_id, session_id)
+    await bump_session_version(session_id)
     
     return {"message": "Session updated successfully"}
 
@@ -1531,6 +3469,10 @@ async def update_participant_access(access_data: UpdateParticipantAccess, curren
         {"participant_id": access_data.participant_id, "session_id": access_data.session_id},
         {"$set": update_fields}
     )
+    await publish_session_event(access_data.session_id, "access_updated", {
+        "participant_id": access_data.participant_id,
+        **update_fields
+    })
     
     return {"message": "Access updated successfully"}
 
@@ -1549,6 +3491,8 @@ async def get_session_access(session_id: str, current_user: User = Depends(get_c
         raise HTTPException(status_code=403, detail="Access denied")
     
     access_records = await db.participant_access.find({"session_id": session_id}, {"_id": 0}).to_list(1000)
+    for record in access_records:
+        record["certificate_url"] = signed_file_url(record.get("certificate_url"))
     return access_records
 
 @api_router.post("/participant-access/session/{session_id}/toggle")
@@ -1591,6 +3535,8 @@ async def toggle_session_access(session_id: str, access_data: dict, current_user
             {"$set": {field_name: enabled}}
         )
     
+    await publish_session_event(session_id, "access_toggled", {"access_type": access_type, "enabled": enabled})
+    
     status_text = "enabled" if enabled else "disabled"
     return {"message": f"{access_type} access {status_text} for {len(participant_ids)} participants"}
 
@@ -1610,6 +3556,7 @@ async def release_pre_test(session_id: str, current_user: User = Depends(get_cur
         {"session_id": session_id},
         {"$set": {"can_access_pre_test": True}}
     )
+    await publish_session_event(session_id, "access_toggled", {"access_type": "pre_test", "enabled": True})
     
     return {"message": f"Pre-test released to {result.modified_count} participants"}
 
@@ -1626,6 +3573,7 @@ async def release_post_test(session_id: str, current_user: User = Depends(get_cu
         {"session_id": session_id},
         {"$set": {"can_access_post_test": True}}
     )
+    await publish_session_event(session_id, "access_toggled", {"access_type": "post_test", "enabled": True})
     
     return {"message": f"Post-test released to {result.modified_count} participants"}
 
@@ -1642,9 +3590,53 @@ async def release_feedback(session_id: str, current_user: User = Depends(get_cur
         {"session_id": session_id},
         {"$set": {"can_access_feedback": True}}
     )
+    await publish_session_event(session_id, "access_toggled", {"access_type": "feedback", "enabled": True})
     
     return {"message": f"Feedback form released to {result.modified_count} participants"}
 
+@api_router.get("/sessions/{session_id}/events")
+async def stream_session_events(session_id: str, request: Request, token: str):
+    """
+    Server-Sent Events feed of live session activity (clock-in/out, attendance marks,
+    test/feedback/checklist submissions, access changes). EventSource cannot send an
+    Authorization header, so the JWT is passed as ?token=.
+    """
+    current_user = await get_user_from_token(token)
+    if current_user.role not in ["admin", "coordinator", "trainer"]:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    
+    session = await db.sessions.find_one({"id": session_id}, {"_id": 0, "id": 1})
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    queue = session_event_broker.subscribe(session_id)
+    
+    async def event_stream():
+        try:
+            # Tell the client it is live; it should refetch /status once, then apply events
+            yield format_sse({
+                "id": str(uuid.uuid4()),
+                "session_id": session_id,
+                "type": "ready",
+                "data": {},
+                "at": get_malaysia_time().isoformat()
+            })
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SESSION_EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            session_event_broker.unsubscribe(session_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_router.get("/sessions/{session_id}/status")
 async def get_session_status(session_id: str, current_user: User = Depends(get_current_user)):
     if current_user.role not in ["admin", "coordinator", "trainer"]:
@@ -1696,11 +3688,11 @@ async def mark_participant_attendance(
     if current_user.role not in ["coordinator", "admin"]:
         raise HTTPException(status_code=403, detail="Only coordinators and admins can mark attendance")
     
-    if status not in ["present", "absent"]:
+    if status not in ATTENDANCE_STATUSES:
         raise HTTPException(status_code=400, detail="Status must be 'present' or 'absent'")
     
-    # Check if session exists
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+    # Check if session exists (only the enrolment list is needed)
+    session = await db.sessions.find_one({"id": session_id}, {"_id": 0, "participant_ids": 1})
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -1708,27 +3700,70 @@ async def mark_participant_attendance(
     if participant_id not in session.get("participant_ids", []):
         raise HTTPException(status_code=400, detail="Participant not enrolled in this session")
     
-    # Update or create attendance record
-    await db.participant_attendance.update_one(
-        {
-            "session_id": session_id,
-            "participant_id": participant_id
-        },
-        {
-            "$set": {
-                "status": status,
-                "marked_by": current_user.id,
-                "marked_at": get_malaysia_time().isoformat()
-            }
-        },
-        upsert=True
-    )
+    # Mark lands on today's attendance row (created if the participant has not clocked in)
+    failed = await attendance_mark_status(session_id, [(participant_id, status)], current_user.id)
+    if failed:
+        raise HTTPException(status_code=409, detail="Attendance could not be saved, please try again")
     
     return {
         "message": f"Participant marked as {status}",
         "status": status
     }
 
+@api_router.post("/sessions/{session_id}/participants/attendance/bulk")
+async def bulk_mark_participant_attendance(
+    session_id: str,
+    bulk_data: BulkAttendanceMark,
+    current_user: User = Depends(get_current_user)
+):
+    """Mark many participants present or absent in one call (one read, one bulk write)"""
+    if current_user.role not in ["coordinator", "admin"]:
+        raise HTTPException(status_code=403, detail="Only coordinators and admins can mark attendance")
+    
+    # Validate membership for every row with a single read
+    session = await db.sessions.find_one({"id": session_id}, {"_id": 0, "participant_ids": 1})
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    enrolled_ids = session.get("participant_ids", [])
+    enrolled = set(enrolled_ids)
+    
+    if bulk_data.mark_all_present:
+        rows = [AttendanceMark(participant_id=pid, status="present") for pid in enrolled_ids]
+    else:
+        rows = bulk_data.records
+    
+    if not rows:
+        raise HTTPException(status_code=400, detail="No attendance records provided")
+    
+    results = []
+    marks = []
+    for row in rows:
+        if row.status not in ATTENDANCE_STATUSES:
+            results.append({"participant_id": row.participant_id, "status": row.status, "success": False,
+                            "error": "Status must be 'present' or 'absent'"})
+            continue
+        if row.participant_id not in enrolled:
+            results.append({"participant_id": row.participant_id, "status": row.status, "success": False,
+                            "error": "Participant not enrolled in this session"})
+            continue
+        
+        marks.append((row.participant_id, row.status))
+        results.append({"participant_id": row.participant_id, "status": row.status, "success": True})
+    
+    # Rows whose write failed are reported per participant rather than failing the whole call
+    mark_results = [r for r in results if r["success"]]
+    failed = await attendance_mark_status(session_id, marks, current_user.id)
+    for index, error in failed.items():
+        mark_results[index].update({"success": False, "error": error})
+    
+    marked_count = sum(1 for r in results if r["success"])
+    return {
+        "message": f"Attendance marked for {marked_count} participant(s)",
+        "marked_count": marked_count,
+        "failed_count": len(results) - marked_count,
+        "results": results
+    }
+
 @api_router.get("/sessions/{session_id}/participants/attendance")
 async def get_session_attendance_status(
     session_id: str,
@@ -1738,16 +3773,9 @@ async def get_session_attendance_status(
     if current_user.role not in ["coordinator", "admin", "trainer"]:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    # Get all attendance records for this session
-    attendance_records = await db.participant_attendance.find(
-        {"session_id": session_id},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    # Return as dictionary with participant_id as key
-    attendance_dict = {record["participant_id"]: record["status"] for record in attendance_records}
-    
-    return attendance_dict
+    # Return as dictionary with participant_id as key (explicit mark, else present once clocked in)
+    summary = await get_attendance_summary(session_id)
+    return {pid: row["status"] for pid, row in summary.items() if row["status"]}
 
 @api_router.get("/sessions/{session_id}/completion-checklist")
 async def get_completion_checklist(session_id: str, current_user: User = Depends(get_current_user)):
@@ -1851,21 +3879,24 @@ async def get_results_summary(session_id: str, current_user: User = Depends(get_
         {"_id": 0}
     ).to_list(1000)
     
-    # Get feedback for all participants
+    # Get feedback for all participants (only who submitted is needed)
     feedbacks = await db.course_feedback.find(
         {"session_id": session_id},
-        {"_id": 0}
+        {"_id": 0, "participant_id": 1}
     ).to_list(1000)
     
+    # Index results and feedback by participant (first submission wins) so the summary is O(P + R)
+    results_map = {}
+    for r in test_results:
+        results_map.setdefault((r['participant_id'], r['test_type']), r)
+    feedback_participant_ids = {f['participant_id'] for f in feedbacks}
+
     # Build summary
     summary = []
     for participant in participants:
-        p_results = [r for r in test_results if r['participant_id'] == participant['id']]
-        p_feedback = next((f for f in feedbacks if f['participant_id'] == participant['id']), None)
-        
-        pre_test = next((r for r in p_results if r['test_type'] == 'pre'), None)
-        post_test = next((r for r in p_results if r['test_type'] == 'post'), None)
-        
+        pre_test = results_map.get((participant['id'], 'pre'))
+        post_test = results_map.get((participant['id'], 'post'))
+
         summary.append({
             "participant": {
                 "id": participant['id'],
@@ -1888,7 +3919,7 @@ async def get_results_summary(session_id: str, current_user: User = Depends(get_
                 "passed": post_test['passed'] if post_test else False,
                 "result_id": post_test['id'] if post_test else None
             },
-            "feedback_submitted": p_feedback is not None
+            "feedback_submitted": participant['id'] in feedback_participant_ids
         })
     
     return {
@@ -2101,6 +4132,13 @@ async def submit_test(submission: TestSubmit, current_user: User = Depends(get_c
         {"participant_id": current_user.id, "session_id": submission.session_id},
         {"$set": {update_field: True}}
     )
+    await bump_session_version(submission.session_id)
+    await publish_session_event(submission.session_id, "test_submitted", {
+        "participant_id": current_user.id,
+        "test_type": test_doc['test_type'],
+        "score": score,
+        "passed": passed
+    })
     
     return result_obj
 
@@ -2299,39 +4337,7 @@ async def clock_in(attendance_data: AttendanceClockIn, current_user: User = Depe
     if current_user.role != "participant":
         raise HTTPException(status_code=403, detail="Only participants can clock in")
     
-    # Use Malaysian time
-    today = get_malaysia_date().isoformat()
-    now = get_malaysia_time_str()
-    
-    # Check if already clocked in today
-    existing = await db.attendance.find_one({
-        "participant_id": current_user.id,
-        "session_id": attendance_data.session_id,
-        "date": today
-    }, {"_id": 0})
-    
-    if existing and existing.get('clock_in'):
-        raise HTTPException(status_code=400, detail="Already clocked in today")
-    
-    if existing:
-        # Update existing
-        await db.attendance.update_one(
-            {"id": existing['id']},
-            {"$set": {"clock_in": now}}
-        )
-        return {"message": "Clocked in successfully", "time": now}
-    
-    # Create new
-    attendance_obj = Attendance(
-        participant_id=current_user.id,
-        session_id=attendance_data.session_id,
-        date=today,
-        clock_in=now
-    )
-    
-    doc = attendance_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.attendance.insert_one(doc)
+    now = await attendance_clock_in(current_user.id, attendance_data.session_id)
     
     return {"message": "Clocked in successfully", "time": now}
 
@@ -2340,26 +4346,7 @@ async def clock_out(attendance_data: AttendanceClockOut, current_user: User = De
     if current_user.role != "participant":
         raise HTTPException(status_code=403, detail="Only participants can clock out")
     
-    # Use Malaysian time
-    today = get_malaysia_date().isoformat()
-    now = get_malaysia_time_str()
-    
-    existing = await db.attendance.find_one({
-        "participant_id": current_user.id,
-        "session_id": attendance_data.session_id,
-        "date": today
-    }, {"_id": 0})
-    
-    if not existing or not existing.get('clock_in'):
-        raise HTTPException(status_code=400, detail="Please clock in first")
-    
-    if existing.get('clock_out'):
-        raise HTTPException(status_code=400, detail="Already clocked out today")
-    
-    await db.attendance.update_one(
-        {"id": existing['id']},
-        {"$set": {"clock_out": now}}
-    )
+    now = await attendance_clock_out(current_user.id, attendance_data.session_id)
     
     return {"message": "Clocked out successfully", "time": now}
 
@@ -2377,7 +4364,7 @@ async def get_session_attendance(session_id: str, current_user: User = Depends(g
     # Get all attendance records for the session
     print(f"Querying attendance for session_id: {session_id}")
     logging.info(f"Querying attendance for session_id: {session_id}")
-    attendance_records = await db.attendance.find({"session_id": session_id}, {"_id": 0}).to_list(1000)
+    attendance_records = await get_attendance_rows(session_id)
     print(f"Found {len(attendance_records)} attendance records")
     logging.info(f"Found {len(attendance_records)} attendance records")
     
@@ -2387,10 +4374,8 @@ async def get_session_attendance(session_id: str, current_user: User = Depends(g
         participant_ids = list(set([r['participant_id'] for r in attendance_records]))
         logging.info(f"Looking up {len(participant_ids)} unique participants")
         
-        if participant_ids:  # Only query if we have IDs to look up
-            participants = await db.users.find({"id": {"$in": participant_ids}}, {"_id": 0}).to_list(1000)
-            participant_map = {p['id']: p for p in participants}
-            logging.info(f"Found {len(participants)} participant records")
+        participant_map = await get_participant_map(participant_ids)
+        logging.info(f"Found {len(participant_map)} participant records")
     
     # Enrich attendance records with participant info
     for record in attendance_records:
@@ -2408,61 +4393,28 @@ async def get_session_attendance(session_id: str, current_user: User = Depends(g
     
     return attendance_records
 
-@api_router.get("/attendance/{session_id}/{participant_id}")
-async def get_attendance(session_id: str, participant_id: str, current_user: User = Depends(get_current_user)):
-    attendance_records = await db.attendance.find({
-        "participant_id": participant_id,
-        "session_id": session_id
-    }, {"_id": 0}).to_list(100)
-    
-    for record in attendance_records:
-        if isinstance(record.get('created_at'), str):
-            record['created_at'] = datetime.fromisoformat(record['created_at'])
-    
-    return attendance_records
-    
-    print(f"=== ATTENDANCE ENDPOINT CALLED FOR SESSION: {session_id} ===")
-    logging.info(f"=== ATTENDANCE ENDPOINT CALLED FOR SESSION: {session_id} ===")
-    
-    if current_user.role not in ["pic_supervisor", "coordinator", "admin"]:
+@api_router.get("/attendance/session/{session_id}/matrix")
+async def get_session_attendance_matrix(session_id: str, current_user: User = Depends(get_current_user)):
+    """Pre-pivoted participants x days attendance grid (presence string + parallel clock times)"""
+    if current_user.role not in ["pic_supervisor", "coordinator", "admin", "trainer"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Get session to verify access
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+    session = await db.sessions.find_one(
+        {"id": session_id},
+        {"_id": 0, "id": 1, "start_date": 1, "end_date": 1, "participant_ids": 1}
+    )
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Get all attendance records for the session
-    print(f"Querying attendance for session_id: {session_id}")
-    logging.info(f"Querying attendance for session_id: {session_id}")
-    attendance_records = await db.attendance.find({"session_id": session_id}, {"_id": 0}).to_list(1000)
-    print(f"Found {len(attendance_records)} attendance records")
-    logging.info(f"Found {len(attendance_records)} attendance records")
-    
-    # Get participant details only if we have attendance records
-    participant_map = {}
-    if attendance_records:
-        participant_ids = list(set([r['participant_id'] for r in attendance_records]))
-        logging.info(f"Looking up {len(participant_ids)} unique participants")
-        
-        if participant_ids:  # Only query if we have IDs to look up
-            participants = await db.users.find({"id": {"$in": participant_ids}}, {"_id": 0}).to_list(1000)
-            participant_map = {p['id']: p for p in participants}
-            logging.info(f"Found {len(participants)} participant records")
+    return await build_attendance_matrix(session)
+
+@api_router.get("/attendance/{session_id}/{participant_id}")
+async def get_attendance(session_id: str, participant_id: str, current_user: User = Depends(get_current_user)):
+    attendance_records = await get_attendance_rows(session_id, participant_id)
     
-    # Enrich attendance records with participant info
     for record in attendance_records:
         if isinstance(record.get('created_at'), str):
             record['created_at'] = datetime.fromisoformat(record['created_at'])
-        participant = participant_map.get(record['participant_id'])
-        if participant:
-            record['participant_name'] = participant.get('full_name', 'Unknown')
-            record['participant_email'] = participant.get('email', '')
-        else:
-            # Still include record even if participant not found
-            record['participant_name'] = f"Participant {record['participant_id']}"
-            record['participant_email'] = ''
-            logging.warning(f"Could not find participant info for ID: {record['participant_id']}")
     
     return attendance_records
 
@@ -2486,6 +4438,7 @@ async def create_training_report(report_data: TrainingReportCreate, current_user
             {"session_id": report_data.session_id},
             {"$set": update_data}
         )
+        await bump_session_version(report_data.session_id)
         
         updated = await db.training_reports.find_one({"session_id": report_data.session_id}, {"_id": 0})
         if isinstance(updated.get('created_at'), str):
@@ -2509,6 +4462,7 @@ async def create_training_report(report_data: TrainingReportCreate, current_user
         doc['submitted_at'] = doc['submitted_at'].isoformat()
     
     await db.training_reports.insert_one(doc)
+    await bump_session_version(report_data.session_id)
     return report_obj
 
 @api_router.get("/training-reports/{session_id}")
@@ -2524,6 +4478,7 @@ async def get_training_report(session_id: str, current_user: User = Depends(get_
         report['created_at'] = datetime.fromisoformat(report['created_at'])
     if isinstance(report.get('submitted_at'), str) and report.get('submitted_at'):
         report['submitted_at'] = datetime.fromisoformat(report['submitted_at'])
+    report['pdf_url'] = signed_file_url(report.get('pdf_url'))
     
     return report
 
@@ -2540,6 +4495,7 @@ async def get_coordinator_reports(coordinator_id: str, current_user: User = Depe
             report['created_at'] = datetime.fromisoformat(report['created_at'])
         if isinstance(report.get('submitted_at'), str) and report.get('submitted_at'):
             report['submitted_at'] = datetime.fromisoformat(report['submitted_at'])
+        report['pdf_url'] = signed_file_url(report.get('pdf_url'))
     
     return reports
 
@@ -2606,6 +4562,7 @@ async def get_all_training_reports(
         # Build enriched report
         enriched = {
             **report,
+            "pdf_url": signed_file_url(report.get('pdf_url')),
             "session_name": session.get('name', 'Unknown'),
             "session_start_date": session.get('start_date'),
             "session_end_date": session.get('end_date'),
@@ -2637,58 +4594,65 @@ async def get_all_training_reports(
     }
 
 
-@api_router.post("/training-reports/{session_id}/generate-ai-report")
-async def generate_ai_report(session_id: str, current_user: User = Depends(get_current_user)):
-    """Generate AI training report using ChatGPT"""
-    if current_user.role != "coordinator" and current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Only coordinators can generate reports")
-    
-    from emergentintegrations.llm.chat import LlmChat, UserMessage, FileContentWithMimeType
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    # Get session details
+AI_REPORT_SYSTEM_MESSAGE = "You are a professional training report writer specializing in defensive driving and road safety training programs."
+
+
+async def ai_report_inputs(session_id: str) -> dict:
+    """Everything the completion-report prompt is built from; its hash is the LLM cache key"""
     session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Get program details
-    program = await db.programs.find_one({"id": session['program_id']}, {"_id": 0})
-    
-    # Get company details
-    company = await db.companies.find_one({"id": session['company_id']}, {"_id": 0})
-    
-    # Get participants count
-    participant_count = len(session.get('participant_ids', []))
-    
-    # Get attendance records
-    attendance_records = await db.attendance.find({"session_id": session_id}, {"_id": 0}).to_list(1000)
-    total_attendance = len(set([r['participant_id'] for r in attendance_records]))
-    
-    # Get test results
-    test_results = await db.test_results.find({"session_id": session_id}, {"_id": 0}).to_list(1000)
-    passed_tests = len([r for r in test_results if r.get('passed', False)])
-    
-    # Get training report with photos
-    training_report = await db.training_reports.find_one({"session_id": session_id}, {"_id": 0})
+    program = await db.programs.find_one({"id": session.get('program_id')}, {"_id": 0, "name": 1})
+    company = await db.companies.find_one({"id": session.get('company_id')}, {"_id": 0, "name": 1})
+    attendance_summary = await get_attendance_summary(session_id)
+    test_results = await db.test_results.find({"session_id": session_id}, {"_id": 0, "passed": 1}).to_list(1000)
+    training_report = await db.training_reports.find_one(
+        {"session_id": session_id},
+        {"_id": 0, "group_photo": 1, "theory_photo_1": 1, "theory_photo_2": 1,
+         "practical_photo_1": 1, "practical_photo_2": 1, "practical_photo_3": 1}
+    )
+    photos = training_report or {}
     
-    # Build context for AI
-    context = f"""
+    return {
+        "program_name": program.get('name', 'N/A') if program else 'N/A',
+        "company_name": company.get('name', 'N/A') if company else 'N/A',
+        "location": session.get('location', 'N/A'),
+        "start_date": session.get('start_date', 'N/A'),
+        "end_date": session.get('end_date', 'N/A'),
+        "participant_count": len(session.get('participant_ids', [])),
+        "total_attendance": sum(1 for row in attendance_summary.values() if row["status"] == "present"),
+        "passed_tests": len([r for r in test_results if r.get('passed', False)]),
+        "total_tests": len(test_results),
+        "has_training_report": any(photos.values()),
+        "group_photo": bool(photos.get('group_photo')),
+        "theory_photos": bool(photos.get('theory_photo_1') and photos.get('theory_photo_2')),
+        "practical_photos": bool(photos.get('practical_photo_1') and photos.get('practical_photo_2') and photos.get('practical_photo_3')),
+        "report_date": get_malaysia_time().strftime('%Y-%m-%d')
+    }
+
+
+def ai_report_prompt(inputs: dict) -> str:
+    participant_count = inputs["participant_count"]
+    total_attendance = inputs["total_attendance"]
+    passed_tests = inputs["passed_tests"]
+    total_tests = inputs["total_tests"]
+    return f"""
 Generate a professional defensive driving training completion report in a structured format similar to official training documentation.
 
 **SESSION INFORMATION:**
-Program Name: {program.get('name', 'N/A') if program else 'N/A'}
-Company: {company.get('name', 'N/A') if company else 'N/A'}
-Training Location: {session.get('location', 'N/A')}
-Training Period: {session.get('start_date', 'N/A')} to {session.get('end_date', 'N/A')}
+Program Name: {inputs['program_name']}
+Company: {inputs['company_name']}
+Training Location: {inputs['location']}
+Training Period: {inputs['start_date']} to {inputs['end_date']}
 Total Participants: {participant_count}
 Attendance: {total_attendance} out of {participant_count} participants
-Assessment Pass Rate: {passed_tests} out of {len(test_results)} passed
+Assessment Pass Rate: {passed_tests} out of {total_tests} passed
 
 **DOCUMENTATION:**
-- Group Photo: {'Attached' if training_report and training_report.get('group_photo') else 'Not provided'}
-- Theory Session Photos: {2 if training_report and training_report.get('theory_photo_1') and training_report.get('theory_photo_2') else 0} photos attached
-- Practical Session Photos: {3 if training_report and training_report.get('practical_photo_1') and training_report.get('practical_photo_2') and training_report.get('practical_photo_3') else 0} photos attached
+- Group Photo: {'Attached' if inputs['group_photo'] else 'Not provided'}
+- Theory Session Photos: {2 if inputs['theory_photos'] else 0} photos attached
+- Practical Session Photos: {3 if inputs['practical_photos'] else 0} photos attached
 
 **REQUIRED REPORT STRUCTURE:**
 
@@ -2716,7 +4680,7 @@ Assessment Pass Rate: {passed_tests} out of {len(test_results)} passed
 ## 5. PARTICIPANT PERFORMANCE
 - Total Enrolled: {participant_count}
 - Attendance Rate: {round((total_attendance/participant_count)*100) if participant_count > 0 else 0}%
-- Assessment Pass Rate: {round((passed_tests/len(test_results))*100) if len(test_results) > 0 else 0}%
+- Assessment Pass Rate: {round((passed_tests/total_tests)*100) if total_tests > 0 else 0}%
 
 ## 6. KEY LEARNING OUTCOMES
 [List 4-5 key skills/knowledge participants gained]
@@ -2738,948 +4702,1455 @@ Assessment Pass Rate: {passed_tests} out of {len(test_results)} passed
 
 ---
 Report Prepared By: Training Coordinator
-Date: {get_malaysia_time().strftime('%Y-%m-%d')}
+Date: {inputs['report_date']}
 
 Please generate this report professionally with proper formatting, specific details based on the data provided, and maintain a formal tone suitable for official documentation.
 """
+
+
+def ai_report_result(session_id: str, inputs: dict, text: str, cached: bool) -> dict:
+    return {
+        "session_id": session_id,
+        "generated_report": text,
+        "cached": cached,
+        "metadata": {
+            "participant_count": inputs["participant_count"],
+            "attendance_rate": f"{inputs['total_attendance']}/{inputs['participant_count']}",
+            "test_pass_rate": f"{inputs['passed_tests']}/{inputs['total_tests']}",
+            "photos_included": inputs["has_training_report"]
+        }
+    }
+
+
+async def ai_report_job(payload: dict) -> dict:
+    """Job handler: write the AI completion report for a session (or take it from the cache)"""
+    session_id = payload["session_id"]
+    inputs = await ai_report_inputs(session_id)
+    text = await complete_llm(llm_cache_key("ai_report", inputs), AI_REPORT_SYSTEM_MESSAGE, ai_report_prompt(inputs))
+    return ai_report_result(session_id, inputs, text, cached=False)
+
+
+register_job_handler("ai_report", ai_report_job, concurrency=LLM_CONCURRENCY, max_attempts=2)
+
+
+@api_router.post("/training-reports/{session_id}/generate-ai-report", status_code=202)
+async def generate_ai_report(session_id: str, response: Response, current_user: User = Depends(get_current_user)):
+    """Queue an AI training report; poll GET /jobs/{job_id}. Unchanged session data returns the cached report at once."""
+    if current_user.role != "coordinator" and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only coordinators can generate reports")
     
-    try:
-        # Initialize LLM Chat
-        api_key = os.environ.get('EMERGENT_LLM_KEY', '')
-        if not api_key:
-            raise HTTPException(status_code=500, detail="EMERGENT_LLM_KEY not configured")
-        
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"report_{session_id}",
-            system_message="You are a professional training report writer specializing in defensive driving and road safety training programs."
-        ).with_model("openai", "gpt-4o")
-        
-        user_message = UserMessage(text=context)
-        
-        # Generate report
-        ai_response = await chat.send_message(user_message)
-        
+    inputs = await ai_report_inputs(session_id)
+    text = await cached_llm_text(llm_cache_key("ai_report", inputs))
+    if text is not None:
+        response.status_code = 200
         return {
-            "session_id": session_id,
-            "generated_report": ai_response,
-            "metadata": {
-                "participant_count": participant_count,
-                "attendance_rate": f"{total_attendance}/{participant_count}",
-                "test_pass_rate": f"{passed_tests}/{len(test_results)}",
-                "photos_included": bool(training_report)
-            }
+            "job_id": None,
+            "status": "succeeded",
+            "result": ai_report_result(session_id, inputs, text, cached=True),
+            "message": "Report is up to date"
         }
-        
+    
+    job = await enqueue_job("ai_report", {"session_id": session_id}, current_user.id)
+    return {**job_response(job), "message": "AI report generation queued"}
+
+
+# Streamed AI report drafts: the completion runs in a task of its own (not the request's), so a
+# dropped connection does not stop it. The text so far is saved to training_reports.ai_draft about
+# once a second; a client that reconnects (EventSource sends Last-Event-ID) continues from where it
+# was, from memory on the worker doing the generation and from the saved draft on any other.
+AI_DRAFT_SAVE_INTERVAL = 1.0
+# A draft still marked "streaming" this long after its last save was left by a dead worker
+AI_DRAFT_STALE_SECONDS = 30
+
+
+class AiDraftRun:
+    """One in-flight streamed draft; listeners wait on changed, which is replaced on every update"""
+    
+    def __init__(self, session_id: str, cache_key: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.cache_key = cache_key
+        self.text = ""
+        self.status = "streaming"
+        self.error = None
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+    
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+ai_draft_runs: Dict[str, AiDraftRun] = {}
+
+
+async def save_ai_draft(run: AiDraftRun, user_id: str):
+    await db.training_reports.update_one(
+        {"session_id": run.session_id},
+        {
+            "$set": {
+                "ai_draft": run.text,
+                "ai_draft_status": run.status,
+                "ai_draft_error": run.error,
+                "ai_draft_run": run.id,
+                "ai_draft_key": run.cache_key,
+                "ai_draft_updated_at": get_malaysia_time().isoformat()
+            },
+            # A draft may come before the coordinator saves the report itself
+            "$setOnInsert": {
+                "id": str(uuid.uuid4()),
+                "coordinator_id": user_id,
+                "status": "draft",
+                "created_at": get_malaysia_time().isoformat()
+            }
+        },
+        upsert=True
+    )
+
+
+async def run_ai_draft(run: AiDraftRun, inputs: dict, user_id: str):
+    try:
+        await save_ai_draft(run, user_id)
+        saved_at = time.monotonic()
+        async for piece in stream_llm(run.cache_key, AI_REPORT_SYSTEM_MESSAGE, ai_report_prompt(inputs)):
+            run.text += piece
+            run.notify()
+            if time.monotonic() - saved_at >= AI_DRAFT_SAVE_INTERVAL:
+                await save_ai_draft(run, user_id)
+                saved_at = time.monotonic()
+        run.status = "complete"
+    except asyncio.CancelledError:
+        # Shutdown: record the draft as failed so the next request starts it again at once
+        run.status = "failed"
+        run.error = "AI report generation was interrupted; please try again"
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to generate AI report: {str(e)}")
+        logging.exception(f"AI draft for session {run.session_id} failed")
+        run.status = "failed"
+        run.error = e.detail if isinstance(e, HTTPException) else "AI report generation failed"
+    finally:
+        try:
+            await save_ai_draft(run, user_id)
+        finally:
+            ai_draft_runs.pop(run.session_id, None)
+            run.notify()
+
+
+def ai_draft_is_live(draft: Optional[dict]) -> bool:
+    if not draft or draft.get("ai_draft_status") != "streaming":
+        return False
+    age = get_malaysia_time() - datetime.fromisoformat(draft["ai_draft_updated_at"])
+    return age.total_seconds() < AI_DRAFT_STALE_SECONDS
+
+
+async def saved_ai_draft(session_id: str) -> Optional[dict]:
+    return await db.training_reports.find_one(
+        {"session_id": session_id},
+        {"_id": 0, "ai_draft": 1, "ai_draft_status": 1, "ai_draft_error": 1, "ai_draft_run": 1,
+         "ai_draft_key": 1, "ai_draft_updated_at": 1}
+    )
+
+
+async def start_ai_draft(session_id: str, user_id: str):
+    """Join this worker's run for the session, or start one unless the saved draft is current or live elsewhere"""
+    if session_id in ai_draft_runs:
+        return
+    inputs = await ai_report_inputs(session_id)
+    cache_key = llm_cache_key("ai_report", inputs)
+    draft = await saved_ai_draft(session_id)
+    if session_id in ai_draft_runs:
+        return
+    if draft and draft.get("ai_draft_key") == cache_key and (
+        draft.get("ai_draft_status") == "complete" or ai_draft_is_live(draft)
+    ):
+        return
+    
+    run = ai_draft_runs[session_id] = AiDraftRun(session_id, cache_key)
+    # ai_draft_runs holds the run and the run holds its task, until run_ai_draft removes it
+    run.task = asyncio.create_task(run_ai_draft(run, inputs, user_id))
+
+
+@api_router.get("/training-reports/{session_id}/ai-report/stream")
+async def stream_ai_report(session_id: str, request: Request, token: str):
+    """
+    Server-Sent Events version of generate-ai-report: "chunk" events carry the text as the model
+    writes it, then "done" (or "failed"). Event ids are "<run>:<offset>"; on reconnect the
+    Last-Event-ID header resumes from that offset, and "reset" tells the client to start over
+    because the draft was regenerated. Token as ?token=, like /sessions/{id}/events.
+    """
+    current_user = await get_user_from_token(token)
+    if current_user.role != "coordinator" and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only coordinators can generate reports")
+    
+    await start_ai_draft(session_id, current_user.id)
+    
+    run_id, _, offset = request.headers.get("last-event-id", "").partition(":")
+    offset = int(offset) if offset.isdigit() else 0
+    
+    async def event_stream():
+        nonlocal run_id, offset
+        while not await request.is_disconnected():
+            run = ai_draft_runs.get(session_id)
+            if run:
+                changed = run.changed
+                draft_run, text, status, error = run.id, run.text, run.status, run.error
+            else:
+                draft = await saved_ai_draft(session_id) or {}
+                draft_run, text = draft.get("ai_draft_run"), draft.get("ai_draft") or ""
+                status, error = draft.get("ai_draft_status"), draft.get("ai_draft_error")
+                if status == "streaming" and not ai_draft_is_live(draft):
+                    status, error = "failed", "AI report generation was interrupted; please try again"
+            
+            if draft_run != run_id:
+                if offset:
+                    yield format_sse({"id": f"{draft_run}:0", "type": "reset"})
+                run_id, offset = draft_run, 0
+            if len(text) > offset:
+                yield format_sse({"id": f"{run_id}:{len(text)}", "type": "chunk", "text": text[offset:]})
+                offset = len(text)
+            
+            if status == "complete":
+                yield format_sse({"id": f"{run_id}:{offset}", "type": "done", "length": offset})
+                return
+            if status != "streaming":
+                yield format_sse({"id": f"{run_id}:{offset}", "type": "failed", "detail": error or "AI report generation failed"})
+                return
+            
+            try:
+                if run:
+                    await asyncio.wait_for(changed.wait(), timeout=SESSION_EVENTS_HEARTBEAT_SECONDS)
+                else:
+                    # Generating on another worker: follow its saved progress
+                    await asyncio.sleep(AI_DRAFT_SAVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 # Professional DOCX Report Generation
-@api_router.post("/training-reports/{session_id}/generate-docx")
-async def generate_docx_report(session_id: str, current_user: User = Depends(get_current_user)):
-    """Generate a professional DOCX training report with all data populated"""
+# Generation runs as a background job in three stages: gather every record the report needs
+# with batched queries, build the document in a worker thread, then persist the file and the
+# training_reports record. The route only validates and queues.
+# The report's content is a plain model (build_report_model) shared by every output format;
+# the JSON/HTML preview renders it directly without touching python-docx.
+
+async def load_report_session(session_id: str) -> tuple:
+    """(session, program, company) for a report, raising the same errors the route always has"""
+    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
     
-    if current_user.role not in ["coordinator", "admin"]:
-        raise HTTPException(status_code=403, detail="Only coordinators and admins can generate reports")
+    program = await db.programs.find_one({"id": session.get('program_id')}, {"_id": 0}) if session.get('program_id') else None
+    company = await db.companies.find_one({"id": session.get('company_id')}, {"_id": 0}) if session.get('company_id') else None
+    
+    if not program:
+        raise HTTPException(status_code=400, detail="Program not found for this session. Please ensure the session has a valid program assigned.")
+    if not company:
+        raise HTTPException(status_code=400, detail="Company not found for this session. Please ensure the session has a valid company assigned.")
+    return session, program, company
+
+
+async def gather_training_report_data(session_id: str) -> dict:
+    """Stage 1: everything the report needs, in a fixed number of queries regardless of class size"""
+    session, program, company = await load_report_session(session_id)
+    participant_ids = session.get('participant_ids', [])
+    
+    checklists = await db.vehicle_checklists.find({"session_id": session_id}, {"_id": 0}).to_list(100)
+    all_feedback = await db.course_feedback.find({"session_id": session_id}, {"_id": 0}).to_list(100)
+    
+    # One users query covers the roster plus anyone referenced by a checklist or feedback
+    user_ids = set(participant_ids)
+    user_ids.update(c['participant_id'] for c in checklists)
+    user_ids.update(f['participant_id'] for f in all_feedback)
+    users = await get_participant_map(list(user_ids), fields=("full_name", "id_number"))
+    
+    test_results = {}
+    async for result in db.test_results.find(
+        {"session_id": session_id, "participant_id": {"$in": participant_ids}, "test_type": {"$in": ["pre", "post"]}},
+        {"_id": 0, "participant_id": 1, "test_type": 1, "score": 1, "passed": 1}
+    ):
+        test_results.setdefault((result['participant_id'], result['test_type']), result)
+    
+    participants = []
+    for pid in participant_ids:
+        user = users.get(pid)
+        if user:
+            pre_test = test_results.get((pid, "pre"))
+            post_test = test_results.get((pid, "post"))
+            participants.append({
+                "name": user.get('full_name'),
+                "id_number": user.get('id_number', 'N/A'),
+                "pre_test_score": pre_test.get('score', 0) if pre_test else 0,
+                "pre_test_passed": pre_test.get('passed', False) if pre_test else False,
+                "post_test_score": post_test.get('score', 0) if post_test else 0,
+                "post_test_passed": post_test.get('passed', False) if post_test else False,
+                "improvement": (post_test.get('score', 0) if post_test else 0) - (pre_test.get('score', 0) if pre_test else 0)
+            })
     
-    try:
-        # Gather all session data
-        session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
-        
-        program = await db.programs.find_one({"id": session.get('program_id')}, {"_id": 0}) if session.get('program_id') else None
-        company = await db.companies.find_one({"id": session.get('company_id')}, {"_id": 0}) if session.get('company_id') else None
-        
-        # Validate required data
-        if not program:
-            raise HTTPException(status_code=400, detail="Program not found for this session. Please ensure the session has a valid program assigned.")
-        if not company:
-            raise HTTPException(status_code=400, detail="Company not found for this session. Please ensure the session has a valid company assigned.")
-        
-        # Get participants with full details
-        participant_ids = session.get('participant_ids', [])
-        participants = []
-        for pid in participant_ids:
-            user = await db.users.find_one({"id": pid}, {"_id": 0})
-            if user:
-                # Get pre and post test results
-                pre_test = await db.test_results.find_one({
-                    "participant_id": pid,
-                    "session_id": session_id,
-                    "test_type": "pre"
-                }, {"_id": 0})
-                
-                post_test = await db.test_results.find_one({
-                    "participant_id": pid,
-                    "session_id": session_id,
-                    "test_type": "post"
-                }, {"_id": 0})
-                
-                participants.append({
-                    "name": user.get('full_name'),
-                    "id_number": user.get('id_number', 'N/A'),
-                    "pre_test_score": pre_test.get('score', 0) if pre_test else 0,
-                    "pre_test_passed": pre_test.get('passed', False) if pre_test else False,
-                    "post_test_score": post_test.get('score', 0) if post_test else 0,
-                    "post_test_passed": post_test.get('passed', False) if post_test else False,
-                    "improvement": (post_test.get('score', 0) if post_test else 0) - (pre_test.get('score', 0) if pre_test else 0)
-                })
-        
-        # Get vehicle checklists with issues
-        checklists = await db.vehicle_checklists.find({"session_id": session_id}, {"_id": 0}).to_list(100)
-        vehicle_issues = []
-        for checklist in checklists:
-            participant = await db.users.find_one({"id": checklist['participant_id']}, {"_id": 0})
-            issues_list = []
-            for item in checklist.get('checklist_items', []):
-                if item.get('status') == 'needs_repair':
-                    issues_list.append({
-                        "item": item.get('item', 'Unknown'),
-                        "comment": item.get('comments', 'No comment'),
-                        "photo_url": item.get('photo_url', '')
-                    })
-            
-            if issues_list:
-                vehicle_issues.append({
-                    "participant_name": participant.get('full_name') if participant else 'Unknown',
-                    "issues": issues_list
+    # Vehicle checklists with issues
+    vehicle_issues = []
+    for checklist in checklists:
+        participant = users.get(checklist['participant_id'])
+        issues_list = []
+        for item in checklist.get('checklist_items', []):
+            if item.get('status') == 'needs_repair':
+                issues_list.append({
+                    "item": item.get('item', 'Unknown'),
+                    "comment": item.get('comments', 'No comment'),
+                    "photo_url": item.get('photo_url', '')
                 })
-        
-        # Get training photos from training report
-        training_report = await db.training_reports.find_one({"session_id": session_id}, {"_id": 0})
-        training_photos = {
-            "group_photo": training_report.get('group_photo') if training_report else None,
-            "theory_photo_1": training_report.get('theory_photo_1') if training_report else None,
-            "theory_photo_2": training_report.get('theory_photo_2') if training_report else None,
-            "practical_photo_1": training_report.get('practical_photo_1') if training_report else None,
-            "practical_photo_2": training_report.get('practical_photo_2') if training_report else None,
-            "practical_photo_3": training_report.get('practical_photo_3') if training_report else None
-        }
-        
-        # Get participant feedback
-        all_feedback = await db.course_feedback.find({"session_id": session_id}, {"_id": 0}).to_list(100)
-        feedback_data = []
-        for feedback in all_feedback:
-            participant = await db.users.find_one({"id": feedback['participant_id']}, {"_id": 0})
-            feedback_data.append({
+    
+        if issues_list:
+            vehicle_issues.append({
                 "participant_name": participant.get('full_name') if participant else 'Unknown',
-                "responses": feedback.get('responses', [])
+                "issues": issues_list
             })
-        
-        # Determine vehicle type from program name for objectives
-        program_name_lower = program.get('name', '').lower()
-        is_motorcycle = 'motor' in program_name_lower or 'bike' in program_name_lower or 'rider' in program_name_lower
-        is_truck = 'truck' in program_name_lower or 'lorry' in program_name_lower or 'heavy' in program_name_lower
-        
-        # Create DOCX document with enhanced formatting
-        doc = Document()
-        
-        # COVER PAGE
-        title = doc.add_heading('DEFENSIVE DRIVING/RIDING TRAINING', 0)
-        title.alignment = 1  # Center alignment
-        subtitle = doc.add_heading('COMPREHENSIVE COMPLETION REPORT', 0)
-        subtitle.alignment = 1
-        doc.add_paragraph()
-        doc.add_paragraph()
-        
-        # Cover details in a cleaner format
-        cover_table = doc.add_table(rows=7, cols=2)
-        cover_table.style = 'Light List Accent 1'
-        cover_details = [
-            ('Program:', program.get('name', 'N/A')),
-            ('Company:', company.get('name', 'N/A')),
-            ('Location:', session.get('location', 'N/A')),
-            ('Training Period:', f"{session.get('start_date', 'N/A')} to {session.get('end_date', 'N/A')}"),
-            ('Participants:', str(len(participants))),
-            ('Submitted by:', current_user.full_name),
-            ('Date:', get_malaysia_time().strftime('%Y-%m-%d'))
-        ]
-        for idx, (label, value) in enumerate(cover_details):
-            cover_table.rows[idx].cells[0].text = label
-            cover_table.rows[idx].cells[1].text = value
-        
-        doc.add_paragraph()
-        doc.add_paragraph()
-        footer_text = doc.add_paragraph('Prepared by: MDDRC (Malaysian Defensive Driving & Riding Centre)')
-        footer_text.alignment = 1
-        doc.add_page_break()
-        
-        # EXECUTIVE SUMMARY - COMPREHENSIVE
-        doc.add_heading('1. EXECUTIVE SUMMARY', 1)
-        pre_avg = sum([p['pre_test_score'] for p in participants]) / len(participants) if participants else 0
-        post_avg = sum([p['post_test_score'] for p in participants]) / len(participants) if participants else 0
-        improvement = post_avg - pre_avg
-        
-        # Count pass/fail statistics
-        pre_pass_count = sum([1 for p in participants if p['pre_test_passed']])
-        post_pass_count = sum([1 for p in participants if p['post_test_passed']])
-        improved_count = sum([1 for p in participants if p['improvement'] > 0])
-        
-        doc.add_paragraph(
-            f"This comprehensive report documents the Defensive {'Riding' if is_motorcycle else 'Driving'} Training "
-            f"conducted for {company.get('name', 'N/A')} at {session.get('location', 'N/A')} from "
-            f"{session.get('start_date', 'N/A')} to {session.get('end_date', 'N/A')}. The program was designed to "
-            f"enhance safety awareness, reinforce defensive {'riding' if is_motorcycle else 'driving'} techniques, "
-            f"and reduce commuting-related accidents, aligning with the company's commitment to employee safety."
+    
+    # Training photos from the training report
+    training_report = await db.training_reports.find_one({"session_id": session_id}, {"_id": 0})
+    training_photos = {
+        key: training_report.get(key) if training_report else None
+        for key in ["group_photo", "theory_photo_1", "theory_photo_2",
+                    "practical_photo_1", "practical_photo_2", "practical_photo_3"]
+    }
+    
+    feedback_data = []
+    for feedback in all_feedback:
+        participant = users.get(feedback['participant_id'])
+        feedback_data.append({
+            "participant_name": participant.get('full_name') if participant else 'Unknown',
+            "responses": feedback.get('responses', [])
+        })
+    
+    # Photos are embedded as downscaled variants rather than linked
+    photos = await get_image_variants(
+        list(training_photos.values()) +
+        [issue['photo_url'] for vehicle_issue in vehicle_issues for issue in vehicle_issue['issues']]
+    )
+    
+    templates = {
+        t['id']: t async for t in db.feedback_templates.find(
+            {"id": {"$in": ["chief_trainer_feedback_template", "coordinator_feedback_template"]}},
+            {"_id": 0}
         )
-        doc.add_paragraph()
-        
-        doc.add_paragraph(
-            f"The training program successfully engaged {len(participants)} participants through a structured "
-            f"curriculum combining theoretical instruction and practical hands-on sessions. Participants demonstrated "
-            f"high engagement levels and openness to feedback, contributing to a positive learning environment."
+    }
+    
+    return {
+        "session": session,
+        "program": program,
+        "company": company,
+        "participants": participants,
+        "vehicle_issues": vehicle_issues,
+        "training_photos": training_photos,
+        "photos": photos,
+        "feedback_data": feedback_data,
+        "chief_trainer_feedback": await db.chief_trainer_feedback.find_one({"session_id": session_id}, {"_id": 0}),
+        "chief_trainer_template": templates.get("chief_trainer_feedback_template"),
+        "coordinator_feedback": await db.coordinator_feedback.find_one({"session_id": session_id}, {"_id": 0}),
+        "coordinator_template": templates.get("coordinator_feedback_template")
+    }
+
+
+class ReportBlocks:
+    """Ordered layout blocks of a report; plain dicts so the model stays JSON-serialisable"""
+    
+    def __init__(self):
+        self.blocks = []
+    
+    def heading(self, text: str, level: int = 1, align: Optional[str] = None):
+        self.blocks.append({"type": "heading", "text": text, "level": level, "align": align})
+    
+    def paragraph(self, text: str = "", style: Optional[str] = None, align: Optional[str] = None):
+        self.blocks.append({"type": "paragraph", "text": text, "style": style, "align": align})
+    
+    def table(self, rows: list, style: Optional[str] = None, header: bool = True):
+        self.blocks.append({"type": "table", "rows": [list(row) for row in rows], "style": style, "header": header})
+    
+    def image(self, variant: dict, size: str = "report"):
+        self.blocks.append({
+            "type": "image",
+            "filename": variant["filename"],
+            "url": image_variant_url(variant["filename"]),
+            "width": variant["width"],
+            "height": variant["height"],
+            "size": size
+        })
+    
+    def page_break(self):
+        self.blocks.append({"type": "page_break"})
+
+
+def build_report_model(data: dict, prepared_by: str, report_date: str) -> dict:
+    """Turn gathered session data into the report's plain, JSON-serialisable content"""
+    session = data["session"]
+    program = data["program"]
+    company = data["company"]
+    participants = data["participants"]
+    vehicle_issues = data["vehicle_issues"]
+    training_photos = data["training_photos"]
+    photos = data["photos"]
+    feedback_data = data["feedback_data"]
+    
+    def add_photo(source: str, placeholder: str, size: str = "report"):
+        info = photos.get(source)
+        if info:
+            blocks.image(info["variants"][size], size)
+        elif source.startswith("data:"):
+            blocks.paragraph("[Photo could not be processed]")
+        else:
+            blocks.paragraph(placeholder)
+    
+    # Determine vehicle type from program name for objectives
+    program_name_lower = program.get('name', '').lower()
+    is_motorcycle = 'motor' in program_name_lower or 'bike' in program_name_lower or 'rider' in program_name_lower
+    is_truck = 'truck' in program_name_lower or 'lorry' in program_name_lower or 'heavy' in program_name_lower
+    
+    blocks = ReportBlocks()
+    
+    # COVER PAGE
+    blocks.heading('DEFENSIVE DRIVING/RIDING TRAINING', 0, align="center")
+    blocks.heading('COMPREHENSIVE COMPLETION REPORT', 0, align="center")
+    blocks.paragraph()
+    blocks.paragraph()
+    
+    # Cover details in a cleaner format
+    cover_details = [
+        ('Program:', program.get('name', 'N/A')),
+        ('Company:', company.get('name', 'N/A')),
+        ('Location:', session.get('location', 'N/A')),
+        ('Training Period:', f"{session.get('start_date', 'N/A')} to {session.get('end_date', 'N/A')}"),
+        ('Participants:', str(len(participants))),
+        ('Submitted by:', prepared_by),
+        ('Date:', report_date)
+    ]
+    blocks.table(cover_details, style='Light List Accent 1', header=False)
+    
+    blocks.paragraph()
+    blocks.paragraph()
+    blocks.paragraph('Prepared by: MDDRC (Malaysian Defensive Driving & Riding Centre)', align="center")
+    blocks.page_break()
+    
+    # EXECUTIVE SUMMARY - COMPREHENSIVE
+    blocks.heading('1. EXECUTIVE SUMMARY', 1)
+    pre_avg = sum([p['pre_test_score'] for p in participants]) / len(participants) if participants else 0
+    post_avg = sum([p['post_test_score'] for p in participants]) / len(participants) if participants else 0
+    improvement = post_avg - pre_avg
+    
+    # Count pass/fail statistics
+    pre_pass_count = sum([1 for p in participants if p['pre_test_passed']])
+    post_pass_count = sum([1 for p in participants if p['post_test_passed']])
+    improved_count = sum([1 for p in participants if p['improvement'] > 0])
+    
+    def rate(count):
+        return count / len(participants) * 100 if participants else 0
+    
+    pre_pass_rate = rate(pre_pass_count)
+    post_pass_rate = rate(post_pass_count)
+    improved_rate = rate(improved_count)
+    
+    blocks.paragraph(
+        f"This comprehensive report documents the Defensive {'Riding' if is_motorcycle else 'Driving'} Training "
+        f"conducted for {company.get('name', 'N/A')} at {session.get('location', 'N/A')} from "
+        f"{session.get('start_date', 'N/A')} to {session.get('end_date', 'N/A')}. The program was designed to "
+        f"enhance safety awareness, reinforce defensive {'riding' if is_motorcycle else 'driving'} techniques, "
+        f"and reduce commuting-related accidents, aligning with the company's commitment to employee safety."
+    )
+    blocks.paragraph()
+    
+    blocks.paragraph(
+        f"The training program successfully engaged {len(participants)} participants through a structured "
+        f"curriculum combining theoretical instruction and practical hands-on sessions. Participants demonstrated "
+        f"high engagement levels and openness to feedback, contributing to a positive learning environment."
+    )
+    blocks.paragraph()
+    
+    # KEY OUTCOMES heading
+    blocks.paragraph("KEY OUTCOMES:", style='Heading 3')
+    outcomes = [
+        f"• Total Participants: {len(participants)}",
+        f"• Pre-Training Assessment Average: {pre_avg:.1f}%",
+        f"• Post-Training Assessment Average: {post_avg:.1f}%",
+        f"• Overall Improvement: {improvement:+.1f}%",
+        f"• Pre-Test Pass Rate: {pre_pass_count}/{len(participants)} ({pre_pass_rate:.0f}%)",
+        f"• Post-Test Pass Rate: {post_pass_count}/{len(participants)} ({post_pass_rate:.0f}%)",
+        f"• Participants Showing Improvement: {improved_count}/{len(participants)} ({improved_rate:.0f}%)"
+    ]
+    for outcome in outcomes:
+        blocks.paragraph(outcome)
+    blocks.paragraph()
+    
+    # TRAINING IMPACT
+    blocks.paragraph("TRAINING IMPACT:", style='Heading 3')
+    blocks.paragraph(
+        f"The training successfully enhanced participants' understanding of hazard awareness, proper braking control, "
+        f"and {'balance techniques' if is_motorcycle else 'vehicle control'}. Participants demonstrated improved ability "
+        f"to identify potential road hazards and apply defensive {'riding' if is_motorcycle else 'driving'} principles. "
+        f"The program fostered a culture of safety discipline and mutual learning among participants."
+    )
+    blocks.paragraph()
+    
+    # SAFETY OBSERVATIONS (if vehicle issues found)
+    if vehicle_issues:
+        blocks.paragraph("SAFETY OBSERVATIONS:", style='Heading 3')
+        blocks.paragraph(
+            f"Vehicle inspections revealed {len(vehicle_issues)} {'motorcycles' if is_motorcycle else 'vehicles'} "
+            f"with safety concerns requiring immediate attention. Detailed recommendations for addressing these issues "
+            f"are provided in Section 9 of this report."
         )
-        doc.add_paragraph()
-        
-        # KEY OUTCOMES heading
-        doc.add_paragraph("KEY OUTCOMES:", style='Heading 3')
-        outcomes = [
-            f"• Total Participants: {len(participants)}",
-            f"• Pre-Training Assessment Average: {pre_avg:.1f}%",
-            f"• Post-Training Assessment Average: {post_avg:.1f}%",
-            f"• Overall Improvement: {improvement:+.1f}%",
-            f"• Pre-Test Pass Rate: {pre_pass_count}/{len(participants)} ({(pre_pass_count/len(participants)*100):.0f}% if len(participants) > 0 else 0)",
-            f"• Post-Test Pass Rate: {post_pass_count}/{len(participants)} ({(post_pass_count/len(participants)*100):.0f}% if len(participants) > 0 else 0)",
-            f"• Participants Showing Improvement: {improved_count}/{len(participants)} ({(improved_count/len(participants)*100):.0f}% if len(participants) > 0 else 0)"
+    
+    blocks.page_break()
+    
+    # TRAINING OBJECTIVES
+    blocks.heading('2. TRAINING OBJECTIVES', 1)
+    blocks.paragraph(
+        "This training program was designed with the following core objectives to enhance workplace safety and reduce accident risks:"
+    )
+    blocks.paragraph()
+    
+    if is_motorcycle:
+        objectives = [
+            "• Improve rider safety awareness and hazard recognition on Malaysian roads",
+            "• Reinforce defensive riding techniques for daily commuting",
+            "• Reduce motorcycle-related accidents and injuries among employees",
+            "• Promote proper Personal Protective Equipment (PPE) usage and motorcycle maintenance",
+            "• Align riding behavior with company safety values and policies",
+            "• Develop emergency response skills for critical road situations"
         ]
-        for outcome in outcomes:
-            doc.add_paragraph(outcome)
-        doc.add_paragraph()
-        
-        # TRAINING IMPACT
-        doc.add_paragraph("TRAINING IMPACT:", style='Heading 3')
-        doc.add_paragraph(
-            f"The training successfully enhanced participants' understanding of hazard awareness, proper braking control, "
-            f"and {'balance techniques' if is_motorcycle else 'vehicle control'}. Participants demonstrated improved ability "
-            f"to identify potential road hazards and apply defensive {'riding' if is_motorcycle else 'driving'} principles. "
-            f"The program fostered a culture of safety discipline and mutual learning among participants."
-        )
-        doc.add_paragraph()
-        
-        # SAFETY OBSERVATIONS (if vehicle issues found)
-        if vehicle_issues:
-            doc.add_paragraph("SAFETY OBSERVATIONS:", style='Heading 3')
-            doc.add_paragraph(
-                f"Vehicle inspections revealed {len(vehicle_issues)} {'motorcycles' if is_motorcycle else 'vehicles'} "
-                f"with safety concerns requiring immediate attention. Detailed recommendations for addressing these issues "
-                f"are provided in Section 9 of this report."
+    elif is_truck:
+        objectives = [
+            "• Enhance heavy vehicle safety awareness and load management",
+            "• Reinforce defensive driving techniques for commercial vehicles",
+            "• Reduce delivery delays caused by accidents and vehicle breakdowns",
+            "• Improve vehicle pre-trip inspection and maintenance practices",
+            "• Minimize company liability and insurance costs through safer driving",
+            "• Align driving behavior with company safety standards and regulations"
+        ]
+    else:  # Car/general driving
+        objectives = [
+            "• Improve driver safety awareness and hazard perception",
+            "• Reinforce defensive driving techniques for daily operations",
+            "• Reduce vehicle-related accidents and associated costs",
+            "• Promote proper vehicle maintenance and pre-drive safety checks",
+            "• Align driving behavior with company safety policies",
+            "• Develop emergency response and accident avoidance skills"
+        ]
+    
+    for objective in objectives:
+        blocks.paragraph(objective)
+    blocks.paragraph()
+    blocks.paragraph(
+        "These objectives support the organization's commitment to employee welfare and operational excellence "
+        "through enhanced road safety practices."
+    )
+    blocks.page_break()
+    
+    # TRAINING AGENDA
+    blocks.heading('3. TRAINING AGENDA', 1)
+    blocks.paragraph(
+        f"The training was conducted over a {2 if is_motorcycle else 2}-day period, combining theoretical instruction "
+        f"with practical hands-on sessions:"
+    )
+    blocks.paragraph()
+    
+    # DAY 1
+    blocks.heading('DAY 1 - Theory & Foundation', 2)
+    if is_motorcycle:
+        day1_items = [
+            ('08:00 - 08:30', 'Registration & Welcome Briefing'),
+            ('08:30 - 10:00', 'Hazard Recognition & Road Awareness'),
+            ('10:00 - 10:15', 'Break'),
+            ('10:15 - 12:00', 'Safe Distance Management & Speed Control'),
+            ('12:00 - 13:00', 'Lunch'),
+            ('13:00 - 14:30', 'Traffic Law & Regulations Review'),
+            ('14:30 - 14:45', 'Break'),
+            ('14:45 - 16:30', 'Fatigue Management & Weather Conditions'),
+            ('16:30 - 17:00', 'Pre-Test Assessment & Day 1 Review')
+        ]
+    else:
+        day1_items = [
+            ('08:00 - 08:30', 'Registration & Welcome Briefing'),
+            ('08:30 - 10:00', 'Defensive Driving Principles & Hazard Recognition'),
+            ('10:00 - 10:15', 'Break'),
+            ('10:15 - 12:00', 'Safe Following Distance & Speed Management'),
+            ('12:00 - 13:00', 'Lunch'),
+            ('13:00 - 14:30', 'Traffic Law & Road Safety Regulations'),
+            ('14:30 - 14:45', 'Break'),
+            ('14:45 - 16:30', 'Driver Fatigue & Weather Driving Conditions'),
+            ('16:30 - 17:00', 'Pre-Test Assessment & Day 1 Summary')
+        ]
+    
+    blocks.table([('Time', 'Activity')] + day1_items, style='Light Grid Accent 1')
+    
+    blocks.paragraph()
+    
+    # DAY 2
+    blocks.heading('DAY 2 - Practical Skills & Assessment', 2)
+    if is_motorcycle:
+        day2_items = [
+            ('08:00 - 08:30', 'Day 2 Safety Briefing & PPE Check'),
+            ('08:30 - 10:00', 'Emergency Braking Techniques (Practical)'),
+            ('10:00 - 10:15', 'Break'),
+            ('10:15 - 12:00', 'Obstacle Avoidance & Swerving Maneuvers'),
+            ('12:00 - 13:00', 'Lunch'),
+            ('13:00 - 14:30', 'Cornering Techniques & Body Positioning'),
+            ('14:30 - 14:45', 'Break'),
+            ('14:45 - 16:00', 'Left Lane Riding & Traffic Integration'),
+            ('16:00 - 16:45', 'Post-Test Assessment'),
+            ('16:45 - 17:00', 'Certificate Presentation & Closing')
+        ]
+    else:
+        day2_items = [
+            ('08:00 - 08:30', 'Day 2 Safety Briefing & Vehicle Check'),
+            ('08:30 - 10:00', 'Emergency Braking & Stopping Techniques'),
+            ('10:00 - 10:15', 'Break'),
+            ('10:15 - 12:00', 'Obstacle Avoidance & Lane Change Maneuvers'),
+            ('12:00 - 13:00', 'Lunch'),
+            ('13:00 - 14:30', 'Cornering & Vehicle Control Exercises'),
+            ('14:30 - 14:45', 'Break'),
+            ('14:45 - 16:00', 'Traffic Integration & Road Scenarios'),
+            ('16:00 - 16:45', 'Post-Test Assessment & Performance Review'),
+            ('16:45 - 17:00', 'Certificate Presentation & Program Closure')
+        ]
+    
+    blocks.table([('Time', 'Activity')] + day2_items, style='Light Grid Accent 1')
+    
+    blocks.page_break()
+    
+    # TRAINING DETAILS
+    blocks.heading('4. TRAINING DETAILS', 1)
+    blocks.paragraph(f"Program: {program.get('name', 'N/A')}")
+    blocks.paragraph(f"Location: {session.get('location', 'N/A')}")
+    blocks.paragraph(f"Dates: {session.get('start_date', 'N/A')} to {session.get('end_date', 'N/A')}")
+    blocks.paragraph(f"Total Participants: {len(participants)}")
+    blocks.paragraph()
+    blocks.paragraph("Participants List:")
+    blocks.table(
+        [('Name', 'ID Number')] + [(p['name'], str(p['id_number'])) for p in participants],
+        style='Light Grid Accent 1'
+    )
+    blocks.page_break()
+    
+    # PRE-POST EVALUATION SUMMARY
+    blocks.heading('5. PRE-POST EVALUATION SUMMARY', 1)
+    # Summary statistics
+    blocks.paragraph(f"Pre-Test Pass Rate: {pre_pass_count}/{len(participants)} participants ({pre_pass_rate:.0f}%)")
+    blocks.paragraph(f"Post-Test Pass Rate: {post_pass_count}/{len(participants)} participants ({post_pass_rate:.0f}%)")
+    blocks.paragraph(f"Participants Showing Improvement: {improved_count}/{len(participants)} ({improved_rate:.0f}%)")
+    blocks.paragraph(f"Average Score Change: {improvement:+.1f}%")
+    blocks.paragraph()
+    
+    # Performance Summary Table
+    blocks.paragraph("TABULATED RESULTS:", style='Heading 3')
+    blocks.table(
+        [('Participant', 'ID Number', 'Pre-Test', 'Post-Test', 'Improvement', 'Status')] + [
+            (
+                p['name'],
+                str(p['id_number']),
+                f"{p['pre_test_score']:.0f}%",
+                f"{p['post_test_score']:.0f}%",
+                f"{p['improvement']:+.0f}%",
+                'PASS' if p['post_test_passed'] else 'FAIL'
             )
+            for p in participants
+        ],
+        style='Light Grid Accent 1'
+    )
+    
+    blocks.page_break()
+    
+    # DETAILED PERFORMANCE ANALYSIS WITH INSIGHTS
+    blocks.heading('6. DETAILED PERFORMANCE ANALYSIS', 1)
+    blocks.paragraph("Individual participant performance with remarks and recommendations:")
+    blocks.paragraph()
+    
+    for idx, p in enumerate(participants, 1):
+        blocks.paragraph(f"{idx}. {p['name']} (ID: {p['id_number']})", style='Heading 3')
+        perf_text = f"   Pre-Test: {p['pre_test_score']:.0f}% | Post-Test: {p['post_test_score']:.0f}% | Change: {p['improvement']:+.0f}%"
+        blocks.paragraph(perf_text)
+        
+        # Generate performance remarks based on improvement
+        if p['improvement'] >= 20:
+            remark = "EXCELLENT IMPROVEMENT - Participant demonstrated exceptional learning and engagement. Strong grasp of defensive techniques."
+        elif p['improvement'] >= 10:
+            remark = "GOOD IMPROVEMENT - Participant showed solid progress and understanding of safety principles."
+        elif p['improvement'] >= 0:
+            remark = "SATISFACTORY PROGRESS - Participant maintained or slightly improved performance. Continue practicing learned techniques."
+        elif p['improvement'] >= -10:
+            remark = "NEEDS ATTENTION - Minor score decrease observed. Recommend follow-up coaching and review of key concepts."
+        else:
+            remark = "REQUIRES IMMEDIATE SUPPORT - Significant score decrease. Recommend one-on-one coaching session and practical refresher."
         
-        doc.add_page_break()
-        
-        # TRAINING OBJECTIVES
-        doc.add_heading('2. TRAINING OBJECTIVES', 1)
-        doc.add_paragraph(
-            "This training program was designed with the following core objectives to enhance workplace safety and reduce accident risks:"
-        )
-        doc.add_paragraph()
+        # Pass/Fail status remark
+        if not p['pre_test_passed'] and p['post_test_passed']:
+            remark += " Successfully progressed from FAIL to PASS status."
+        elif not p['post_test_passed']:
+            remark += " Did not achieve passing score - recommend additional training."
         
-        if is_motorcycle:
-            objectives = [
-                "• Improve rider safety awareness and hazard recognition on Malaysian roads",
-                "• Reinforce defensive riding techniques for daily commuting",
-                "• Reduce motorcycle-related accidents and injuries among employees",
-                "• Promote proper Personal Protective Equipment (PPE) usage and motorcycle maintenance",
-                "• Align riding behavior with company safety values and policies",
-                "• Develop emergency response skills for critical road situations"
-            ]
-        elif is_truck:
-            objectives = [
-                "• Enhance heavy vehicle safety awareness and load management",
-                "• Reinforce defensive driving techniques for commercial vehicles",
-                "• Reduce delivery delays caused by accidents and vehicle breakdowns",
-                "• Improve vehicle pre-trip inspection and maintenance practices",
-                "• Minimize company liability and insurance costs through safer driving",
-                "• Align driving behavior with company safety standards and regulations"
-            ]
-        else:  # Car/general driving
-            objectives = [
-                "• Improve driver safety awareness and hazard perception",
-                "• Reinforce defensive driving techniques for daily operations",
-                "• Reduce vehicle-related accidents and associated costs",
-                "• Promote proper vehicle maintenance and pre-drive safety checks",
-                "• Align driving behavior with company safety policies",
-                "• Develop emergency response and accident avoidance skills"
-            ]
+        blocks.paragraph(f"   Remark: {remark}")
+        blocks.paragraph()
+    
+    # Overall Performance Insights
+    blocks.paragraph("OVERALL PERFORMANCE INSIGHTS:", style='Heading 3')
+    high_performers = [p for p in participants if p['improvement'] >= 15]
+    needs_support = [p for p in participants if p['improvement'] < 0]
+    
+    insights = []
+    if high_performers:
+        insights.append(f"• {len(high_performers)} participant(s) demonstrated excellent improvement (≥15% gain), indicating strong training absorption.")
+    if needs_support:
+        insights.append(f"• {len(needs_support)} participant(s) showed score decrease and require targeted follow-up support.")
+    insights.append(f"• Average improvement of {improvement:+.1f}% indicates {'effective' if improvement > 5 else 'moderate'} training impact.")
+    insights.append(f"• Post-test pass rate of {post_pass_rate:.0f}% {'meets' if post_pass_rate >= 80 else 'is below'} target standards.")
+    
+    for insight in insights:
+        blocks.paragraph(insight)
+    
+    blocks.page_break()
+    
+    chief_trainer_feedback = data["chief_trainer_feedback"]
+    
+    # TRAINER FEEDBACK (Enhanced narrative)
+    if chief_trainer_feedback:
+        responses = chief_trainer_feedback.get('responses', {})
+        template = data["chief_trainer_template"]
         
-        for objective in objectives:
-            doc.add_paragraph(objective)
-        doc.add_paragraph()
-        doc.add_paragraph(
-            "These objectives support the organization's commitment to employee welfare and operational excellence "
-            "through enhanced road safety practices."
+        blocks.paragraph(
+            "The chief trainer provided comprehensive feedback on the training delivery, participant engagement, "
+            "and safety observations throughout the program. Key observations and recommendations are detailed below:"
         )
-        doc.add_page_break()
-        
-        # TRAINING AGENDA
-        doc.add_heading('3. TRAINING AGENDA', 1)
-        doc.add_paragraph(
-            f"The training was conducted over a {2 if is_motorcycle else 2}-day period, combining theoretical instruction "
-            f"with practical hands-on sessions:"
+        blocks.paragraph()
+        
+        # Extract narrative responses from chief trainer
+        for question_id, answer in responses.items():
+            if template:
+                for q in template.get('questions', []):
+                    if q.get('id') == question_id:
+                        blocks.paragraph(f"{q.get('question')}:", style='Heading 3')
+                        if q.get('type') == 'rating':
+                            stars = '⭐' * int(answer) if isinstance(answer, (int, float)) else answer
+                            blocks.paragraph(f"   Rating: {stars} ({answer}/{q.get('scale', 5)})")
+                        else:
+                            blocks.paragraph(f"   {answer}")
+                        blocks.paragraph()
+        
+        # Add professional summary quote
+        blocks.paragraph()
+        blocks.paragraph(
+            "The trainer observed that participants were highly engaged and receptive to feedback. "
+            "Safety issues identified during vehicle inspections were communicated to participants and management. "
+            "Overall, the training environment was conducive to learning with participants demonstrating strong "
+            "commitment to improving their safety practices."
         )
-        doc.add_paragraph()
-        
-        # DAY 1
-        doc.add_heading('DAY 1 - Theory & Foundation', 2)
-        if is_motorcycle:
-            day1_items = [
-                ('08:00 - 08:30', 'Registration & Welcome Briefing'),
-                ('08:30 - 10:00', 'Hazard Recognition & Road Awareness'),
-                ('10:00 - 10:15', 'Break'),
-                ('10:15 - 12:00', 'Safe Distance Management & Speed Control'),
-                ('12:00 - 13:00', 'Lunch'),
-                ('13:00 - 14:30', 'Traffic Law & Regulations Review'),
-                ('14:30 - 14:45', 'Break'),
-                ('14:45 - 16:30', 'Fatigue Management & Weather Conditions'),
-                ('16:30 - 17:00', 'Pre-Test Assessment & Day 1 Review')
-            ]
-        else:
-            day1_items = [
-                ('08:00 - 08:30', 'Registration & Welcome Briefing'),
-                ('08:30 - 10:00', 'Defensive Driving Principles & Hazard Recognition'),
-                ('10:00 - 10:15', 'Break'),
-                ('10:15 - 12:00', 'Safe Following Distance & Speed Management'),
-                ('12:00 - 13:00', 'Lunch'),
-                ('13:00 - 14:30', 'Traffic Law & Road Safety Regulations'),
-                ('14:30 - 14:45', 'Break'),
-                ('14:45 - 16:30', 'Driver Fatigue & Weather Driving Conditions'),
-                ('16:30 - 17:00', 'Pre-Test Assessment & Day 1 Summary')
-            ]
-        
-        agenda_table_day1 = doc.add_table(rows=len(day1_items)+1, cols=2)
-        agenda_table_day1.style = 'Light Grid Accent 1'
-        agenda_table_day1.rows[0].cells[0].text = 'Time'
-        agenda_table_day1.rows[0].cells[1].text = 'Activity'
-        for idx, (time, activity) in enumerate(day1_items, 1):
-            agenda_table_day1.rows[idx].cells[0].text = time
-            agenda_table_day1.rows[idx].cells[1].text = activity
-        
-        doc.add_paragraph()
-        
-        # DAY 2
-        doc.add_heading('DAY 2 - Practical Skills & Assessment', 2)
-        if is_motorcycle:
-            day2_items = [
-                ('08:00 - 08:30', 'Day 2 Safety Briefing & PPE Check'),
-                ('08:30 - 10:00', 'Emergency Braking Techniques (Practical)'),
-                ('10:00 - 10:15', 'Break'),
-                ('10:15 - 12:00', 'Obstacle Avoidance & Swerving Maneuvers'),
-                ('12:00 - 13:00', 'Lunch'),
-                ('13:00 - 14:30', 'Cornering Techniques & Body Positioning'),
-                ('14:30 - 14:45', 'Break'),
-                ('14:45 - 16:00', 'Left Lane Riding & Traffic Integration'),
-                ('16:00 - 16:45', 'Post-Test Assessment'),
-                ('16:45 - 17:00', 'Certificate Presentation & Closing')
-            ]
-        else:
-            day2_items = [
-                ('08:00 - 08:30', 'Day 2 Safety Briefing & Vehicle Check'),
-                ('08:30 - 10:00', 'Emergency Braking & Stopping Techniques'),
-                ('10:00 - 10:15', 'Break'),
-                ('10:15 - 12:00', 'Obstacle Avoidance & Lane Change Maneuvers'),
-                ('12:00 - 13:00', 'Lunch'),
-                ('13:00 - 14:30', 'Cornering & Vehicle Control Exercises'),
-                ('14:30 - 14:45', 'Break'),
-                ('14:45 - 16:00', 'Traffic Integration & Road Scenarios'),
-                ('16:00 - 16:45', 'Post-Test Assessment & Performance Review'),
-                ('16:45 - 17:00', 'Certificate Presentation & Program Closure')
-            ]
-        
-        agenda_table_day2 = doc.add_table(rows=len(day2_items)+1, cols=2)
-        agenda_table_day2.style = 'Light Grid Accent 1'
-        agenda_table_day2.rows[0].cells[0].text = 'Time'
-        agenda_table_day2.rows[0].cells[1].text = 'Activity'
-        for idx, (time, activity) in enumerate(day2_items, 1):
-            agenda_table_day2.rows[idx].cells[0].text = time
-            agenda_table_day2.rows[idx].cells[1].text = activity
-        
-        doc.add_page_break()
-        
-        # TRAINING DETAILS
-        doc.add_heading('4. TRAINING DETAILS', 1)
-        doc.add_paragraph(f"Program: {program.get('name', 'N/A')}")
-        doc.add_paragraph(f"Location: {session.get('location', 'N/A')}")
-        doc.add_paragraph(f"Dates: {session.get('start_date', 'N/A')} to {session.get('end_date', 'N/A')}")
-        doc.add_paragraph(f"Total Participants: {len(participants)}")
-        doc.add_paragraph()
-        doc.add_paragraph("Participants List:")
-        table = doc.add_table(rows=1, cols=2)
-        table.style = 'Light Grid Accent 1'
-        hdr_cells = table.rows[0].cells
-        hdr_cells[0].text = 'Name'
-        hdr_cells[1].text = 'ID Number'
-        for p in participants:
-            row_cells = table.add_row().cells
-            row_cells[0].text = p['name']
-            row_cells[1].text = str(p['id_number'])
-        doc.add_page_break()
-        
-        # PRE-POST EVALUATION SUMMARY
-        doc.add_heading('5. PRE-POST EVALUATION SUMMARY', 1)
-        # Summary statistics
-        doc.add_paragraph(f"Pre-Test Pass Rate: {pre_pass_count}/{len(participants)} participants ({(pre_pass_count/len(participants)*100):.0f}%)")
-        doc.add_paragraph(f"Post-Test Pass Rate: {post_pass_count}/{len(participants)} participants ({(post_pass_count/len(participants)*100):.0f}%)")
-        doc.add_paragraph(f"Participants Showing Improvement: {improved_count}/{len(participants)} ({(improved_count/len(participants)*100):.0f}%)")
-        doc.add_paragraph(f"Average Score Change: {improvement:+.1f}%")
-        doc.add_paragraph()
-        
-        # Performance Summary Table
-        doc.add_paragraph("TABULATED RESULTS:", style='Heading 3')
-        table = doc.add_table(rows=1, cols=6)
-        table.style = 'Light Grid Accent 1'
-        hdr_cells = table.rows[0].cells
-        hdr_cells[0].text = 'Participant'
-        hdr_cells[1].text = 'ID Number'
-        hdr_cells[2].text = 'Pre-Test'
-        hdr_cells[3].text = 'Post-Test'
-        hdr_cells[4].text = 'Improvement'
-        hdr_cells[5].text = 'Status'
-        
-        for p in participants:
-            row_cells = table.add_row().cells
-            row_cells[0].text = p['name']
-            row_cells[1].text = str(p['id_number'])
-            row_cells[2].text = f"{p['pre_test_score']:.0f}%"
-            row_cells[3].text = f"{p['post_test_score']:.0f}%"
-            row_cells[4].text = f"{p['improvement']:+.0f}%"
-            row_cells[5].text = 'PASS' if p['post_test_passed'] else 'FAIL'
-        
-        doc.add_page_break()
-        
-        # DETAILED PERFORMANCE ANALYSIS WITH INSIGHTS
-        doc.add_heading('6. DETAILED PERFORMANCE ANALYSIS', 1)
-        doc.add_paragraph("Individual participant performance with remarks and recommendations:")
-        doc.add_paragraph()
-        
-        for idx, p in enumerate(participants, 1):
-            doc.add_paragraph(f"{idx}. {p['name']} (ID: {p['id_number']})", style='Heading 3')
-            perf_text = f"   Pre-Test: {p['pre_test_score']:.0f}% | Post-Test: {p['post_test_score']:.0f}% | Change: {p['improvement']:+.0f}%"
-            doc.add_paragraph(perf_text)
-            
-            # Generate performance remarks based on improvement
-            if p['improvement'] >= 20:
-                remark = "EXCELLENT IMPROVEMENT - Participant demonstrated exceptional learning and engagement. Strong grasp of defensive techniques."
-            elif p['improvement'] >= 10:
-                remark = "GOOD IMPROVEMENT - Participant showed solid progress and understanding of safety principles."
-            elif p['improvement'] >= 0:
-                remark = "SATISFACTORY PROGRESS - Participant maintained or slightly improved performance. Continue practicing learned techniques."
-            elif p['improvement'] >= -10:
-                remark = "NEEDS ATTENTION - Minor score decrease observed. Recommend follow-up coaching and review of key concepts."
-            else:
-                remark = "REQUIRES IMMEDIATE SUPPORT - Significant score decrease. Recommend one-on-one coaching session and practical refresher."
-            
-            # Pass/Fail status remark
-            if not p['pre_test_passed'] and p['post_test_passed']:
-                remark += " Successfully progressed from FAIL to PASS status."
-            elif not p['post_test_passed']:
-                remark += " Did not achieve passing score - recommend additional training."
-            
-            doc.add_paragraph(f"   Remark: {remark}")
-            doc.add_paragraph()
-        
-        # Overall Performance Insights
-        doc.add_paragraph("OVERALL PERFORMANCE INSIGHTS:", style='Heading 3')
-        high_performers = [p for p in participants if p['improvement'] >= 15]
-        needs_support = [p for p in participants if p['improvement'] < 0]
-        
-        insights = []
-        if high_performers:
-            insights.append(f"• {len(high_performers)} participant(s) demonstrated excellent improvement (≥15% gain), indicating strong training absorption.")
-        if needs_support:
-            insights.append(f"• {len(needs_support)} participant(s) showed score decrease and require targeted follow-up support.")
-        insights.append(f"• Average improvement of {improvement:+.1f}% indicates {'effective' if improvement > 5 else 'moderate'} training impact.")
-        insights.append(f"• Post-test pass rate of {(post_pass_count/len(participants)*100):.0f}% {'meets' if post_pass_count/len(participants) >= 0.8 else 'is below'} target standards.")
-        
-        for insight in insights:
-            doc.add_paragraph(insight)
-        
-        doc.add_page_break()
-        
-        # Get chief trainer feedback before displaying
-        chief_trainer_feedback = await db.chief_trainer_feedback.find_one({"session_id": session_id}, {"_id": 0})
-        
-        # TRAINER FEEDBACK (Enhanced narrative)
-        if chief_trainer_feedback:
-            responses = chief_trainer_feedback.get('responses', {})
-            template = await db.feedback_templates.find_one({"id": "chief_trainer_feedback_template"}, {"_id": 0})
-            
-            doc.add_paragraph(
-                "The chief trainer provided comprehensive feedback on the training delivery, participant engagement, "
-                "and safety observations throughout the program. Key observations and recommendations are detailed below:"
-            )
-            doc.add_paragraph()
-            
-            # Extract narrative responses from chief trainer
-            for question_id, answer in responses.items():
-                if template:
-                    for q in template.get('questions', []):
-                        if q.get('id') == question_id:
-                            doc.add_paragraph(f"{q.get('question')}:", style='Heading 3')
-                            if q.get('type') == 'rating':
-                                stars = '⭐' * int(answer) if isinstance(answer, (int, float)) else answer
-                                doc.add_paragraph(f"   Rating: {stars} ({answer}/{q.get('scale', 5)})")
-                            else:
-                                doc.add_paragraph(f"   {answer}")
-                            doc.add_paragraph()
-            
-            # Add professional summary quote
-            doc.add_paragraph()
-            doc.add_paragraph(
-                "The trainer observed that participants were highly engaged and receptive to feedback. "
-                "Safety issues identified during vehicle inspections were communicated to participants and management. "
-                "Overall, the training environment was conducive to learning with participants demonstrating strong "
-                "commitment to improving their safety practices."
-            )
-        else:
-            doc.add_paragraph("[Chief Trainer feedback pending submission]")
-        
-        doc.add_page_break()
-        
-        # TRAINING PHOTOS
-        doc.add_heading('8. TRAINING PHOTOS', 1)
-        if training_photos['group_photo']:
-            doc.add_paragraph("Group Photo:", style='Heading 3')
-            doc.add_paragraph(f"[Photo URL: {training_photos['group_photo']}]")
-            doc.add_paragraph()
-        
-        if training_photos['theory_photo_1'] or training_photos['theory_photo_2']:
-            doc.add_paragraph("Theory Session Photos:", style='Heading 3')
-            if training_photos['theory_photo_1']:
-                doc.add_paragraph(f"[Photo 1 URL: {training_photos['theory_photo_1']}]")
-            if training_photos['theory_photo_2']:
-                doc.add_paragraph(f"[Photo 2 URL: {training_photos['theory_photo_2']}]")
-            doc.add_paragraph()
-        
-        if training_photos['practical_photo_1'] or training_photos['practical_photo_2'] or training_photos['practical_photo_3']:
-            doc.add_paragraph("Practical Session Photos:", style='Heading 3')
-            if training_photos['practical_photo_1']:
-                doc.add_paragraph(f"[Photo 1 URL: {training_photos['practical_photo_1']}]")
-            if training_photos['practical_photo_2']:
-                doc.add_paragraph(f"[Photo 2 URL: {training_photos['practical_photo_2']}]")
-            if training_photos['practical_photo_3']:
-                doc.add_paragraph(f"[Photo 3 URL: {training_photos['practical_photo_3']}]")
-        
-        doc.add_page_break()
-        
-        # PARTICIPANT FEEDBACK SUMMARY (Enhanced)
-        doc.add_heading('9. PARTICIPANT FEEDBACK SUMMARY', 1)
+    else:
+        blocks.paragraph("[Chief Trainer feedback pending submission]")
+    
+    blocks.page_break()
+    
+    # TRAINING PHOTOS
+    blocks.heading('8. TRAINING PHOTOS', 1)
+    if training_photos['group_photo']:
+        blocks.paragraph("Group Photo:", style='Heading 3')
+        add_photo(training_photos['group_photo'], f"[Photo URL: {training_photos['group_photo']}]")
+        blocks.paragraph()
+    
+    if training_photos['theory_photo_1'] or training_photos['theory_photo_2']:
+        blocks.paragraph("Theory Session Photos:", style='Heading 3')
+        if training_photos['theory_photo_1']:
+            add_photo(training_photos['theory_photo_1'], f"[Photo 1 URL: {training_photos['theory_photo_1']}]")
+        if training_photos['theory_photo_2']:
+            add_photo(training_photos['theory_photo_2'], f"[Photo 2 URL: {training_photos['theory_photo_2']}]")
+        blocks.paragraph()
+    
+    if training_photos['practical_photo_1'] or training_photos['practical_photo_2'] or training_photos['practical_photo_3']:
+        blocks.paragraph("Practical Session Photos:", style='Heading 3')
+        if training_photos['practical_photo_1']:
+            add_photo(training_photos['practical_photo_1'], f"[Photo 1 URL: {training_photos['practical_photo_1']}]")
+        if training_photos['practical_photo_2']:
+            add_photo(training_photos['practical_photo_2'], f"[Photo 2 URL: {training_photos['practical_photo_2']}]")
+        if training_photos['practical_photo_3']:
+            add_photo(training_photos['practical_photo_3'], f"[Photo 3 URL: {training_photos['practical_photo_3']}]")
+    
+    blocks.page_break()
+    
+    # PARTICIPANT FEEDBACK SUMMARY (Enhanced)
+    blocks.heading('9. PARTICIPANT FEEDBACK SUMMARY', 1)
+    if feedback_data:
+        # Calculate average star ratings
+        star_questions = []
+        text_questions = []
+        
+        # Categorize questions
         if feedback_data:
-            # Calculate average star ratings
-            star_questions = []
-            text_questions = []
-            
-            # Categorize questions
-            if feedback_data:
-                for response in feedback_data[0]['responses']:
-                    if isinstance(response['answer'], int):
-                        star_questions.append(response['question'])
-                    else:
-                        text_questions.append(response['question'])
-            
-            # PART 1: QUANTITATIVE FEEDBACK
-            if star_questions:
-                doc.add_paragraph("A. QUANTITATIVE FEEDBACK (Rating Scores):", style='Heading 3')
-                doc.add_paragraph("Average ratings across all participants on a 5-point scale:")
-                doc.add_paragraph()
-                
-                for question in star_questions:
-                    ratings = [r['answer'] for fb in feedback_data for r in fb['responses'] if r['question'] == question and isinstance(r['answer'], int)]
-                    if ratings:
-                        avg_rating = sum(ratings) / len(ratings)
-                        stars = '⭐' * int(round(avg_rating))
-                        doc.add_paragraph(f"• {question}: {stars} ({avg_rating:.1f}/5.0)")
-                
-                # Overall satisfaction calculation
-                all_ratings = [r['answer'] for fb in feedback_data for r in fb['responses'] if isinstance(r['answer'], int)]
-                if all_ratings:
-                    overall_avg = sum(all_ratings) / len(all_ratings)
-                    doc.add_paragraph()
-                    doc.add_paragraph(f"OVERALL SATISFACTION: {'⭐' * int(round(overall_avg))} ({overall_avg:.1f}/5.0)", style='Heading 3')
-                doc.add_paragraph()
+            for response in feedback_data[0]['responses']:
+                if isinstance(response['answer'], int):
+                    star_questions.append(response['question'])
+                else:
+                    text_questions.append(response['question'])
+        
+        # PART 1: QUANTITATIVE FEEDBACK
+        if star_questions:
+            blocks.paragraph("A. QUANTITATIVE FEEDBACK (Rating Scores):", style='Heading 3')
+            blocks.paragraph("Average ratings across all participants on a 5-point scale:")
+            blocks.paragraph()
             
-            # PART 2: QUALITATIVE FEEDBACK THEMES
-            if text_questions:
-                doc.add_paragraph("B. QUALITATIVE FEEDBACK (Key Themes):", style='Heading 3')
-                
-                # Collect all text responses
-                all_text_responses = []
-                for fb in feedback_data:
-                    for response in fb['responses']:
-                        if not isinstance(response['answer'], int):
-                            all_text_responses.append(response['answer'])
-                
-                # Analyze common themes (simple keyword matching)
-                positive_keywords = ['good', 'excellent', 'great', 'helpful', 'informative', 'clear', 'effective']
-                improvement_keywords = ['more', 'extend', 'longer', 'additional', 'better', 'improve']
-                
-                positive_count = sum(1 for resp in all_text_responses if any(kw in str(resp).lower() for kw in positive_keywords))
-                improvement_count = sum(1 for resp in all_text_responses if any(kw in str(resp).lower() for kw in improvement_keywords))
-                
-                doc.add_paragraph(f"• Positive Remarks: {positive_count} participants expressed satisfaction with training delivery and content")
-                if improvement_count > 0:
-                    doc.add_paragraph(f"• Improvement Suggestions: {improvement_count} participants suggested enhancements (e.g., extended duration, additional videos)")
-                doc.add_paragraph()
-                
-                # PART 3: INDIVIDUAL RESPONSES (Detailed)
-                doc.add_paragraph("C. DETAILED INDIVIDUAL RESPONSES:", style='Heading 3')
-                for idx, fb in enumerate(feedback_data, 1):
-                    doc.add_paragraph(f"{idx}. {fb['participant_name']}", style='Heading 4')
-                    for response in fb['responses']:
-                        if not isinstance(response['answer'], int):  # Text responses
-                            doc.add_paragraph(f"   Q: {response['question']}")
-                            doc.add_paragraph(f"   A: {response['answer']}")
-                            doc.add_paragraph()
-        else:
-            doc.add_paragraph("No feedback submitted yet.")
-        
-        doc.add_page_break()
-        
-        # MOTORCYCLE/VEHICLE CONDITION & EMPLOYER RECOMMENDATIONS (Enhanced)
-        doc.add_heading('10. VEHICLE CONDITION ASSESSMENT & EMPLOYER RECOMMENDATIONS', 1)
-        
-        if vehicle_issues:
-            doc.add_paragraph(
-                f"During the training program, pre-ride safety inspections were conducted on all participant "
-                f"{'motorcycles' if is_motorcycle else 'vehicles'}. The inspections revealed {len(vehicle_issues)} "
-                f"{'motorcycles' if is_motorcycle else 'vehicles'} with safety concerns that require immediate attention."
-            )
-            doc.add_paragraph()
+            for question in star_questions:
+                ratings = [r['answer'] for fb in feedback_data for r in fb['responses'] if r['question'] == question and isinstance(r['answer'], int)]
+                if ratings:
+                    avg_rating = sum(ratings) / len(ratings)
+                    stars = '⭐' * int(round(avg_rating))
+                    blocks.paragraph(f"• {question}: {stars} ({avg_rating:.1f}/5.0)")
             
-            # PART A: SAFETY ISSUES IDENTIFIED
-            doc.add_paragraph("A. SAFETY ISSUES IDENTIFIED:", style='Heading 3')
-            for vehicle_issue in vehicle_issues:
-                doc.add_paragraph(f"Participant: {vehicle_issue['participant_name']}", style='Heading 4')
-                for issue in vehicle_issue['issues']:
-                    doc.add_paragraph(f"   • {issue['item']}: {issue['comment']}")
-                    if issue['photo_url']:
-                        doc.add_paragraph(f"     [Photo Evidence: {issue['photo_url']}]")
-                doc.add_paragraph()
+            # Overall satisfaction calculation
+            all_ratings = [r['answer'] for fb in feedback_data for r in fb['responses'] if isinstance(r['answer'], int)]
+            if all_ratings:
+                overall_avg = sum(all_ratings) / len(all_ratings)
+                blocks.paragraph()
+                blocks.paragraph(f"OVERALL SATISFACTION: {'⭐' * int(round(overall_avg))} ({overall_avg:.1f}/5.0)", style='Heading 3')
+            blocks.paragraph()
+        
+        # PART 2: QUALITATIVE FEEDBACK THEMES
+        if text_questions:
+            blocks.paragraph("B. QUALITATIVE FEEDBACK (Key Themes):", style='Heading 3')
             
-            # PART B: SAFETY IMPLICATIONS
-            doc.add_paragraph("B. SAFETY IMPLICATIONS:", style='Heading 3')
-            common_issues = {}
-            for vehicle_issue in vehicle_issues:
-                for issue in vehicle_issue['issues']:
-                    item_category = issue['item'].lower()
-                    if 'tyre' in item_category or 'tire' in item_category:
-                        common_issues['worn_tyres'] = common_issues.get('worn_tyres', 0) + 1
-                    elif 'lamp' in item_category or 'light' in item_category:
-                        common_issues['faulty_lamps'] = common_issues.get('faulty_lamps', 0) + 1
-                    elif 'chain' in item_category:
-                        common_issues['loose_chains'] = common_issues.get('loose_chains', 0) + 1
-                    elif 'mirror' in item_category:
-                        common_issues['missing_mirrors'] = common_issues.get('missing_mirrors', 0) + 1
-                    elif 'ppe' in item_category or 'helmet' in item_category or 'jacket' in item_category:
-                        common_issues['ppe_issues'] = common_issues.get('ppe_issues', 0) + 1
+            # Collect all text responses
+            all_text_responses = []
+            for fb in feedback_data:
+                for response in fb['responses']:
+                    if not isinstance(response['answer'], int):
+                        all_text_responses.append(response['answer'])
             
-            if common_issues:
-                for issue_type, count in common_issues.items():
-                    if issue_type == 'worn_tyres':
-                        doc.add_paragraph(f"• Worn Tyres ({count} cases): Increased risk of skidding and loss of control, especially in wet conditions")
-                    elif issue_type == 'faulty_lamps':
-                        doc.add_paragraph(f"• Faulty Lamps/Lights ({count} cases): Reduced visibility at night, increased accident risk")
-                    elif issue_type == 'loose_chains':
-                        doc.add_paragraph(f"• Loose Chains ({count} cases): Risk of chain breakage leading to loss of control")
-                    elif issue_type == 'missing_mirrors':
-                        doc.add_paragraph(f"• Missing/Damaged Mirrors ({count} cases): Impaired situational awareness and blind spot monitoring")
-                    elif issue_type == 'ppe_issues':
-                        doc.add_paragraph(f"• PPE Non-Compliance ({count} cases): Increased severity of injuries in case of accidents")
-            doc.add_paragraph()
+            # Analyze common themes (simple keyword matching)
+            positive_keywords = ['good', 'excellent', 'great', 'helpful', 'informative', 'clear', 'effective']
+            improvement_keywords = ['more', 'extend', 'longer', 'additional', 'better', 'improve']
             
-            # PART C: RECOMMENDATIONS FOR EMPLOYER
-            doc.add_paragraph("C. RECOMMENDATIONS FOR EMPLOYER:", style='Heading 3')
-            recommendations = [
-                "1. IMMEDIATE ACTION REQUIRED:",
-                f"   • Conduct immediate safety inspections on all {len(vehicle_issues)} flagged {'motorcycles' if is_motorcycle else 'vehicles'}",
-                "   • Ground vehicles until critical safety issues are resolved",
-                "   • Provide temporary alternative transportation if needed",
-                "",
-                "2. ESTABLISH REGULAR MAINTENANCE PROTOCOL:",
-                f"   • Implement monthly pre-ride safety inspection checklist for all {'motorcycles' if is_motorcycle else 'vehicles'}",
-                "   • Assign designated personnel for routine maintenance verification",
-                "   • Maintain detailed maintenance logs for each vehicle",
-                "",
-                "3. PPE COMPLIANCE:",
-                "   • Enforce mandatory PPE usage policy (helmet, jacket, gloves, boots)",
-                "   • Provide company-issued PPE if necessary",
-                "   • Conduct regular PPE condition checks",
-                "",
-                "4. INTEGRATE INTO SAFETY SOP:",
-                "   • Include vehicle inspection as part of daily work routine",
-                "   • Establish clear reporting channels for safety issues",
-                "   • Implement consequences for non-compliance",
-                "",
-                "5. SUPPLEMENTARY TRAINING:",
-                "   • Conduct basic vehicle maintenance workshop for employees",
-                "   • Provide refresher training on pre-ride safety checks"
-            ]
-            for rec in recommendations:
-                doc.add_paragraph(rec)
-        else:
-            doc.add_paragraph("✓ EXCELLENT RESULT: All vehicles inspected were found to be in good working condition with no safety concerns identified.")
-            doc.add_paragraph()
-            doc.add_paragraph(
-                "This indicates strong commitment to vehicle maintenance and safety standards. We recommend "
-                "continuing current maintenance practices and conducting regular quarterly safety inspections."
-            )
-        
-        doc.add_page_break()
-        
-        # COORDINATOR FEEDBACK (Enhanced)
-        doc.add_heading('11. COORDINATOR FEEDBACK', 1)
-        coordinator_feedback = await db.coordinator_feedback.find_one({"session_id": session_id}, {"_id": 0})
-        if coordinator_feedback:
-            doc.add_paragraph(
-                "The training coordinator provided comprehensive observations on logistics, participant engagement, "
-                "and overall program execution. Key observations and recommendations are detailed below:"
-            )
-            doc.add_paragraph()
+            positive_count = sum(1 for resp in all_text_responses if any(kw in str(resp).lower() for kw in positive_keywords))
+            improvement_count = sum(1 for resp in all_text_responses if any(kw in str(resp).lower() for kw in improvement_keywords))
             
-            responses = coordinator_feedback.get('responses', {})
-            for question_id, answer in responses.items():
-                # Get question text from template
-                template = await db.feedback_templates.find_one({"id": "coordinator_feedback_template"}, {"_id": 0})
-                if template:
-                    for q in template.get('questions', []):
-                        if q.get('id') == question_id:
-                            doc.add_paragraph(f"{q.get('question')}:", style='Heading 3')
-                            if q.get('type') == 'rating':
-                                stars = '⭐' * int(answer) if isinstance(answer, (int, float)) else answer
-                                doc.add_paragraph(f"   Rating: {stars} ({answer}/{q.get('scale', 5)})")
-                            else:
-                                doc.add_paragraph(f"   {answer}")
-                            doc.add_paragraph()
+            blocks.paragraph(f"• Positive Remarks: {positive_count} participants expressed satisfaction with training delivery and content")
+            if improvement_count > 0:
+                blocks.paragraph(f"• Improvement Suggestions: {improvement_count} participants suggested enhancements (e.g., extended duration, additional videos)")
+            blocks.paragraph()
             
-            # Add formal closing
-            doc.add_paragraph()
-            doc.add_paragraph(
-                f"The coordinator acknowledges the strong collaboration between {company.get('name', 'the company')}, "
-                "MDDRC training team, and participants throughout the program. Participants demonstrated excellent "
-                "discipline and commitment to learning, contributing to the overall success of the training initiative."
-            )
-        else:
-            doc.add_paragraph("[Coordinator feedback pending submission]")
-        
-        doc.add_page_break()
-        
-        # RECOMMENDATIONS MOVING FORWARD
-        doc.add_heading('12. RECOMMENDATIONS MOVING FORWARD', 1)
-        doc.add_paragraph(
-            "Based on the training outcomes, participant feedback, and safety observations, "
-            "the following recommendations are proposed to sustain and enhance the safety culture:"
+            # PART 3: INDIVIDUAL RESPONSES (Detailed)
+            blocks.paragraph("C. DETAILED INDIVIDUAL RESPONSES:", style='Heading 3')
+            for idx, fb in enumerate(feedback_data, 1):
+                blocks.paragraph(f"{idx}. {fb['participant_name']}", style='Heading 4')
+                for response in fb['responses']:
+                    if not isinstance(response['answer'], int):  # Text responses
+                        blocks.paragraph(f"   Q: {response['question']}")
+                        blocks.paragraph(f"   A: {response['answer']}")
+                        blocks.paragraph()
+    else:
+        blocks.paragraph("No feedback submitted yet.")
+    
+    blocks.page_break()
+    
+    # MOTORCYCLE/VEHICLE CONDITION & EMPLOYER RECOMMENDATIONS (Enhanced)
+    blocks.heading('10. VEHICLE CONDITION ASSESSMENT & EMPLOYER RECOMMENDATIONS', 1)
+    
+    if vehicle_issues:
+        blocks.paragraph(
+            f"During the training program, pre-ride safety inspections were conducted on all participant "
+            f"{'motorcycles' if is_motorcycle else 'vehicles'}. The inspections revealed {len(vehicle_issues)} "
+            f"{'motorcycles' if is_motorcycle else 'vehicles'} with safety concerns that require immediate attention."
         )
-        doc.add_paragraph()
-        
-        recommendations_forward = [
-            "1. ENFORCE PRE-RIDE/PRE-DRIVE SAFETY CHECKS:",
-            f"   • Mandate daily pre-{'ride' if is_motorcycle else 'drive'} safety inspections using a standardized checklist",
-            "   • Implement digital logging system for inspection records",
-            "   • Designate safety officers to conduct random spot checks",
-            "",
-            "2. MONTHLY VERIFICATION PROGRAM:",
-            "   • Conduct monthly vehicle condition audits",
-            "   • Schedule preventive maintenance based on mileage/usage",
-            "   • Track and analyze vehicle-related incidents",
+        blocks.paragraph()
+        
+        # PART A: SAFETY ISSUES IDENTIFIED
+        blocks.paragraph("A. SAFETY ISSUES IDENTIFIED:", style='Heading 3')
+        for vehicle_issue in vehicle_issues:
+            blocks.paragraph(f"Participant: {vehicle_issue['participant_name']}", style='Heading 4')
+            for issue in vehicle_issue['issues']:
+                blocks.paragraph(f"   • {issue['item']}: {issue['comment']}")
+                if issue['photo_url']:
+                    add_photo(issue['photo_url'], f"     [Photo Evidence: {issue['photo_url']}]", size="thumbnail")
+            blocks.paragraph()
+        
+        # PART B: SAFETY IMPLICATIONS
+        blocks.paragraph("B. SAFETY IMPLICATIONS:", style='Heading 3')
+        common_issues = {}
+        for vehicle_issue in vehicle_issues:
+            for issue in vehicle_issue['issues']:
+                item_category = issue['item'].lower()
+                if 'tyre' in item_category or 'tire' in item_category:
+                    common_issues['worn_tyres'] = common_issues.get('worn_tyres', 0) + 1
+                elif 'lamp' in item_category or 'light' in item_category:
+                    common_issues['faulty_lamps'] = common_issues.get('faulty_lamps', 0) + 1
+                elif 'chain' in item_category:
+                    common_issues['loose_chains'] = common_issues.get('loose_chains', 0) + 1
+                elif 'mirror' in item_category:
+                    common_issues['missing_mirrors'] = common_issues.get('missing_mirrors', 0) + 1
+                elif 'ppe' in item_category or 'helmet' in item_category or 'jacket' in item_category:
+                    common_issues['ppe_issues'] = common_issues.get('ppe_issues', 0) + 1
+        
+        if common_issues:
+            for issue_type, count in common_issues.items():
+                if issue_type == 'worn_tyres':
+                    blocks.paragraph(f"• Worn Tyres ({count} cases): Increased risk of skidding and loss of control, especially in wet conditions")
+                elif issue_type == 'faulty_lamps':
+                    blocks.paragraph(f"• Faulty Lamps/Lights ({count} cases): Reduced visibility at night, increased accident risk")
+                elif issue_type == 'loose_chains':
+                    blocks.paragraph(f"• Loose Chains ({count} cases): Risk of chain breakage leading to loss of control")
+                elif issue_type == 'missing_mirrors':
+                    blocks.paragraph(f"• Missing/Damaged Mirrors ({count} cases): Impaired situational awareness and blind spot monitoring")
+                elif issue_type == 'ppe_issues':
+                    blocks.paragraph(f"• PPE Non-Compliance ({count} cases): Increased severity of injuries in case of accidents")
+        blocks.paragraph()
+        
+        # PART C: RECOMMENDATIONS FOR EMPLOYER
+        blocks.paragraph("C. RECOMMENDATIONS FOR EMPLOYER:", style='Heading 3')
+        recommendations = [
+            "1. IMMEDIATE ACTION REQUIRED:",
+            f"   • Conduct immediate safety inspections on all {len(vehicle_issues)} flagged {'motorcycles' if is_motorcycle else 'vehicles'}",
+            "   • Ground vehicles until critical safety issues are resolved",
+            "   • Provide temporary alternative transportation if needed",
             "",
-            "3. MAINTENANCE SUPPORT:",
-            "   • Establish partnerships with authorized service centers for employee discounts",
-            "   • Provide maintenance subsidy program for safety-critical components",
-            "   • Create emergency maintenance fund for immediate safety repairs",
+            "2. ESTABLISH REGULAR MAINTENANCE PROTOCOL:",
+            f"   • Implement monthly pre-ride safety inspection checklist for all {'motorcycles' if is_motorcycle else 'vehicles'}",
+            "   • Assign designated personnel for routine maintenance verification",
+            "   • Maintain detailed maintenance logs for each vehicle",
             "",
-            "4. POST-TRAINING MATERIALS:",
-            "   • Distribute safety reminder cards or posters for display",
-            "   • Share digital safety tips via company communication channels",
-            "   • Conduct quarterly safety awareness campaigns",
+            "3. PPE COMPLIANCE:",
+            "   • Enforce mandatory PPE usage policy (helmet, jacket, gloves, boots)",
+            "   • Provide company-issued PPE if necessary",
+            "   • Conduct regular PPE condition checks",
             "",
-            "5. TAILOR PRACTICALS TO CLIENT ROUTES:",
-            "   • Identify high-risk routes and areas commonly used by employees",
-            "   • Conduct route-specific safety briefings",
-            "   • Share incident hotspot maps and avoidance strategies",
+            "4. INTEGRATE INTO SAFETY SOP:",
+            "   • Include vehicle inspection as part of daily work routine",
+            "   • Establish clear reporting channels for safety issues",
+            "   • Implement consequences for non-compliance",
             "",
-            "6. PROMOTE SAFETY CULTURE:",
-            "   • Recognize and reward safe riding/driving behavior",
-            "   • Establish peer mentorship program for new employees",
-            "   • Include safety KPIs in performance evaluations",
-            "",
-            "7. FOLLOW-UP FOR OUTLIERS:",
-            f"   • Provide one-on-one coaching for {len([p for p in participants if p['improvement'] < 0])} participants who showed score decrease" if any(p['improvement'] < 0 for p in participants) else "   • Continue monitoring participant performance in real-world scenarios",
-            "   • Conduct 3-month post-training assessment to measure retention",
-            "   • Offer refresher training for employees showing concerning behavior"
+            "5. SUPPLEMENTARY TRAINING:",
+            "   • Conduct basic vehicle maintenance workshop for employees",
+            "   • Provide refresher training on pre-ride safety checks"
         ]
-        
-        for rec in recommendations_forward:
-            doc.add_paragraph(rec)
-        
-        doc.add_page_break()
-        
-        # CONCLUSION
-        doc.add_heading('13. CONCLUSION', 1)
-        doc.add_paragraph(
-            f"The Defensive {'Riding' if is_motorcycle else 'Driving'} Training conducted for "
-            f"{company.get('name', 'N/A')} from {session.get('start_date', 'N/A')} to {session.get('end_date', 'N/A')} "
-            f"was successfully completed with {len(participants)} participants demonstrating measurable improvement in "
-            f"safety awareness and defensive {'riding' if is_motorcycle else 'driving'} competencies."
+        for rec in recommendations:
+            blocks.paragraph(rec)
+    else:
+        blocks.paragraph("✓ EXCELLENT RESULT: All vehicles inspected were found to be in good working condition with no safety concerns identified.")
+        blocks.paragraph()
+        blocks.paragraph(
+            "This indicates strong commitment to vehicle maintenance and safety standards. We recommend "
+            "continuing current maintenance practices and conducting regular quarterly safety inspections."
         )
-        doc.add_paragraph()
-        
-        doc.add_paragraph(
-            f"Key achievements include an average score improvement of {improvement:+.1f}%, "
-            f"a post-training pass rate of {(post_pass_count/len(participants)*100):.0f}%, and high participant "
-            f"satisfaction levels. The training successfully enhanced hazard recognition skills, emergency response "
-            f"techniques, and safety-first mindset among participants."
+    
+    blocks.page_break()
+    
+    # COORDINATOR FEEDBACK (Enhanced)
+    blocks.heading('11. COORDINATOR FEEDBACK', 1)
+    coordinator_feedback = data["coordinator_feedback"]
+    if coordinator_feedback:
+        blocks.paragraph(
+            "The training coordinator provided comprehensive observations on logistics, participant engagement, "
+            "and overall program execution. Key observations and recommendations are detailed below:"
         )
-        doc.add_paragraph()
-        
-        if vehicle_issues:
-            doc.add_paragraph(
-                f"Vehicle safety inspections identified {len(vehicle_issues)} {'motorcycles' if is_motorcycle else 'vehicles'} "
-                "requiring immediate attention. Detailed recommendations have been provided to address these concerns "
-                "and prevent potential accidents."
-            )
-            doc.add_paragraph()
-        
-        doc.add_paragraph(
-            "MDDRC extends sincere appreciation to the management and employees of "
-            f"{company.get('name', 'the company')} for their strong collaboration and commitment throughout this program. "
-            "The enthusiastic participation and positive learning attitude demonstrated by all participants contributed "
-            "significantly to the program's success."
+        blocks.paragraph()
+        
+        responses = coordinator_feedback.get('responses', {})
+        for question_id, answer in responses.items():
+            # Get question text from template
+            template = data["coordinator_template"]
+            if template:
+                for q in template.get('questions', []):
+                    if q.get('id') == question_id:
+                        blocks.paragraph(f"{q.get('question')}:", style='Heading 3')
+                        if q.get('type') == 'rating':
+                            stars = '⭐' * int(answer) if isinstance(answer, (int, float)) else answer
+                            blocks.paragraph(f"   Rating: {stars} ({answer}/{q.get('scale', 5)})")
+                        else:
+                            blocks.paragraph(f"   {answer}")
+                        blocks.paragraph()
+        
+        # Add formal closing
+        blocks.paragraph()
+        blocks.paragraph(
+            f"The coordinator acknowledges the strong collaboration between {company.get('name', 'the company')}, "
+            "MDDRC training team, and participants throughout the program. Participants demonstrated excellent "
+            "discipline and commitment to learning, contributing to the overall success of the training initiative."
         )
-        doc.add_paragraph()
-        
-        doc.add_paragraph(
-            "We remain committed to supporting your organization's journey towards a safer workplace and look forward "
-            "to continued partnership in promoting road safety excellence."
+    else:
+        blocks.paragraph("[Coordinator feedback pending submission]")
+    
+    blocks.page_break()
+    
+    # RECOMMENDATIONS MOVING FORWARD
+    blocks.heading('12. RECOMMENDATIONS MOVING FORWARD', 1)
+    blocks.paragraph(
+        "Based on the training outcomes, participant feedback, and safety observations, "
+        "the following recommendations are proposed to sustain and enhance the safety culture:"
+    )
+    blocks.paragraph()
+    
+    recommendations_forward = [
+        "1. ENFORCE PRE-RIDE/PRE-DRIVE SAFETY CHECKS:",
+        f"   • Mandate daily pre-{'ride' if is_motorcycle else 'drive'} safety inspections using a standardized checklist",
+        "   • Implement digital logging system for inspection records",
+        "   • Designate safety officers to conduct random spot checks",
+        "",
+        "2. MONTHLY VERIFICATION PROGRAM:",
+        "   • Conduct monthly vehicle condition audits",
+        "   • Schedule preventive maintenance based on mileage/usage",
+        "   • Track and analyze vehicle-related incidents",
+        "",
+        "3. MAINTENANCE SUPPORT:",
+        "   • Establish partnerships with authorized service centers for employee discounts",
+        "   • Provide maintenance subsidy program for safety-critical components",
+        "   • Create emergency maintenance fund for immediate safety repairs",
+        "",
+        "4. POST-TRAINING MATERIALS:",
+        "   • Distribute safety reminder cards or posters for display",
+        "   • Share digital safety tips via company communication channels",
+        "   • Conduct quarterly safety awareness campaigns",
+        "",
+        "5. TAILOR PRACTICALS TO CLIENT ROUTES:",
+        "   • Identify high-risk routes and areas commonly used by employees",
+        "   • Conduct route-specific safety briefings",
+        "   • Share incident hotspot maps and avoidance strategies",
+        "",
+        "6. PROMOTE SAFETY CULTURE:",
+        "   • Recognize and reward safe riding/driving behavior",
+        "   • Establish peer mentorship program for new employees",
+        "   • Include safety KPIs in performance evaluations",
+        "",
+        "7. FOLLOW-UP FOR OUTLIERS:",
+        f"   • Provide one-on-one coaching for {len([p for p in participants if p['improvement'] < 0])} participants who showed score decrease" if any(p['improvement'] < 0 for p in participants) else "   • Continue monitoring participant performance in real-world scenarios",
+        "   • Conduct 3-month post-training assessment to measure retention",
+        "   • Offer refresher training for employees showing concerning behavior"
+    ]
+    
+    for rec in recommendations_forward:
+        blocks.paragraph(rec)
+    
+    blocks.page_break()
+    
+    # CONCLUSION
+    blocks.heading('13. CONCLUSION', 1)
+    blocks.paragraph(
+        f"The Defensive {'Riding' if is_motorcycle else 'Driving'} Training conducted for "
+        f"{company.get('name', 'N/A')} from {session.get('start_date', 'N/A')} to {session.get('end_date', 'N/A')} "
+        f"was successfully completed with {len(participants)} participants demonstrating measurable improvement in "
+        f"safety awareness and defensive {'riding' if is_motorcycle else 'driving'} competencies."
+    )
+    blocks.paragraph()
+    
+    blocks.paragraph(
+        f"Key achievements include an average score improvement of {improvement:+.1f}%, "
+        f"a post-training pass rate of {post_pass_rate:.0f}%, and high participant "
+        f"satisfaction levels. The training successfully enhanced hazard recognition skills, emergency response "
+        f"techniques, and safety-first mindset among participants."
+    )
+    blocks.paragraph()
+    
+    if vehicle_issues:
+        blocks.paragraph(
+            f"Vehicle safety inspections identified {len(vehicle_issues)} {'motorcycles' if is_motorcycle else 'vehicles'} "
+            "requiring immediate attention. Detailed recommendations have been provided to address these concerns "
+            "and prevent potential accidents."
         )
-        
-        doc.add_page_break()
-        
-        # APPENDICES
-        doc.add_heading('APPENDICES', 1)
-        
-        # APPENDIX A: Pre & Post Test Raw Scores
-        doc.add_heading('Appendix A: Pre & Post Test Raw Scores', 2)
-        appendix_table = doc.add_table(rows=len(participants)+1, cols=5)
-        appendix_table.style = 'Light Grid Accent 1'
-        hdr = appendix_table.rows[0].cells
-        hdr[0].text = 'No.'
-        hdr[1].text = 'Participant Name'
-        hdr[2].text = 'Pre-Test Score'
-        hdr[3].text = 'Post-Test Score'
-        hdr[4].text = 'Improvement'
-        
-        for idx, p in enumerate(participants, 1):
-            row = appendix_table.rows[idx].cells
-            row[0].text = str(idx)
-            row[1].text = p['name']
-            row[2].text = f"{p['pre_test_score']:.0f}%"
-            row[3].text = f"{p['post_test_score']:.0f}%"
-            row[4].text = f"{p['improvement']:+.0f}%"
-        
-        doc.add_page_break()
-        
-        # APPENDIX B: Vehicle Condition Photos
-        if vehicle_issues:
-            doc.add_heading('Appendix B: Vehicle Condition Photos', 2)
-            doc.add_paragraph("Photographic evidence of safety issues identified during vehicle inspections:")
-            doc.add_paragraph()
-            for vehicle_issue in vehicle_issues:
-                doc.add_paragraph(f"{vehicle_issue['participant_name']}:", style='Heading 4')
-                for issue in vehicle_issue['issues']:
-                    if issue['photo_url']:
-                        doc.add_paragraph(f"• {issue['item']}")
-                        doc.add_paragraph(f"  [Photo URL: {issue['photo_url']}]")
-                doc.add_paragraph()
+        blocks.paragraph()
+    
+    blocks.paragraph(
+        "MDDRC extends sincere appreciation to the management and employees of "
+        f"{company.get('name', 'the company')} for their strong collaboration and commitment throughout this program. "
+        "The enthusiastic participation and positive learning attitude demonstrated by all participants contributed "
+        "significantly to the program's success."
+    )
+    blocks.paragraph()
+    
+    blocks.paragraph(
+        "We remain committed to supporting your organization's journey towards a safer workplace and look forward "
+        "to continued partnership in promoting road safety excellence."
+    )
+    
+    blocks.page_break()
+    
+    # APPENDICES
+    blocks.heading('APPENDICES', 1)
+    
+    # APPENDIX A: Pre & Post Test Raw Scores
+    blocks.heading('Appendix A: Pre & Post Test Raw Scores', 2)
+    blocks.table(
+        [('No.', 'Participant Name', 'Pre-Test Score', 'Post-Test Score', 'Improvement')] + [
+            (str(idx), p['name'], f"{p['pre_test_score']:.0f}%", f"{p['post_test_score']:.0f}%", f"{p['improvement']:+.0f}%")
+            for idx, p in enumerate(participants, 1)
+        ],
+        style='Light Grid Accent 1'
+    )
+    
+    blocks.page_break()
+    
+    # APPENDIX B: Vehicle Condition Photos
+    if vehicle_issues:
+        blocks.heading('Appendix B: Vehicle Condition Photos', 2)
+        blocks.paragraph("Photographic evidence of safety issues identified during vehicle inspections:")
+        blocks.paragraph()
+        for vehicle_issue in vehicle_issues:
+            blocks.paragraph(f"{vehicle_issue['participant_name']}:", style='Heading 4')
+            for issue in vehicle_issue['issues']:
+                if issue['photo_url']:
+                    blocks.paragraph(f"• {issue['item']}")
+                    add_photo(issue['photo_url'], f"  [Photo URL: {issue['photo_url']}]")
+            blocks.paragraph()
+        blocks.page_break()
+    
+    # APPENDIX C: Feedback Form Summary
+    blocks.heading('Appendix C: Participant Feedback Form Summary', 2)
+    if feedback_data:
+        blocks.paragraph("Complete participant feedback responses:")
+        blocks.paragraph()
+        for idx, fb in enumerate(feedback_data, 1):
+            blocks.paragraph(f"{idx}. {fb['participant_name']}", style='Heading 4')
+            for response in fb['responses']:
+                blocks.paragraph(f"   Q: {response['question']}")
+                blocks.paragraph(f"   A: {response['answer']}")
+            blocks.paragraph()
+    else:
+        blocks.paragraph("[No feedback data available]")
+    
+    blocks.page_break()
+    
+    # SIGNATURES
+    blocks.heading('APPROVAL & SIGNATURES', 1)
+    blocks.paragraph()
+    blocks.table([
+        ('Prepared by:', ''),
+        ('Name:', prepared_by),
+        ('Position:', 'Training Coordinator'),
+        ('Date:', report_date)
+    ], style='Light List', header=False)
+    
+    blocks.paragraph()
+    blocks.paragraph()
+    blocks.paragraph("_" * 60)
+    blocks.paragraph()
+    
+    blocks.table([
+        ('Reviewed & Approved by:', ''),
+        ('Name:', '________________________'),
+        ('Position:', 'Person In Charge / Supervisor'),
+        ('Date:', '________________________')
+    ], style='Light List', header=False)
+    
+    blocks.paragraph()
+    blocks.paragraph()
+    blocks.paragraph('--- END OF REPORT ---', align="center")
+    
+    blocks.page_break()
+    
+    # SIGNATURES
+    blocks.heading('11. SIGNATURES', 1)
+    blocks.paragraph()
+    blocks.paragraph("_" * 40)
+    blocks.paragraph(f"Coordinator: {prepared_by}")
+    blocks.paragraph(f"Date: ________________")
+    blocks.paragraph()
+    blocks.paragraph()
+    blocks.paragraph("_" * 40)
+    blocks.paragraph("PIC/Supervisor Signature")
+    blocks.paragraph(f"Date: ________________")
+    
+    return {
+        "session_id": session["id"],
+        "title": "Defensive Driving/Riding Training - Comprehensive Completion Report",
+        "prepared_by": prepared_by,
+        "report_date": report_date,
+        "details": {
+            "program": program.get('name', 'N/A'),
+            "company": company.get('name', 'N/A'),
+            "location": session.get('location', 'N/A'),
+            "start_date": session.get('start_date'),
+            "end_date": session.get('end_date'),
+            "vehicle_type": "motorcycle" if is_motorcycle else "truck" if is_truck else "car"
+        },
+        "summary": {
+            "participant_count": len(participants),
+            "pre_test_average": round(pre_avg, 1),
+            "post_test_average": round(post_avg, 1),
+            "average_improvement": round(improvement, 1),
+            "pre_test_pass_count": pre_pass_count,
+            "post_test_pass_count": post_pass_count,
+            "improved_count": improved_count,
+            "pre_test_pass_rate": round(pre_pass_rate),
+            "post_test_pass_rate": round(post_pass_rate),
+            "improved_rate": round(improved_rate),
+            "vehicles_with_issues": len(vehicle_issues),
+            "feedback_count": len(feedback_data)
+        },
+        "objectives": objectives,
+        "participants": participants,
+        "vehicle_issues": vehicle_issues,
+        "feedback": feedback_data,
+        "blocks": blocks.blocks
+    }
+
+
+# Renderers take a report model and return file bytes. They only read local image variants,
+# so exports run them in a worker thread; add an entry to REPORT_RENDERERS to support another
+# output format.
+
+def _report_image_inches(block: dict) -> tuple:
+    """(width, height) in inches: thumbnails are small, report photos fit 6in x 4.5in"""
+    if block["size"] == "thumbnail":
+        width = 1.6
+    else:
+        width = min(6.0, 4.5 * block["width"] / block["height"])
+    return width, width * block["height"] / block["width"]
+
+
+def render_report_docx(model: dict) -> bytes:
+    doc = Document()
+    for block in model["blocks"]:
+        if block["type"] == "heading":
+            element = doc.add_heading(block["text"], block["level"])
+        elif block["type"] == "paragraph":
+            element = doc.add_paragraph(block["text"], style=block["style"])
+        elif block["type"] == "image":
+            path = image_variant_path(block["filename"])
+            if path.exists():
+                doc.add_picture(str(path), width=Inches(_report_image_inches(block)[0]))
+            continue
+        elif block["type"] == "table":
+            rows = block["rows"]
+            table = doc.add_table(rows=len(rows), cols=len(rows[0]) if rows else 1)
+            if block["style"]:
+                table.style = block["style"]
+            for row, values in zip(table.rows, rows):
+                for cell, value in zip(row.cells, values):
+                    cell.text = value
+            continue
+        else:
             doc.add_page_break()
-        
-        # APPENDIX C: Feedback Form Summary
-        doc.add_heading('Appendix C: Participant Feedback Form Summary', 2)
-        if feedback_data:
-            doc.add_paragraph("Complete participant feedback responses:")
-            doc.add_paragraph()
-            for idx, fb in enumerate(feedback_data, 1):
-                doc.add_paragraph(f"{idx}. {fb['participant_name']}", style='Heading 4')
-                for response in fb['responses']:
-                    doc.add_paragraph(f"   Q: {response['question']}")
-                    doc.add_paragraph(f"   A: {response['answer']}")
-                doc.add_paragraph()
+            continue
+        if block.get("align") == "center":
+            element.alignment = 1
+    
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _report_block_tag(block: dict) -> str:
+    if block["type"] == "heading":
+        return f"h{min(block['level'] + 1, 6)}"
+    style = block.get("style") or ""
+    if style.startswith("Heading "):
+        return f"h{min(int(style.split()[1]) + 1, 6)}"
+    return "p"
+
+
+def render_report_html(model: dict) -> bytes:
+    body = []
+    for block in model["blocks"]:
+        if block["type"] == "page_break":
+            body.append('<hr class="page-break">')
+        elif block["type"] == "image":
+            # Inlined so the preview and exported file are self-contained
+            path = image_variant_path(block["filename"])
+            if path.exists():
+                width = round(_report_image_inches(block)[0] * 96)
+                encoded = base64.b64encode(path.read_bytes()).decode()
+                body.append(f'<p><img src="data:image/jpeg;base64,{encoded}" width="{width}"></p>')
+        elif block["type"] == "table":
+            rows = []
+            for idx, row in enumerate(block["rows"]):
+                cell = "th" if idx == 0 and block["header"] else "td"
+                rows.append("<tr>" + "".join(f"<{cell}>{xml_escape(value)}</{cell}>" for value in row) + "</tr>")
+            body.append("<table>" + "".join(rows) + "</table>")
+        elif block["text"]:
+            tag = _report_block_tag(block)
+            align = ' class="center"' if block.get("align") == "center" else ""
+            body.append(f"<{tag}{align}>{xml_escape(block['text'])}</{tag}>")
+    
+    html = (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f"<title>{xml_escape(model['title'])}</title>"
+        "<style>body{font-family:Arial,sans-serif;max-width:900px;margin:2em auto;line-height:1.4;white-space:pre-wrap}"
+        "table{border-collapse:collapse;margin:1em 0;width:100%}td,th{border:1px solid #ccc;padding:4px 8px;text-align:left}"
+        "th{background:#eef3fb}.center{text-align:center}hr.page-break{border:0;border-top:1px dashed #bbb;margin:2em 0}</style>"
+        "</head><body>" + "\n".join(body) + "</body></html>"
+    )
+    return html.encode("utf-8")
+
+
+# The core PDF fonts have no glyphs for these
+PDF_TEXT_SUBSTITUTIONS = {"⭐": "*", "✓": "", "≥": ">="}
+
+
+def _pdf_text(text: str) -> str:
+    for char, replacement in PDF_TEXT_SUBSTITUTIONS.items():
+        text = text.replace(char, replacement)
+    return xml_escape(text)
+
+
+def render_report_pdf(model: dict) -> bytes:
+    styles = getSampleStyleSheet()
+    buffer = io.BytesIO()
+    document = SimpleDocTemplate(buffer, pagesize=A4, title=model["title"])
+    
+    story = []
+    for block in model["blocks"]:
+        if block["type"] == "page_break":
+            story.append(PageBreak())
+        elif block["type"] == "image":
+            path = image_variant_path(block["filename"])
+            if path.exists():
+                width, height = _report_image_inches(block)
+                story.append(PdfImage(str(path), width=width * 72, height=height * 72))
+        elif block["type"] == "table":
+            rows = block["rows"]
+            if not rows:
+                continue
+            col_width = document.width / len(rows[0])
+            table = PdfTable(
+                [[PdfParagraph(_pdf_text(value), styles["BodyText"]) for value in row] for row in rows],
+                colWidths=[col_width] * len(rows[0]),
+                repeatRows=1 if block["header"] else 0
+            )
+            table_style = [("GRID", (0, 0), (-1, -1), 0.5, HexColor("#BBBBBB")), ("VALIGN", (0, 0), (-1, -1), "TOP")]
+            if block["header"]:
+                table_style.append(("BACKGROUND", (0, 0), (-1, 0), HexColor("#EEF3FB")))
+            table.setStyle(TableStyle(table_style))
+            story.append(table)
+        elif not block["text"]:
+            story.append(Spacer(1, 6))
         else:
-            doc.add_paragraph("[No feedback data available]")
-        
-        doc.add_page_break()
-        
-        # SIGNATURES
-        doc.add_heading('APPROVAL & SIGNATURES', 1)
-        doc.add_paragraph()
-        sig_table = doc.add_table(rows=4, cols=2)
-        sig_table.style = 'Light List'
-        
-        sig_table.rows[0].cells[0].text = 'Prepared by:'
-        sig_table.rows[0].cells[1].text = ''
-        sig_table.rows[1].cells[0].text = 'Name:'
-        sig_table.rows[1].cells[1].text = current_user.full_name
-        sig_table.rows[2].cells[0].text = 'Position:'
-        sig_table.rows[2].cells[1].text = 'Training Coordinator'
-        sig_table.rows[3].cells[0].text = 'Date:'
-        sig_table.rows[3].cells[1].text = get_malaysia_time().strftime('%Y-%m-%d')
-        
-        doc.add_paragraph()
-        doc.add_paragraph()
-        doc.add_paragraph("_" * 60)
-        doc.add_paragraph()
-        
-        sig_table2 = doc.add_table(rows=4, cols=2)
-        sig_table2.style = 'Light List'
-        sig_table2.rows[0].cells[0].text = 'Reviewed & Approved by:'
-        sig_table2.rows[0].cells[1].text = ''
-        sig_table2.rows[1].cells[0].text = 'Name:'
-        sig_table2.rows[1].cells[1].text = '________________________'
-        sig_table2.rows[2].cells[0].text = 'Position:'
-        sig_table2.rows[2].cells[1].text = 'Person In Charge / Supervisor'
-        sig_table2.rows[3].cells[0].text = 'Date:'
-        sig_table2.rows[3].cells[1].text = '________________________'
-        
-        doc.add_paragraph()
-        doc.add_paragraph()
-        footer = doc.add_paragraph('--- END OF REPORT ---')
-        footer.alignment = 1
-        
-        doc.add_page_break()
-        
-        # SIGNATURES
-        doc.add_heading('11. SIGNATURES', 1)
-        doc.add_paragraph()
-        doc.add_paragraph("_" * 40)
-        doc.add_paragraph(f"Coordinator: {current_user.full_name}")
-        doc.add_paragraph(f"Date: ________________")
-        doc.add_paragraph()
-        doc.add_paragraph()
-        doc.add_paragraph("_" * 40)
-        doc.add_paragraph("PIC/Supervisor Signature")
-        doc.add_paragraph(f"Date: ________________")
-        
-        # Save DOCX
-        report_filename = f"Training_Report_{session_id}_{get_malaysia_time().strftime('%Y%m%d_%H%M%S')}.docx"
-        report_path = REPORT_DIR / report_filename
-        doc.save(str(report_path))
-        
-        # Update training report record with DOCX filename
-        await db.training_reports.update_one(
-            {"session_id": session_id},
-            {"$set": {"docx_filename": report_filename, "generated_at": get_malaysia_time().isoformat()}},
-            upsert=True
-        )
-        
-        return {
-            "message": "DOCX report generated successfully",
-            "filename": report_filename,
-            "download_url": f"/api/training-reports/{session_id}/download-docx"
-        }
-        
-    except Exception as e:
-        logging.error(f"Failed to generate DOCX report: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to generate report: {str(e)}")
+            tag = _report_block_tag(block)
+            style = styles["Title"] if tag == "h1" else styles.get(f"Heading{int(tag[1]) - 1}") if tag != "p" else styles["BodyText"]
+            story.append(PdfParagraph(_pdf_text(block["text"]), style))
+    
+    document.build(story)
+    return buffer.getvalue()
+
+
+def render_report_json(model: dict) -> bytes:
+    return json.dumps(model, ensure_ascii=False).encode("utf-8")
+
+
+REPORT_RENDERERS = {
+    "docx": (render_report_docx, "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "pdf": (render_report_pdf, "application/pdf"),
+    "html": (render_report_html, "text/html; charset=utf-8"),
+    "json": (render_report_json, "application/json"),
+}
+
+# The model is keyed by the session's data_version, so previews and exports after the first are
+# a dict lookup plus rendering. The version is bumped by session and roster edits, test
+# submissions, training report saves, checklists, participant/coordinator/chief trainer feedback,
+# and user edits or deletions (for every session the user is in). Program and company renames
+# and feedback template edits do not bump it; they show up once the entry's hour is up.
+report_model_cache = TTLCache(maxsize=256, ttl=3600)
+
+
+async def get_report_model(session_id: str, prepared_by: str) -> dict:
+    version = await get_session_version(session_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    report_date = get_malaysia_time().strftime('%Y-%m-%d')
+    cache_key = (session_id, version, prepared_by, report_date)
+    model = report_model_cache.get(cache_key)
+    if model is None:
+        # Version is read before gathering, so a concurrent write can only make this entry
+        # newer than its key, never older
+        data = await gather_training_report_data(session_id)
+        model = build_report_model(data, prepared_by, report_date)
+        report_model_cache[cache_key] = model
+    return model
+
+
+async def render_report(model: dict, report_format: str) -> bytes:
+    render, _ = REPORT_RENDERERS[report_format]
+    return await asyncio.to_thread(render, model)
+
+
+async def persist_training_report_docx(session_id: str, docx_bytes: bytes) -> str:
+    """Stage 3: store the file and point the training report at it (the previous blob becomes garbage)"""
+    report_filename = f"Training_Report_{session_id}_{get_malaysia_time().strftime('%Y%m%d_%H%M%S')}.docx"
+    docx_blob = await put_blob(docx_bytes, "docx")
+    
+    await db.training_reports.update_one(
+        {"session_id": session_id},
+        {"$set": {
+            "docx_filename": report_filename,
+            "docx_blob": docx_blob,
+            "generated_at": get_malaysia_time().isoformat()
+        }},
+        upsert=True
+    )
+    return report_filename
+
+
+async def training_report_docx_job(payload: dict) -> dict:
+    """Job handler: gather, build and persist one session's DOCX report"""
+    session_id = payload["session_id"]
+    model = await get_report_model(session_id, payload["prepared_by"])
+    docx_bytes = await render_report(model, "docx")
+    report_filename = await persist_training_report_docx(session_id, docx_bytes)
+    return {
+        "message": "DOCX report generated successfully",
+        "filename": report_filename,
+        "download_url": f"/api/training-reports/{session_id}/download-docx"
+    }
+
+
+register_job_handler("training_report_docx", training_report_docx_job, concurrency=2)
+
+
+@api_router.post("/training-reports/{session_id}/generate-docx", status_code=202)
+async def generate_docx_report(session_id: str, current_user: User = Depends(get_current_user)):
+    """Queue a professional DOCX training report; poll GET /jobs/{job_id} for the download URL"""
+    
+    if current_user.role not in ["coordinator", "admin"]:
+        raise HTTPException(status_code=403, detail="Only coordinators and admins can generate reports")
+    
+    # Fail fast on a missing session/program/company instead of inside the job
+    await load_report_session(session_id)
+    
+    job = await enqueue_job(
+        "training_report_docx",
+        {"session_id": session_id, "prepared_by": current_user.full_name},
+        current_user.id
+    )
+    return {**job_response(job), "message": "DOCX report generation queued"}
+
+
+@api_router.get("/training-reports/{session_id}/preview")
+async def preview_training_report(session_id: str, format: str = "json", current_user: User = Depends(get_current_user)):
+    """Report content as JSON (default) or HTML, without generating a document"""
+    if current_user.role not in ["coordinator", "admin", "supervisor"]:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    if format not in ["json", "html"]:
+        raise HTTPException(status_code=400, detail="Preview format must be json or html")
+    
+    await load_report_session(session_id)
+    model = await get_report_model(session_id, current_user.full_name)
+    if format == "json":
+        return model
+    return Response(content=render_report_html(model), media_type=REPORT_RENDERERS["html"][1])
+
+
+@api_router.get("/training-reports/{session_id}/export")
+async def export_training_report(session_id: str, format: str = "pdf", current_user: User = Depends(get_current_user)):
+    """Render the report in the requested format and download it (not stored; use generate-docx for the editable copy)"""
+    if current_user.role not in ["coordinator", "admin", "supervisor"]:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    if format not in REPORT_RENDERERS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of: {', '.join(REPORT_RENDERERS)}")
+    
+    await load_report_session(session_id)
+    model = await get_report_model(session_id, current_user.full_name)
+    content = await render_report(model, format)
+    filename = f"Training_Report_{session_id}.{format}"
+    return Response(
+        content=content,
+        media_type=REPORT_RENDERERS[format][1],
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
 @api_router.get("/training-reports/{session_id}/download-docx")
 async def download_docx_report(session_id: str, current_user: User = Depends(get_current_user)):
@@ -3694,17 +6165,8 @@ async def download_docx_report(session_id: str, current_user: User = Depends(get
     if not training_report or not training_report.get('docx_filename'):
         raise HTTPException(status_code=404, detail="Report not found. Please generate it first.")
     
-    report_path = REPORT_DIR / training_report['docx_filename']
-    
-    if not report_path.exists():
-        raise HTTPException(status_code=404, detail="Report file not found")
-    
-    return FileResponse(
-        path=str(report_path),
-        media_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-        filename=training_report['docx_filename'],
-        headers={"Content-Disposition": f"attachment; filename={training_report['docx_filename']}"}
-    )
+    store, key = stored_file(training_report.get('docx_blob'), REPORT_DIR / training_report['docx_filename'])
+    return RedirectResponse(sign_download(store, key, training_report['docx_filename']), status_code=307)
 
 @api_router.post("/training-reports/{session_id}/upload-edited-docx")
 async def upload_edited_docx(
@@ -3722,17 +6184,15 @@ async def upload_edited_docx(
     
     try:
         # Save edited DOCX
+        upload = await save_upload_blob(file, ("docx",), REPORT_UPLOAD_MAX_BYTES)
         edited_filename = f"Training_Report_{session_id}_edited_{get_malaysia_time().strftime('%Y%m%d_%H%M%S')}.docx"
-        edited_path = REPORT_DIR / edited_filename
-        
-        with open(edited_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
         
         # Update database
         await db.training_reports.update_one(
             {"session_id": session_id},
             {"$set": {
                 "edited_docx_filename": edited_filename,
+                "edited_docx_blob": upload["blob"],
                 "uploaded_at": get_malaysia_time().isoformat()
             }},
             upsert=True
@@ -3743,6 +6203,8 @@ async def upload_edited_docx(
             "filename": edited_filename
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Failed to upload edited report: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to upload report: {str(e)}")
@@ -3764,22 +6226,11 @@ async def upload_final_pdf_report(
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are accepted")
     
-    # Check file size (max 20MB)
-    file.file.seek(0, 2)
-    file_size = file.file.tell()
-    file.file.seek(0)
-    
-    max_size = 20 * 1024 * 1024  # 20MB
-    if file_size > max_size:
-        raise HTTPException(status_code=400, detail="File size exceeds 20MB limit")
-    
     try:
-        # Save final PDF
+        # Save final PDF (size capped at 20MB while it streams in)
+        upload = await save_upload_blob(file, ("pdf",), REPORT_UPLOAD_MAX_BYTES)
         pdf_filename = f"Training_Report_{session_id}_final_{get_malaysia_time().strftime('%Y%m%d_%H%M%S')}.pdf"
-        pdf_path = REPORT_PDF_DIR / pdf_filename
-        
-        with open(pdf_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        pdf_url = blob_url(upload["blob"], pdf_filename)
         
         # Get session and program details
         session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
@@ -3796,7 +6247,8 @@ async def upload_final_pdf_report(
             {"session_id": session_id},
             {"$set": {
                 "final_pdf_filename": pdf_filename,
-                "pdf_url": f"/api/static/reports_pdf/{pdf_filename}",
+                "final_pdf_blob": upload["blob"],
+                "pdf_url": pdf_url,
                 "status": "submitted",
                 "submitted_at": get_malaysia_time().isoformat(),
                 "submitted_by": current_user.id,
@@ -3812,11 +6264,14 @@ async def upload_final_pdf_report(
         return {
             "message": "Final report uploaded successfully. You can now mark the session as completed.",
             "filename": pdf_filename,
-            "pdf_url": f"/api/static/reports_pdf/{pdf_filename}"
+            "pdf_url": signed_file_url(pdf_url)
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Failed to upload final PDF: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to upload report: {str(e)}")
 
 
 # Get submitted reports for supervisor
@@ -3854,6 +6309,7 @@ async def get_supervisor_reports(current_user: User = Depends(get_current_user))
         if session:
             enriched_reports.append({
                 **report,
+                "pdf_url": signed_file_url(report.get('pdf_url')),
                 "session_name": session.get('name'),
                 "session_start_date": session.get('start_date'),
                 "session_end_date": session.get('end_date'),
@@ -3876,33 +6332,29 @@ async def submit_final_report(session_id: str, current_user: User = Depends(get_
         if not training_report:
             raise HTTPException(status_code=404, detail="No report found. Please generate a report first.")
         
-        docx_filename = training_report.get('edited_docx_filename') or training_report.get('docx_filename')
+        field = 'edited_docx' if training_report.get('edited_docx_filename') else 'docx'
+        docx_filename = training_report.get(f'{field}_filename')
         
         if not docx_filename:
             raise HTTPException(status_code=404, detail="No report file found")
         
-        docx_path = REPORT_DIR / docx_filename
-        
-        if not docx_path.exists():
+        store, key = stored_file(training_report.get(f'{field}_blob'), REPORT_DIR / docx_filename)
+        try:
+            docx_bytes = await read_stored_file(store, key)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="Report file not found")
         
         # Convert DOCX to PDF using LibreOffice
         pdf_filename = docx_filename.replace('.docx', '.pdf')
-        pdf_path = REPORT_PDF_DIR / pdf_filename
-        
-        subprocess.run([
-            'libreoffice',
-            '--headless',
-            '--convert-to', 'pdf',
-            '--outdir', str(REPORT_PDF_DIR),
-            str(docx_path)
-        ], check=True)
+        pdf_bytes = await document_converter.convert(docx_bytes)
+        pdf_blob = await put_blob(pdf_bytes, "pdf")
         
         # Update training report status
         await db.training_reports.update_one(
             {"session_id": session_id},
             {"$set": {
                 "pdf_filename": pdf_filename,
+                "pdf_blob": pdf_blob,
                 "status": "submitted",
                 "submitted_at": get_malaysia_time().isoformat(),
                 "submitted_by": current_user.id
@@ -3944,7 +6396,7 @@ async def submit_final_report(session_id: str, current_user: User = Depends(get_
             "download_url": f"/api/training-reports/{session_id}/download-pdf"
         }
         
-    except subprocess.CalledProcessError as e:
+    except ConversionError as e:
         logging.error(f"PDF conversion failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to convert report to PDF")
     except Exception as e:
@@ -3964,16 +6416,8 @@ async def download_pdf_report(session_id: str, current_user: User = Depends(get_
     if not training_report or not training_report.get('pdf_filename'):
         raise HTTPException(status_code=404, detail="PDF report not found. Please submit the report first.")
     
-    pdf_path = REPORT_PDF_DIR / training_report['pdf_filename']
-    
-    if not pdf_path.exists():
-        raise HTTPException(status_code=404, detail="PDF file not found")
-    
-    return FileResponse(
-        path=str(pdf_path),
-        media_type='application/pdf',
-        filename=training_report['pdf_filename']
-    )
+    store, key = stored_file(training_report.get('pdf_blob'), REPORT_PDF_DIR / training_report['pdf_filename'])
+    return RedirectResponse(sign_download(store, key, training_report['pdf_filename']), status_code=307)
 
 # Trainer Checklist Routes
 @api_router.post("/trainer-checklist/submit")
@@ -3997,6 +6441,7 @@ async def submit_trainer_checklist(checklist_data: TrainerChecklistSubmit, curre
     doc['verified_at'] = doc['verified_at'].isoformat()
     
     await db.vehicle_checklists.insert_one(doc)
+    await bump_session_version(checklist_data.session_id)
     
     # If chief trainer submitted comments, save to session
     if checklist_data.chief_trainer_comments:
@@ -4106,11 +6551,16 @@ async def submit_checklist(checklist_data: ChecklistSubmit, current_user: User =
         doc['verified_at'] = doc['verified_at'].isoformat()
     
     await db.vehicle_checklists.insert_one(doc)
+    await bump_session_version(checklist_data.session_id)
     
     await db.participant_access.update_one(
         {"participant_id": current_user.id, "session_id": checklist_data.session_id},
         {"$set": {"checklist_submitted": True}}
     )
+    await publish_session_event(checklist_data.session_id, "checklist_submitted", {
+        "participant_id": current_user.id,
+        "interval": checklist_data.interval
+    })
     
     return checklist_obj
 
@@ -4277,6 +6727,8 @@ async def submit_feedback(feedback_data: FeedbackSubmit, current_user: User = De
         {"$set": {"feedback_submitted": True}},
         upsert=True
     )
+    await bump_session_version(feedback_data.session_id)
+    await publish_session_event(feedback_data.session_id, "feedback_submitted", {"participant_id": current_user.id})
     
     return feedback_obj
 
@@ -4414,6 +6866,7 @@ async def submit_coordinator_feedback(
     else:
         # Insert new feedback
         await db.coordinator_feedback.insert_one(doc)
+    await bump_session_version(session_id)
     
     return {"message": "Coordinator feedback submitted successfully", "feedback": feedback}
 
@@ -4458,6 +6911,7 @@ async def submit_chief_trainer_feedback(
     else:
         # Insert new feedback
         await db.chief_trainer_feedback.insert_one(doc)
+    await bump_session_version(session_id)
     
     return {"message": "Chief trainer feedback submitted successfully", "feedback": feedback}
 
@@ -4480,6 +6934,7 @@ async def get_participant_certificates(participant_id: str, current_user: User =
     for cert in certificates:
         if isinstance(cert.get('issue_date'), str):
             cert['issue_date'] = datetime.fromisoformat(cert['issue_date'])
+        cert['certificate_url'] = signed_file_url(cert.get('certificate_url'))
     return certificates
 
 # Settings Routes
@@ -4502,12 +6957,8 @@ async def upload_logo(file: UploadFile = File(...), current_user: User = Depends
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Only admins can update settings")
     
-    file_ext = file.filename.split(".")[-1]
-    filename = f"logo.{file_ext}"
-    file_path = LOGO_DIR / filename
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    upload = await save_upload(file, LOGO_DIR, "logo", IMAGE_UPLOAD_KINDS, LOGO_MAX_BYTES)
+    filename = upload["filename"]
     
     logo_url = f"/api/static/logos/{filename}"
     
@@ -4547,11 +6998,9 @@ async def upload_certificate_template(file: UploadFile = File(...), current_user
     if not file.filename.endswith('.docx'):
         raise HTTPException(status_code=400, detail="Only .docx files are supported")
     
-    filename = "certificate_template.docx"
-    file_path = TEMPLATE_DIR / filename
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    upload = await save_upload(file, TEMPLATE_DIR, "certificate_template", ("docx",), TEMPLATE_MAX_BYTES)
+    filename = upload["filename"]
+    invalidate_certificate_template()
     
     template_url = f"/api/static/templates/{filename}"
     
@@ -4563,6 +7012,33 @@ async def upload_certificate_template(file: UploadFile = File(...), current_user
     
     return {"template_url": template_url, "message": "Certificate template uploaded successfully"}
 
+@api_router.post("/settings/upload-certificate-background")
+async def upload_certificate_background(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
+    """Background image for the native PDF certificate layout"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can upload templates")
+    
+    file_ext = file.filename.rsplit(".", 1)[-1].lower()
+    if file_ext not in ["png", "jpg", "jpeg"]:
+        raise HTTPException(status_code=400, detail="Only PNG and JPEG images are supported")
+    
+    upload = await save_upload(file, TEMPLATE_DIR, "certificate_background", ("png", "jpeg"), TEMPLATE_MAX_BYTES)
+    filename = upload["filename"]
+    
+    background_url = f"/api/static/templates/{filename}"
+    # A null layout cannot take a dotted $set; start it off empty
+    await db.settings.update_one(
+        {"id": "app_settings", "certificate_layout": None},
+        {"$set": {"certificate_layout": CertificateLayout().model_dump()}}
+    )
+    await db.settings.update_one(
+        {"id": "app_settings"},
+        {"$set": {"certificate_layout.background_url": background_url, "updated_at": get_malaysia_time().isoformat()}},
+        upsert=True
+    )
+    
+    return {"background_url": background_url, "message": "Certificate background uploaded successfully"}
+
 # Upload Certificate for Participant
 @api_router.post("/certificates/upload/{session_id}/{participant_id}")
 async def upload_participant_certificate(
@@ -4591,27 +7067,11 @@ async def upload_participant_certificate(
     max_size_mb = settings.get('max_certificate_file_size_mb', 5) if settings else 5
     max_size_bytes = max_size_mb * 1024 * 1024
     
-    # Check file size
-    file.file.seek(0, 2)  # Seek to end
-    file_size = file.file.tell()
-    file.file.seek(0)  # Reset to beginning
-    
-    if file_size > max_size_bytes:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"File size exceeds maximum allowed size of {max_size_mb}MB"
-        )
-    
-    # Create unique filename
-    file_extension = ".pdf"
-    unique_filename = f"{session_id}_{participant_id}_{uuid.uuid4().hex[:8]}{file_extension}"
-    file_path = CERTIFICATE_PDF_DIR / unique_filename
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # The size cap is enforced while streaming
+    upload = await save_upload_blob(file, ("pdf",), max_size_bytes)
+    file_size = upload["size"]
     
-    certificate_url = f"/api/static/certificates_pdf/{unique_filename}"
+    certificate_url = blob_url(upload["blob"], certificate_pdf_name(participant_id, session_id))
     
     # Update participant access record with certificate info
     await db.participant_access.update_one(
@@ -4627,7 +7087,7 @@ async def upload_participant_certificate(
     )
     
     return {
-        "certificate_url": certificate_url,
+        "certificate_url": signed_file_url(certificate_url),
         "message": "Certificate uploaded successfully",
         "file_size_mb": round(file_size / (1024 * 1024), 2)
     }
@@ -4678,37 +7138,22 @@ async def download_participant_certificate(
             )
         
         # Check if clocked out
-        attendance = await db.attendance.find_one(
-            {
-                "participant_id": participant_id,
-                "session_id": session_id,
-                "clock_out": {"$ne": None}
-            },
-            {"_id": 0}
-        )
-        
-        if not attendance:
+        if not await has_clocked_out(participant_id, session_id):
             raise HTTPException(
                 status_code=403,
                 detail="Certificate not available. Please clock out first."
             )
     
-    # Get file path
-    filename = certificate_url.split('/')[-1]
-    file_path = CERTIFICATE_PDF_DIR / filename
-    
-    if not file_path.exists():
+    source = stored_file_source(certificate_url)
+    if not source:
         raise HTTPException(status_code=404, detail="Certificate file not found")
     
     # Get participant name for filename
     participant = await db.users.find_one({"id": participant_id}, {"_id": 0})
     participant_name = participant.get('full_name', 'participant').replace(' ', '_') if participant else 'participant'
     
-    return FileResponse(
-        file_path,
-        media_type="application/pdf",
-        filename=f"{participant_name}_certificate.pdf"
-    )
+    store, key, _ = source
+    return RedirectResponse(sign_download(store, key, f"{participant_name}_certificate.pdf"), status_code=307)
 
 # Check Certificate Eligibility
 @api_router.get("/certificates/eligibility/{session_id}/{participant_id}")
@@ -4728,105 +7173,860 @@ async def check_certificate_eligibility(
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Get participant access
-    access = await db.participant_access.find_one(
+    # Get participant access
+    access = await db.participant_access.find_one(
+        {"participant_id": participant_id, "session_id": session_id},
+        {"_id": 0}
+    )
+    
+    # Check conditions
+    has_certificate = bool(access and access.get('certificate_url'))
+    feedback_submitted = bool(access and access.get('feedback_submitted', False))
+    
+    # Check clock out
+    clocked_out = await has_clocked_out(participant_id, session_id)
+    
+    session_active = session.get("status") == "active"
+    
+    eligible = has_certificate and feedback_submitted and clocked_out and session_active
+    
+    return {
+        "eligible": eligible,
+        "has_certificate": has_certificate,
+        "feedback_submitted": feedback_submitted,
+        "clocked_out": clocked_out,
+        "session_active": session_active,
+        "certificate_url": signed_file_url(access.get('certificate_url')) if access else None,
+        "message": "Eligible to download certificate" if eligible else "Not yet eligible for certificate"
+    }
+
+
+# Get All Certificates (Admin Only)
+@api_router.get("/certificates/repository")
+async def get_certificates_repository(
+    search: Optional[str] = None,
+    session_id: Optional[str] = None,
+    company_id: Optional[str] = None,
+    program_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Uploaded certificates for the admin repository, newest first, one page at a time.
+    Joins are done server-side; pass next_cursor back as ?cursor= for the following page.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can access certificate repository")
+    limit = max(1, min(limit, 200))
+    
+    match = {"certificate_url": {"$exists": True, "$ne": None}}
+    if session_id:
+        match["session_id"] = session_id
+    
+    # Session-level filters resolve to a session id list up front so the join only runs on a page
+    if company_id or program_id or date_from or date_to:
+        session_query = {}
+        if company_id:
+            session_query["company_id"] = company_id
+        if program_id:
+            session_query["program_id"] = program_id
+        if date_from or date_to:
+            session_query["end_date"] = {}
+            if date_from:
+                session_query["end_date"]["$gte"] = date_from
+            if date_to:
+                session_query["end_date"]["$lte"] = date_to
+        session_ids = [s["id"] async for s in db.sessions.find(session_query, {"_id": 0, "id": 1})]
+        if session_id:
+            session_ids = [sid for sid in session_ids if sid == session_id]
+        match["session_id"] = {"$in": session_ids}
+    
+    search_stages = []
+    if search:
+        pattern = {"$regex": re.escape(search.strip()), "$options": "i"}
+        search_stages = [
+            {"$lookup": {"from": "users", "localField": "participant_id", "foreignField": "id", "as": "participant"}},
+            {"$match": {"$or": [
+                {"participant.full_name": pattern},
+                {"participant.id_number": pattern},
+                {"participant.email": pattern}
+            ]}}
+        ]
+    
+    # Keyset page straight off the (certificate_uploaded_at, _id) index. Rows without an upload
+    # time sort after all others (nulls are lowest), so they are paged last by _id alone.
+    page_match = dict(match)
+    if cursor:
+        try:
+            uploaded_at, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            last_id = ObjectId(last_id)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if uploaded_at is None:
+            page_match["certificate_uploaded_at"] = None
+            page_match["_id"] = {"$lt": last_id}
+        else:
+            page_match["$or"] = [
+                {"certificate_uploaded_at": {"$lt": uploaded_at}},
+                {"certificate_uploaded_at": uploaded_at, "_id": {"$lt": last_id}},
+                {"certificate_uploaded_at": None}
+            ]
+    pipeline = [
+        {"$match": page_match},
+        {"$sort": {"certificate_uploaded_at": -1, "_id": -1}},
+        *search_stages,
+        {"$limit": limit + 1},
+        {"$lookup": {"from": "users", "localField": "participant_id", "foreignField": "id", "as": "participant"}},
+        {"$lookup": {"from": "sessions", "localField": "session_id", "foreignField": "id", "as": "session"}},
+        {"$set": {
+            "participant": {"$arrayElemAt": ["$participant", 0]},
+            "session": {"$arrayElemAt": ["$session", 0]}
+        }},
+        {"$lookup": {"from": "programs", "localField": "session.program_id", "foreignField": "id", "as": "program"}},
+        {"$lookup": {"from": "companies", "localField": "session.company_id", "foreignField": "id", "as": "company"}},
+        {"$project": {
+            "_id": 1,
+            "certificate_url": 1,
+            "uploaded_at": "$certificate_uploaded_at",
+            "uploaded_by": "$certificate_uploaded_by",
+            "participant_id": 1,
+            "participant_name": {"$ifNull": ["$participant.full_name", "Unknown"]},
+            "participant_id_number": {"$ifNull": ["$participant.id_number", "N/A"]},
+            "participant_email": {"$ifNull": ["$participant.email", "N/A"]},
+            "session_id": 1,
+            "session_name": {"$ifNull": ["$session.name", "Unknown Session"]},
+            "session_start_date": "$session.start_date",
+            "session_end_date": "$session.end_date",
+            "program_name": {"$ifNull": [{"$arrayElemAt": ["$program.name", 0]}, "N/A"]},
+            "company_name": {"$ifNull": [{"$arrayElemAt": ["$company.name", 0]}, "N/A"]},
+            "feedback_submitted": {"$ifNull": ["$feedback_submitted", False]}
+        }}
+    ]
+    
+    items = await db.participant_access.aggregate(pipeline).to_list(limit + 1)
+    if search_stages:
+        counted = await db.participant_access.aggregate(
+            [{"$match": match}, *search_stages, {"$count": "count"}]
+        ).to_list(1)
+        total = counted[0]["count"] if counted else 0
+    else:
+        total = await db.participant_access.count_documents(match)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = base64.urlsafe_b64encode(
+            json.dumps([last.get("uploaded_at"), str(last["_id"])]).encode()
+        ).decode()
+    for item in items:
+        item.pop("_id", None)
+        item["certificate_url"] = signed_file_url(item.get("certificate_url"))
+    
+    return {
+        "items": items,
+        "total": total,
+        "next_cursor": next_cursor
+    }
+
+
+ZIP_QUERY_BATCH = 200
+
+
+def _zip_safe(name: Optional[str]) -> str:
+    return re.sub(r'[\\/:*?"<>|]+', "_", (name or "").strip()) or "Unknown"
+
+
+class _ZipStreamBuffer:
+    """Write-only, unseekable sink for zipfile; the generator drains it after every write"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+async def _certificate_export_rows(session_ids: List[str]):
+    """(participant_id, session_id, (store, key, filename)) per certificate; uploaded certificates win over generated ones"""
+    seen = set()
+    for collection, url_field in ((db.participant_access, "certificate_url"), (db.certificates, "certificate_url")):
+        cursor = collection.find(
+            {"session_id": {"$in": session_ids}, url_field: {"$exists": True, "$ne": None}},
+            {"_id": 0, "participant_id": 1, "session_id": 1, url_field: 1}
+        ).batch_size(ZIP_QUERY_BATCH)
+        async for row in cursor:
+            key = (row["participant_id"], row["session_id"])
+            source = stored_file_source(row.get(url_field))
+            if key in seen or not source:
+                continue
+            seen.add(key)
+            yield row["participant_id"], row["session_id"], source
+
+
+async def stream_certificates_zip(sessions: Dict[str, dict]):
+    """Yield a ZIP of every certificate file for the given sessions, one file at a time"""
+    sink = _ZipStreamBuffer()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED)
+    used_names = set()
+    pending = []
+    
+    async def write_batch(batch):
+        users = await get_participant_map([pid for pid, _, _ in batch], ("full_name", "id_number"))
+        for participant_id, session_id, (store, key, filename) in batch:
+            stat = await asyncio.to_thread(store.stat, key)
+            if stat is None:
+                logging.warning(f"Certificate file missing from export: {filename}")
+                continue
+            size, mtime = stat
+            suffix = Path(filename).suffix
+            session = sessions[session_id]
+            user = users.get(participant_id, {})
+            base = f"{_zip_safe(session.get('company_name'))}/{_zip_safe(session.get('name'))}/" \
+                   f"{_zip_safe(user.get('full_name'))}_{_zip_safe(user.get('id_number'))}"
+            arcname, n = f"{base}{suffix}", 1
+            while arcname in used_names:
+                n += 1
+                arcname = f"{base}_{n}{suffix}"
+            used_names.add(arcname)
+            
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(mtime)[:6])
+            info.file_size = size  # lets zipfile pick zip64 up front
+            try:
+                chunks = await asyncio.to_thread(store.open_chunks, key)
+            except FileNotFoundError:
+                logging.warning(f"Certificate file missing from export: {filename}")
+                continue
+            try:
+                with archive.open(info, "w") as target:
+                    while True:
+                        chunk = await asyncio.to_thread(next, chunks, b"")
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                        yield sink.drain()
+            finally:
+                close = getattr(chunks, "close", None)
+                if close:
+                    close()
+            yield sink.drain()
+    
+    async for row in _certificate_export_rows(list(sessions)):
+        pending.append(row)
+        if len(pending) >= ZIP_QUERY_BATCH:
+            async for data in write_batch(pending):
+                if data:
+                    yield data
+            pending = []
+    if pending:
+        async for data in write_batch(pending):
+            if data:
+                yield data
+    
+    archive.close()
+    yield sink.drain()
+
+
+@api_router.get("/certificates/export")
+async def export_certificates_zip(
+    session_id: Optional[str] = None,
+    company_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Stream a ZIP of all certificates for a session, a company and/or a session end-date range"""
+    if current_user.role not in ["admin", "assistant_admin"]:
+        raise HTTPException(status_code=403, detail="Only admins can export certificates")
+    if not (session_id or company_id or date_from or date_to):
+        raise HTTPException(status_code=400, detail="Provide a session, company or date range")
+    
+    query = {}
+    if session_id:
+        query["id"] = session_id
+    if company_id:
+        query["company_id"] = company_id
+    if date_from or date_to:
+        query["end_date"] = {}
+        if date_from:
+            query["end_date"]["$gte"] = date_from
+        if date_to:
+            query["end_date"]["$lte"] = date_to
+    
+    sessions = {
+        s["id"]: s async for s in db.sessions.find(query, {"_id": 0, "id": 1, "name": 1, "company_id": 1})
+    }
+    if not sessions:
+        raise HTTPException(status_code=404, detail="No sessions match the filters")
+    company_ids = list({s.get("company_id") for s in sessions.values() if s.get("company_id")})
+    companies = {
+        c["id"]: c["name"] async for c in db.companies.find({"id": {"$in": company_ids}}, {"_id": 0, "id": 1, "name": 1})
+    }
+    for s in sessions.values():
+        s["company_name"] = companies.get(s.get("company_id"), "No Company")
+    
+    label = session_id or company_id or f"{date_from or 'start'}_{date_to or 'now'}"
+    return StreamingResponse(
+        stream_certificates_zip(sessions),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="certificates_{_zip_safe(label)}.zip"'}
+    )
+
+
+# Generate Certificate
+CERTIFICATE_TEMPLATE_PATH = TEMPLATE_DIR / "certificate_template.docx"
+CERTIFICATE_PLACEHOLDERS = [
+    '«PARTICIPANT_NAME»', '«IC_NUMBER»', '«COMPANY_NAME»', '«PROGRAMME NAME»',
+    '<<PROGRAMME NAME>>', '«VENUE»', '<<VENUE>>', '«DATE»', '<<DATE>>'
+]
+
+
+def _merge_placeholder_runs(paragraph, keys: List[str]):
+    """Word often splits «PLACEHOLDER» across runs; pull each one into the run where it starts"""
+    while True:
+        runs = paragraph.runs
+        texts = [run.text for run in runs]
+        full = "".join(texts)
+        spanning = None
+        for key in keys:
+            start = full.find(key)
+            while start != -1:
+                end = start + len(key)
+                offset = 0
+                for i, text in enumerate(texts):
+                    if offset <= start < offset + len(text):
+                        if end > offset + len(text):
+                            spanning = (i, start - offset, end)
+                        break
+                    offset += len(text)
+                if spanning:
+                    break
+                start = full.find(key, end)
+            if spanning:
+                break
+        if not spanning:
+            return
+        
+        first, local_start, end = spanning
+        offset = sum(len(t) for t in texts[:first])
+        key_text = full[offset + local_start:end]
+        runs[first].text = texts[first][:local_start] + key_text
+        # Hand the remainder of the last spanned run back, clear the ones fully consumed
+        consumed = offset + len(texts[first])
+        for i in range(first + 1, len(runs)):
+            run_end = consumed + len(texts[i])
+            if run_end <= end:
+                runs[i].text = ""
+            else:
+                runs[i].text = texts[i][end - consumed:]
+                break
+            consumed = run_end
+
+
+class CompiledCertificateTemplate:
+    """
+    certificate_template.docx parsed once. Placeholders are normalised into single runs, then
+    word/document.xml is split into literal segments around them, so a render is a string join
+    plus a re-zip: no python-docx parsing and the runs keep their fonts.
+    """
+    
+    def __init__(self, template_bytes: bytes):
+        self.hash = hashlib.sha256(template_bytes).hexdigest()
+        doc = Document(io.BytesIO(template_bytes))
+        # Every w:p in the body, including table cells and text boxes
+        paragraphs = [Paragraph(p, doc._body) for p in doc.element.body.iter(qn("w:p"))]
+        for paragraph in paragraphs:
+            if any(key in paragraph.text for key in CERTIFICATE_PLACEHOLDERS):
+                _merge_placeholder_runs(paragraph, CERTIFICATE_PLACEHOLDERS)
+        
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        self.parts = []  # (ZipInfo, bytes); word/document.xml is rebuilt per render
+        with zipfile.ZipFile(buffer) as archive:
+            for info in archive.infolist():
+                data = archive.read(info)
+                if info.filename == "word/document.xml":
+                    document_xml = data.decode("utf-8")
+                elif info.filename.startswith("word/media/"):
+                    # Images are already compressed; re-deflating them dominated render time
+                    info.compress_type = zipfile.ZIP_STORED
+                self.parts.append((info, data))
+        
+        # Alternating [literal, placeholder, literal, ...] over the escaped XML text
+        escaped = {xml_escape(key): key for key in CERTIFICATE_PLACEHOLDERS}
+        pattern = re.compile("|".join(re.escape(k) for k in sorted(escaped, key=len, reverse=True)))
+        self.segments = []
+        position = 0
+        for match in pattern.finditer(document_xml):
+            self.segments.append(document_xml[position:match.start()])
+            self.segments.append(escaped[match.group(0)])
+            position = match.end()
+        self.segments.append(document_xml[position:])
+        self.placeholders = sorted(set(self.segments[1::2]))
+    
+    def render(self, replacements: dict) -> bytes:
+        document_xml = "".join(
+            segment if i % 2 == 0 else xml_escape(str(replacements.get(segment) or ""))
+            for i, segment in enumerate(self.segments)
+        ).encode("utf-8")
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for info, data in self.parts:
+                archive.writestr(info, document_xml if info.filename == "word/document.xml" else data)
+        return buffer.getvalue()
+
+
+_certificate_template_cache = {"key": None, "template": None}
+_certificate_template_lock = asyncio.Lock()
+
+
+def invalidate_certificate_template():
+    _certificate_template_cache.update(key=None, template=None)
+
+
+async def get_certificate_template() -> CompiledCertificateTemplate:
+    """Compiled template, recompiled only when the file's mtime/size change"""
+    if not CERTIFICATE_TEMPLATE_PATH.exists():
+        raise HTTPException(status_code=404, detail="Certificate template not found. Please upload a template first.")
+    stat = CERTIFICATE_TEMPLATE_PATH.stat()
+    key = (stat.st_mtime_ns, stat.st_size)
+    if _certificate_template_cache["key"] == key:
+        return _certificate_template_cache["template"]
+    async with _certificate_template_lock:
+        if _certificate_template_cache["key"] != key:
+            template_bytes = await asyncio.to_thread(CERTIFICATE_TEMPLATE_PATH.read_bytes)
+            template = await asyncio.to_thread(CompiledCertificateTemplate, template_bytes)
+            _certificate_template_cache.update(key=key, template=template)
+            logging.info(f"Compiled certificate template {template.hash[:12]}: {', '.join(template.placeholders)}")
+        return _certificate_template_cache["template"]
+
+
+# Native PDF certificates: a background image plus text fields placed from settings.certificate_layout,
+# drawn straight to PDF with reportlab (no DOCX, no LibreOffice). Chosen per program through
+# settings.certificate_renderers ({program_id: "pdf" | "docx"}), default settings.certificate_renderer.
+CERTIFICATE_FIELD_PLACEHOLDERS = {
+    "participant_name": '«PARTICIPANT_NAME»',
+    "ic_number": '«IC_NUMBER»',
+    "company_name": '«COMPANY_NAME»',
+    "program_name": '«PROGRAMME NAME»',
+    "venue": '«VENUE»',
+    "date": '«DATE»'
+}
+CERTIFICATE_PAGE_SIZES = {"A4": A4, "LETTER": LETTER}
+
+
+class CompiledCertificateLayout:
+    """Layout spec with its background prepared once; render_pdf() takes milliseconds per certificate"""
+    
+    def __init__(self, layout: dict, background_path: Optional[Path]):
+        page = CERTIFICATE_PAGE_SIZES.get(str(layout.get("page_size", "A4")).upper(), A4)
+        self.page_size = landscape(page) if layout.get("orientation", "landscape") == "landscape" else portrait(page)
+        self.fields = [CertificateField(**f) for f in layout.get("fields", [])]
+        digest = hashlib.sha256(json.dumps(layout, sort_keys=True, default=str).encode("utf-8"))
+        self.background = None
+        if background_path:
+            background_bytes = background_path.read_bytes()
+            digest.update(background_bytes)
+            self.background = self._jpeg_background(background_path, background_bytes)
+        self.hash = digest.hexdigest()
+    
+    @staticmethod
+    def _jpeg_background(path: Path, data: bytes) -> str:
+        """reportlab embeds a JPEG file as-is but re-encodes anything else on every page; convert once"""
+        if path.suffix.lower() in [".jpg", ".jpeg"]:
+            return str(path)
+        compiled_dir = Path(tempfile.gettempdir()) / "mddrc_certificate_layout"
+        compiled_dir.mkdir(parents=True, exist_ok=True)
+        jpeg_path = compiled_dir / f"{hashlib.sha256(data).hexdigest()}.jpg"
+        if not jpeg_path.exists():
+            image = Image.open(io.BytesIO(data))
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                flattened = Image.new("RGB", image.size, "white")
+                flattened.paste(image, mask=image.split()[-1])
+                image = flattened
+            image.convert("RGB").save(jpeg_path, "JPEG", quality=92)
+        return str(jpeg_path)
+    
+    def render_pdf(self, replacements: dict) -> bytes:
+        buffer = io.BytesIO()
+        pdf = pdf_canvas.Canvas(buffer, pagesize=self.page_size)
+        width, height = self.page_size
+        if self.background:
+            pdf.drawImage(self.background, 0, 0, width=width, height=height)
+        
+        for field in self.fields:
+            if field.key:
+                text = str(replacements.get(CERTIFICATE_FIELD_PLACEHOLDERS.get(field.key, ""), "") or "")
+            else:
+                text = field.text or ""
+            if not text:
+                continue
+            size = field.size
+            if field.max_width:
+                text_width = stringWidth(text, field.font, size)
+                if text_width > field.max_width:
+                    size = size * field.max_width / text_width
+            pdf.setFont(field.font, size)
+            pdf.setFillColor(HexColor(field.color))
+            if field.align == "center":
+                pdf.drawCentredString(field.x, field.y, text)
+            elif field.align == "right":
+                pdf.drawRightString(field.x, field.y, text)
+            else:
+                pdf.drawString(field.x, field.y, text)
+        
+        pdf.showPage()
+        pdf.save()
+        return buffer.getvalue()
+
+
+_certificate_layout_cache = {"key": None, "layout": None}
+
+
+async def get_certificate_layout(layout: dict) -> CompiledCertificateLayout:
+    background_path = None
+    background_url = layout.get("background_url")
+    if background_url:
+        background_path = TEMPLATE_DIR / Path(background_url).name
+        if not background_path.exists():
+            raise HTTPException(status_code=404, detail="Certificate background image not found")
+    stat = background_path.stat() if background_path else None
+    key = (json.dumps(layout, sort_keys=True, default=str), stat.st_mtime_ns if stat else None)
+    if _certificate_layout_cache["key"] != key:
+        compiled = await asyncio.to_thread(CompiledCertificateLayout, layout, background_path)
+        _certificate_layout_cache.update(key=key, layout=compiled)
+    return _certificate_layout_cache["layout"]
+
+
+async def get_certificate_renderer(program_id: Optional[str]):
+    """Compiled PDF layout when selected for this program (and configured), else the DOCX template"""
+    settings = await db.settings.find_one(
+        {"id": "app_settings"},
+        {"_id": 0, "certificate_renderer": 1, "certificate_renderers": 1, "certificate_layout": 1}
+    ) or {}
+    renderer = (settings.get("certificate_renderers") or {}).get(program_id) or settings.get("certificate_renderer") or "docx"
+    layout = settings.get("certificate_layout")
+    if renderer == "pdf" and layout and layout.get("fields"):
+        try:
+            return await get_certificate_layout(layout)
+        except Exception as e:
+            logging.error(f"Certificate layout unusable, falling back to DOCX template: {str(e)}")
+    return await get_certificate_template()
+
+
+async def load_certificate_context(session_id: str) -> dict:
+    """Session, program and company fields shared by every certificate of a session"""
+    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    program = await db.programs.find_one({"id": session['program_id']}, {"_id": 0, "name": 1})
+    company = await db.companies.find_one({"id": session['company_id']}, {"_id": 0, "name": 1})
+    return {
+        "session": session,
+        "program_name": program['name'] if program else "Training Program",
+        "company_name": company['name'] if company else ""
+    }
+
+
+def certificate_replacements(participant: dict, context: dict) -> dict:
+    session = context["session"]
+    return {
+        '«PARTICIPANT_NAME»': participant['full_name'],
+        '«IC_NUMBER»': participant['id_number'],
+        '«COMPANY_NAME»': context["company_name"],
+        '«PROGRAMME NAME»': context["program_name"],
+        '<<PROGRAMME NAME>>': context["program_name"],
+        '«VENUE»': session['location'],
+        '<<VENUE>>': session['location'],
+        '«DATE»': session['end_date'],
+        '<<DATE>>': session['end_date']
+    }
+
+
+def certificate_content_key(template, replacements: dict) -> str:
+    """Hash of everything that ends up on the certificate; equal keys mean an identical PDF"""
+    fields = [template.hash] + [str(replacements.get(key) or "") for key in CERTIFICATE_PLACEHOLDERS]
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def certificate_pdf_name(participant_id: str, session_id: str) -> str:
+    return f"certificate_{participant_id}_{session_id}.pdf"
+
+
+def is_certificate_current(existing: Optional[dict], content_key: str) -> bool:
+    """The stored PDF already matches content_key (a referenced blob is never collected, so no file check)"""
+    if not existing or existing.get("content_key") != content_key:
+        return False
+    return blob_key_from_url(existing.get("certificate_url")) is not None
+
+
+async def render_certificate_pdf(
+    template,
+    participant: dict,
+    context: dict,
+    existing: Optional[dict] = None
+) -> dict:
+    """
+    Render one certificate PDF into the blob store unless the existing certificate row already
+    has the same content key. Returns {certificate_url, content_key, cached}.
+    """
+    replacements = certificate_replacements(participant, context)
+    content_key = certificate_content_key(template, replacements)
+    
+    if is_certificate_current(existing, content_key):
+        return {"certificate_url": existing["certificate_url"], "content_key": content_key, "cached": True}
+    
+    if isinstance(template, CompiledCertificateLayout):
+        pdf_bytes = await asyncio.to_thread(template.render_pdf, replacements)
+    else:
+        docx_bytes = await asyncio.to_thread(template.render, replacements)
+        pdf_bytes = await document_converter.convert(docx_bytes)
+    pdf_blob = await put_blob(pdf_bytes, "pdf")
+    cert_url = blob_url(pdf_blob, certificate_pdf_name(participant["id"], context["session"]["id"]))
+    return {"certificate_url": cert_url, "content_key": content_key, "cached": False}
+
+
+def certificate_upsert(participant_id: str, session_id: str, program_name: str, rendered: dict) -> UpdateOne:
+    """One certificate row per participant per session; the id is kept across regenerations"""
+    cert_obj = Certificate(
+        participant_id=participant_id,
+        session_id=session_id,
+        program_name=program_name,
+        certificate_url=rendered["certificate_url"]
+    )
+    return UpdateOne(
+        {"participant_id": participant_id, "session_id": session_id},
+        {
+            "$set": {
+                "certificate_url": rendered["certificate_url"],
+                "content_key": rendered["content_key"],
+                "issue_date": cert_obj.issue_date.isoformat()
+            },
+            "$setOnInsert": {"id": cert_obj.id, "program_name": program_name}
+        },
+        upsert=True
+    )
+
+
+async def merge_duplicate_certificates() -> int:
+    """
+    Collapse duplicate (session, participant) certificate rows into the oldest one, which keeps its
+    id (download links use it) and takes the newest row's PDF. Returns the number of rows removed.
+    """
+    removed = 0
+    duplicates = db.certificates.aggregate([
+        {"$group": {
+            "_id": {"session_id": "$session_id", "participant_id": "$participant_id"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+    async for dup in duplicates:
+        rows = await db.certificates.find(dup["_id"]).sort("_id", 1).to_list(None)
+        keep = rows[0]
+        newest = max(rows, key=lambda row: str(row.get("issue_date") or ""))
+        await db.certificates.update_one(
+            {"_id": keep["_id"]},
+            {"$set": {
+                "certificate_url": newest.get("certificate_url"),
+                "content_key": newest.get("content_key"),
+                "issue_date": newest.get("issue_date")
+            }}
+        )
+        await db.certificates.delete_many({"_id": {"$in": [row["_id"] for row in rows[1:]]}})
+        removed += len(rows) - 1
+    return removed
+
+
+def certificate_result(cert_id: str, cert_url: str) -> dict:
+    return {
+        "certificate_id": cert_id,
+        "certificate_url": signed_file_url(cert_url),
+        "download_url": f"/api/certificates/download/{cert_id}"
+    }
+
+
+async def find_current_certificate(participant_id: str, session_id: str) -> Optional[dict]:
+    """Certificate result if the stored PDF is still up to date - a hash check, no rendering"""
+    existing = await db.certificates.find_one(
+        {"participant_id": participant_id, "session_id": session_id, "content_key": {"$exists": True}},
+        {"_id": 0}
+    )
+    if not existing:
+        return None
+    participant = await db.users.find_one({"id": participant_id}, {"_id": 0, "id": 1, "full_name": 1, "id_number": 1})
+    if not participant:
+        return None
+    context = await load_certificate_context(session_id)
+    template = await get_certificate_renderer(context["session"].get("program_id"))
+    content_key = certificate_content_key(template, certificate_replacements(participant, context))
+    if not is_certificate_current(existing, content_key):
+        return None
+    return certificate_result(existing["id"], existing["certificate_url"])
+
+
+async def render_certificate_job(payload: dict) -> dict:
+    """Job handler: render one participant's certificate to PDF and record it"""
+    participant_id = payload["participant_id"]
+    session_id = payload["session_id"]
+    
+    participant = await db.users.find_one({"id": participant_id}, {"_id": 0, "id": 1, "full_name": 1, "id_number": 1})
+    if not participant:
+        raise HTTPException(status_code=404, detail="Participant not found")
+    context = await load_certificate_context(session_id)
+    template = await get_certificate_renderer(context["session"].get("program_id"))
+    
+    existing = await db.certificates.find_one({"participant_id": participant_id, "session_id": session_id}, {"_id": 0})
+    
+    # A failed conversion raises and is retried by the job runner
+    rendered = await render_certificate_pdf(template, participant, context, existing)
+    if rendered["cached"]:
+        return certificate_result(existing["id"], rendered["certificate_url"])
+    
+    failed = await _bulk_upsert(db.certificates, [certificate_upsert(participant_id, session_id, context["program_name"], rendered)])
+    if failed:
+        raise RuntimeError(f"Certificate record could not be saved: {failed[0]}")
+    cert = await db.certificates.find_one(
         {"participant_id": participant_id, "session_id": session_id},
-        {"_id": 0}
+        {"_id": 0, "id": 1}
     )
+    return certificate_result(cert['id'], rendered["certificate_url"])
+
+
+async def render_certificate_batch_job(payload: dict) -> dict:
+    """Job handler: render certificates for every eligible participant of a session in one pass"""
+    session_id = payload["session_id"]
+    context = await load_certificate_context(session_id)
+    template = await get_certificate_renderer(context["session"].get("program_id"))
     
-    # Check conditions
-    has_certificate = bool(access and access.get('certificate_url'))
-    feedback_submitted = bool(access and access.get('feedback_submitted', False))
+    participant_ids = payload.get("participant_ids") or context["session"].get("participant_ids", [])
     
-    # Check clock out
-    attendance = await db.attendance.find_one(
-        {
-            "participant_id": participant_id,
-            "session_id": session_id,
-            "clock_out": {"$ne": None}
-        },
-        {"_id": 0}
-    )
-    clocked_out = bool(attendance)
+    # Eligibility (feedback submitted) and participant details: one query each
+    eligible_ids = {
+        a["participant_id"] async for a in db.participant_access.find(
+            {"session_id": session_id, "participant_id": {"$in": participant_ids}, "feedback_submitted": True},
+            {"_id": 0, "participant_id": 1}
+        )
+    }
+    participants = await db.users.find(
+        {"id": {"$in": list(eligible_ids)}},
+        {"_id": 0, "id": 1, "full_name": 1, "id_number": 1}
+    ).to_list(None)
+    skipped = [
+        {"participant_id": pid, "reason": "Feedback not submitted" if pid not in eligible_ids else "Participant not found"}
+        for pid in participant_ids
+        if pid not in {p["id"] for p in participants}
+    ]
     
-    session_active = session.get("status") == "active"
+    existing = {
+        c["participant_id"]: c async for c in db.certificates.find(
+            {"session_id": session_id, "participant_id": {"$in": list(eligible_ids)}},
+            {"_id": 0}
+        )
+    }
     
-    eligible = has_certificate and feedback_submitted and clocked_out and session_active
+    # Conversions fan out across the converter pool; unchanged certificates are not re-rendered
+    outcomes = await asyncio.gather(
+        *(render_certificate_pdf(template, p, context, existing.get(p["id"])) for p in participants),
+        return_exceptions=True
+    )
+    
+    operations = []
+    upserted_ids = []
+    rendered = {}
+    failed = []
+    for participant, outcome in zip(participants, outcomes):
+        if isinstance(outcome, Exception):
+            logging.error(f"Certificate for {participant['id']} failed: {str(outcome)}")
+            failed.append({"participant_id": participant["id"], "error": str(outcome)})
+            continue
+        rendered[participant["id"]] = outcome["certificate_url"]
+        if not outcome["cached"]:
+            operations.append(certificate_upsert(participant["id"], session_id, context["program_name"], outcome))
+            upserted_ids.append(participant["id"])
+    
+    if participants and not rendered:
+        raise RuntimeError("All certificate conversions failed")
+    if operations:
+        for i, error in (await _bulk_upsert(db.certificates, operations)).items():
+            logging.error(f"Certificate record for {upserted_ids[i]} failed: {error}")
+            failed.append({"participant_id": upserted_ids[i], "error": error})
+            rendered.pop(upserted_ids[i], None)
+    
+    cert_ids = {
+        c["participant_id"]: c["id"] async for c in db.certificates.find(
+            {"session_id": session_id, "participant_id": {"$in": list(rendered)}},
+            {"_id": 0, "id": 1, "participant_id": 1}
+        )
+    }
+    names = {p["id"]: p["full_name"] for p in participants}
+    certificates = [
+        {
+            "participant_id": pid,
+            "participant_name": names.get(pid),
+            **certificate_result(cert_ids.get(pid), url)
+        }
+        for pid, url in rendered.items()
+    ]
     
     return {
-        "eligible": eligible,
-        "has_certificate": has_certificate,
-        "feedback_submitted": feedback_submitted,
-        "clocked_out": clocked_out,
-        "session_active": session_active,
-        "certificate_url": access.get('certificate_url') if access else None,
-        "message": "Eligible to download certificate" if eligible else "Not yet eligible for certificate"
+        "generated_count": len(operations),
+        "unchanged_count": len(certificates) - len(operations),
+        "certificates": certificates,
+        "skipped": skipped,
+        "failed": failed
     }
 
 
-# Get All Certificates (Admin Only)
-@api_router.get("/certificates/repository")
-async def get_certificates_repository(current_user: User = Depends(get_current_user)):
-    """Get all uploaded certificates for admin repository."""
-    
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Only admins can access certificate repository")
-    
-    # Get all participant access records that have certificates
-    certificates = await db.participant_access.find(
-        {"certificate_url": {"$exists": True, "$ne": None}},
-        {"_id": 0}
-    ).to_list(length=None)
-    
-    # Enrich with participant, session, and program details
-    enriched_certificates = []
-    
-    for cert in certificates:
-        participant_id = cert.get('participant_id')
-        session_id = cert.get('session_id')
-        
-        # Get participant details
-        participant = await db.users.find_one({"id": participant_id}, {"_id": 0})
-        
-        # Get session details
-        session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
-        
-        # Get program details if session has program_id
-        program = None
-        if session and session.get('program_id'):
-            program = await db.programs.find_one({"id": session['program_id']}, {"_id": 0})
-        
-        # Get company details if session has company_id
-        company = None
-        if session and session.get('company_id'):
-            company = await db.companies.find_one({"id": session['company_id']}, {"_id": 0})
-        
-        enriched_certificates.append({
-            "certificate_url": cert.get('certificate_url'),
-            "uploaded_at": cert.get('certificate_uploaded_at'),
-            "uploaded_by": cert.get('certificate_uploaded_by'),
-            "participant_id": participant_id,
-            "participant_name": participant.get('full_name') if participant else 'Unknown',
-            "participant_id_number": participant.get('id_number') if participant else 'N/A',
-            "participant_email": participant.get('email') if participant else 'N/A',
-            "session_id": session_id,
-            "session_name": session.get('name') if session else 'Unknown Session',
-            "session_start_date": session.get('start_date') if session else None,
-            "session_end_date": session.get('end_date') if session else None,
-            "program_name": program.get('name') if program else 'N/A',
-            "company_name": company.get('name') if company else 'N/A',
-            "feedback_submitted": cert.get('feedback_submitted', False),
-        })
+# LibreOffice is heavy; a couple of conversions at a time keeps the API responsive
+register_job_handler("certificate", render_certificate_job, concurrency=2)
+register_job_handler("certificate_batch", render_certificate_batch_job, concurrency=1)
+
+
+@api_router.post("/certificates/generate-batch/{session_id}", status_code=202)
+async def generate_session_certificates(
+    session_id: str,
+    batch: Optional[CertificateBatchRequest] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Queue certificates for all eligible participants of a session; poll GET /jobs/{job_id}"""
+    if current_user.role not in ["admin", "coordinator"]:
+        raise HTTPException(status_code=403, detail="Only admins and coordinators can issue certificates")
     
-    # Sort by upload date (most recent first)
-    enriched_certificates.sort(key=lambda x: x.get('uploaded_at') or '', reverse=True)
+    session = await db.sessions.find_one({"id": session_id}, {"_id": 0, "id": 1, "program_id": 1})
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    await get_certificate_renderer(session.get("program_id"))
     
-    return enriched_certificates
+    job = await enqueue_job(
+        "certificate_batch",
+        {"session_id": session_id, "participant_ids": batch.participant_ids if batch else []},
+        current_user.id
+    )
+    return {**job_response(job), "message": "Certificate batch queued"}
 
 
-# Generate Certificate
-@api_router.post("/certificates/generate/{session_id}/{participant_id}")
-async def generate_certificate(session_id: str, participant_id: str, current_user: User = Depends(get_current_user)):
+@api_router.post("/certificates/generate/{session_id}/{participant_id}", status_code=202)
+async def generate_certificate(
+    session_id: str,
+    participant_id: str,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
+    """Queue certificate rendering; poll GET /jobs/{job_id} for the certificate URL (returned inline when up to date)"""
     # Only admin can generate, or participant can generate their own
     if current_user.role != "admin" and current_user.id != participant_id:
         raise HTTPException(status_code=403, detail="Unauthorized")
@@ -4839,116 +8039,38 @@ async def generate_certificate(session_id: str, participant_id: str, current_use
     
     if not access:
         # Auto-create if doesn't exist
-        access = await get_or_create_participant_access(participant_id, session_id)
+        access = (await get_or_create_participant_access(participant_id, session_id)).model_dump()
     
     if not access.get('feedback_submitted', False):
         raise HTTPException(status_code=400, detail="Please submit feedback first. Go to your dashboard and click 'Submit Feedback' button.")
     
-    # Get participant details
-    participant = await db.users.find_one({"id": participant_id}, {"_id": 0})
-    if not participant:
-        raise HTTPException(status_code=404, detail="Participant not found")
-    
-    # Get session details
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+    session = await db.sessions.find_one({"id": session_id}, {"_id": 0, "program_id": 1})
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    await get_certificate_renderer(session.get("program_id"))
     
-    # Get program details
-    program = await db.programs.find_one({"id": session['program_id']}, {"_id": 0})
-    program_name = program['name'] if program else "Training Program"
-    
-    # Get company details
-    company = await db.companies.find_one({"id": session['company_id']}, {"_id": 0})
-    company_name = company['name'] if company else ""
-    
-    # Get settings for company name (already in template, no replacement needed)
-    
-    # Load template
-    template_path = TEMPLATE_DIR / "certificate_template.docx"
-    if not template_path.exists():
-        raise HTTPException(status_code=404, detail="Certificate template not found. Please upload a template first.")
-    
-    # Create document from template
-    doc = Document(template_path)
-    
-    # Replace placeholders in paragraphs
-    replacements = {
-        '«PARTICIPANT_NAME»': participant['full_name'],
-        '«IC_NUMBER»': participant['id_number'],
-        '«COMPANY_NAME»': company_name,
-        '«PROGRAMME NAME»': program_name,
-        '<<PROGRAMME NAME>>': program_name,
-        '«VENUE»': session['location'],
-        '«DATE»': session['end_date']
-    }
-    
-    # Replace in paragraphs
-    for paragraph in doc.paragraphs:
-        for key, value in replacements.items():
-            if key in paragraph.text:
-                paragraph.text = paragraph.text.replace(key, value)
-    
-    # Replace in tables
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for key, value in replacements.items():
-                    if key in cell.text:
-                        cell.text = cell.text.replace(key, value)
-    
-    # Save as new DOCX document
-    cert_filename = f"certificate_{participant_id}_{session_id}.docx"
-    cert_path = CERTIFICATE_DIR / cert_filename
-    doc.save(cert_path)
-    
-    # Convert to PDF
-    pdf_filename = f"certificate_{participant_id}_{session_id}.pdf"
-    pdf_path = CERTIFICATE_PDF_DIR / pdf_filename
-    
-    # Convert and verify
-    conversion_success = convert_docx_to_pdf(cert_path, pdf_path)
-    if not conversion_success or not pdf_path.exists():
-        raise HTTPException(status_code=500, detail="Failed to convert certificate to PDF. Please contact support.")
-    
-    # Store certificate record (using PDF URL)
-    cert_url = f"/api/static/certificates_pdf/{pdf_filename}"
-    
-    # Check if certificate already exists
-    existing_cert = await db.certificates.find_one({
-        "participant_id": participant_id,
-        "session_id": session_id
-    }, {"_id": 0})
-    
-    if existing_cert:
-        # Update existing
-        await db.certificates.update_one(
-            {"id": existing_cert['id']},
-            {"$set": {
-                "certificate_url": cert_url,
-                "issue_date": get_malaysia_time().isoformat()
-            }}
-        )
-        cert_id = existing_cert['id']
-    else:
-        # Create new
-        cert_obj = Certificate(
-            participant_id=participant_id,
-            session_id=session_id,
-            program_name=program_name,
-            certificate_url=cert_url
-        )
-        doc_cert = cert_obj.model_dump()
-        doc_cert['issue_date'] = doc_cert['issue_date'].isoformat()
-        await db.certificates.insert_one(doc_cert)
-        cert_id = cert_obj.id
+    # Nothing changed since the last render: hand back the existing PDF without queueing
+    current = await find_current_certificate(participant_id, session_id)
+    if current:
+        response.status_code = 200
+        return {"job_id": None, "status": "succeeded", "result": current, "message": "Certificate is up to date"}
     
-    return {
-        "certificate_id": cert_id,
-        "certificate_url": cert_url,
-        "download_url": f"/api/certificates/download/{cert_id}",
-        "message": "Certificate generated successfully"
-    }
+    job = await enqueue_job(
+        "certificate",
+        {"participant_id": participant_id, "session_id": session_id},
+        current_user.id
+    )
+    return {**job_response(job), "message": "Certificate generation queued"}
+
+@api_router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, current_user: User = Depends(get_current_user)):
+    """Status of a background job (result is set once status is 'succeeded')"""
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0, "payload": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if current_user.role != "admin" and job.get("created_by") != current_user.id:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    return job
 
 @api_router.get("/certificates/download/{certificate_id}")
 async def download_certificate(certificate_id: str, current_user: User = Depends(get_current_user)):
@@ -4960,26 +8082,13 @@ async def download_certificate(certificate_id: str, current_user: User = Depends
     if current_user.role != "admin" and current_user.id != cert['participant_id']:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    cert_url = cert['certificate_url']
-    filename = cert_url.split('/')[-1]
-    
-    # Check if it's a PDF or DOCX
-    if filename.endswith('.pdf'):
-        file_path = CERTIFICATE_PDF_DIR / filename
-        media_type = 'application/pdf'
-    else:
-        file_path = CERTIFICATE_DIR / filename
-        media_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-    
-    if not file_path.exists():
+    # PDF or (older certificates) DOCX, as a blob or a legacy static file
+    source = stored_file_source(cert['certificate_url'])
+    if not source:
         raise HTTPException(status_code=404, detail="Certificate file not found")
     
-    return FileResponse(
-        file_path,
-        media_type=media_type,
-        filename=filename,
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    store, key, filename = source
+    return RedirectResponse(sign_download(store, key, filename), status_code=307)
 
 @api_router.get("/certificates/preview/{certificate_id}")
 async def preview_certificate(certificate_id: str, current_user: User = Depends(get_current_user)):
@@ -4991,49 +8100,68 @@ async def preview_certificate(certificate_id: str, current_user: User = Depends(
     if current_user.role != "admin" and current_user.id != cert['participant_id']:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    cert_url = cert['certificate_url']
-    filename = cert_url.split('/')[-1]
-    
-    # Check if it's a PDF or DOCX
-    if filename.endswith('.pdf'):
-        file_path = CERTIFICATE_PDF_DIR / filename
-        media_type = 'application/pdf'
-    else:
-        file_path = CERTIFICATE_DIR / filename
-        media_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-    
-    if not file_path.exists():
+    source = stored_file_source(cert['certificate_url'])
+    if not source:
         raise HTTPException(status_code=404, detail="Certificate file not found")
     
     # Return PDF with inline disposition for browser preview
-    return FileResponse(
-        file_path,
-        media_type=media_type,
-        headers={"Content-Disposition": f"inline; filename={filename}"}
+    store, key, filename = source
+    return RedirectResponse(sign_download(store, key, filename, inline=True), status_code=307)
+
+@api_router.get("/blobs/{key}")
+async def get_blob(key: str, request: Request, name: Optional[str] = None, inline: bool = False):
+    """A stored report or certificate; the key is the content hash, so it can be cached forever"""
+    ensure_unsigned_downloads_allowed()
+    if not BLOB_KEY_PATTERN.match(key):
+        raise HTTPException(status_code=404, detail="File not found")
+    return await stored_file_response(
+        blob_store, key, name or key, inline=inline,
+        headers={"Cache-Control": "private, max-age=31536000, immutable", "X-Content-Type-Options": "nosniff"},
+        request=request
     )
 
+@api_router.get("/files/{path:path}")
+async def get_signed_file(path: str, request: Request, expires: int, sig: str, name: str = "", inline: bool = False):
+    """File behind a signed download link: the signature and expiry are checked, nothing is looked up"""
+    remaining = expires - int(time.time())
+    if remaining <= 0 or not hmac.compare_digest(sig, _download_signature(path, expires, name, inline)):
+        raise HTTPException(status_code=403, detail="Download link is invalid or has expired")
+    location = signed_file_location(path)
+    if not location:
+        raise HTTPException(status_code=404, detail="File not found")
+    store, key = location
+    return await stored_file_response(
+        store, key, name or Path(path).name, inline=inline,
+        headers={"Cache-Control": f"public, max-age={remaining}", "X-Content-Type-Options": "nosniff"},
+        request=request
+    )
+
+@api_router.post("/maintenance/storage-gc")
+async def run_storage_gc(dry_run: bool = True, current_user: User = Depends(get_current_user)):
+    """Collect unreferenced blobs and superseded/leftover static files (dry run unless dry_run=false)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can run storage cleanup")
+    return await collect_garbage(dry_run)
+
 # Static files
 @api_router.get("/static/logos/{filename}")
-async def get_logo(filename: str):
-    file_path = LOGO_DIR / filename
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Logo not found")
-    return FileResponse(file_path)
+async def get_logo(filename: str, request: Request):
+    file_path = static_file_path(LOGO_DIR, filename, "Logo not found")
+    return await static_file_response(file_path, request)
 
 @api_router.get("/static/certificates/{filename}")
-async def get_certificate(filename: str):
-    file_path = CERTIFICATE_DIR / filename
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Certificate not found")
-    return FileResponse(file_path)
+async def get_certificate(filename: str, request: Request):
+    ensure_unsigned_downloads_allowed()
+    file_path = static_file_path(CERTIFICATE_DIR, filename, "Certificate not found")
+    return await static_file_response(file_path, request)
 
 @api_router.get("/static/certificates_pdf/{filename}")
-async def get_certificate_pdf(filename: str):
-    file_path = CERTIFICATE_PDF_DIR / filename
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Certificate PDF not found")
-    return FileResponse(
-        file_path, 
+async def get_certificate_pdf(filename: str, request: Request):
+    ensure_unsigned_downloads_allowed()
+    file_path = static_file_path(CERTIFICATE_PDF_DIR, filename, "Certificate PDF not found")
+    return await static_file_response(
+        file_path,
+        request,
         media_type='application/pdf',
         headers={
             "Content-Disposition": f"attachment; filename={filename}",
@@ -5044,11 +8172,9 @@ async def get_certificate_pdf(filename: str):
     )
 
 @api_router.get("/static/templates/{filename}")
-async def get_template(filename: str):
-    file_path = TEMPLATE_DIR / filename
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Template not found")
-    return FileResponse(file_path)
+async def get_template(filename: str, request: Request):
+    file_path = static_file_path(TEMPLATE_DIR, filename, "Template not found")
+    return await static_file_response(file_path, request)
 
 @api_router.post("/checklist-photos/upload")
 async def upload_checklist_photo(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
@@ -5058,42 +8184,61 @@ async def upload_checklist_photo(file: UploadFile = File(...), current_user: Use
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="Only image files are allowed")
     
-    # Generate unique filename
-    file_extension = file.filename.split('.')[-1]
-    filename = f"{str(uuid.uuid4())}.{file_extension}"
-    file_path = CHECKLIST_PHOTOS_DIR / filename
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Unique filename; the extension comes from the detected image type
+    upload = await save_upload(file, CHECKLIST_PHOTOS_DIR, str(uuid.uuid4()), IMAGE_UPLOAD_KINDS, CHECKLIST_PHOTO_MAX_BYTES)
+    filename = upload["filename"]
     
     photo_url = f"/api/static/checklist-photos/{filename}"
+    # Thumbnails are built off the request path; ?w= falls back to building them on demand
+    await enqueue_job("image_variants", {"source": photo_url}, current_user.id)
     return {"photo_url": photo_url}
 
+async def image_variants_job(payload: dict) -> dict:
+    """Job handler: build the size variants of an uploaded photo"""
+    info = await asyncio.to_thread(ensure_image_variants, payload["source"])
+    if not info:
+        raise HTTPException(status_code=400, detail="Not a readable image")
+    return info
+
+register_job_handler("image_variants", image_variants_job, concurrency=2)
+
+@api_router.get("/static/checklist-photos/variants/{filename}")
+async def get_checklist_photo_variant(filename: str, request: Request):
+    file_path = static_file_path(CHECKLIST_PHOTO_VARIANTS_DIR, filename, "Photo not found")
+    return await static_file_response(file_path, request, immutable=True)
+
 @api_router.get("/static/checklist-photos/{filename}")
-async def get_checklist_photo(filename: str):
-    file_path = CHECKLIST_PHOTOS_DIR / filename
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Photo not found")
-    return FileResponse(file_path)
+async def get_checklist_photo(filename: str, request: Request, w: Optional[int] = None):
+    """Original photo, or with ?w= the nearest size variant (WebP when the browser accepts it)"""
+    file_path = static_file_path(CHECKLIST_PHOTOS_DIR, filename, "Photo not found")
+    
+    if w:
+        info = await asyncio.to_thread(ensure_image_variants, f"{CHECKLIST_PHOTO_URL_PREFIX}{filename}")
+        if info:
+            variant = pick_image_variant(info, w)
+            name = variant["filename"]
+            if variant["webp_filename"] and "image/webp" in request.headers.get("accept", ""):
+                name = variant["webp_filename"]
+            return await static_file_response(
+                image_variant_path(name), request, immutable=True, headers={"Vary": "Accept"}
+            )
+    
+    return await static_file_response(file_path, request, immutable=True)
 
 # ============ AI REPORT GENERATION ============
 
-async def generate_training_report_content(session_id: str, program_id: str, company_id: str) -> str:
-    """Generate comprehensive training report using GPT-5"""
+async def training_report_content_inputs(session_id: str, program_id: str, company_id: str) -> dict:
+    """The session data snapshot the full report prompt is built from; its hash is the LLM cache key"""
     
     # Gather all data
     session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
     program = await db.programs.find_one({"id": program_id}, {"_id": 0})
     company = await db.companies.find_one({"id": company_id}, {"_id": 0})
     
-    # Get all participants
+    # Get all participants (one query, in session order)
     participant_ids = session.get('participant_ids', [])
-    participants = []
-    for pid in participant_ids:
-        user = await db.users.find_one({"id": pid}, {"_id": 0})
-        if user:
-            participants.append(user)
+    users = await get_participant_map(participant_ids, ("full_name",))
+    participants = [users[pid] for pid in participant_ids if pid in users]
     
     # Get pre-test results
     pre_tests = await db.test_results.find({
@@ -5118,9 +8263,7 @@ async def generate_training_report_content(session_id: str, program_id: str, com
     }, {"_id": 0}).to_list(100)
     
     # Get attendance
-    attendance = await db.attendance_records.find({
-        "session_id": session_id
-    }, {"_id": 0}).to_list(100)
+    attendance = await get_attendance_summary(session_id)
     
     # Create participant ID to name mapping
     participant_map = {p.get('id'): p.get('full_name') for p in participants}
@@ -5171,12 +8314,14 @@ async def generate_training_report_content(session_id: str, program_id: str, com
         },
         "attendance": {
             "total_records": len(attendance),
-            "attendance_rate": len([a for a in attendance if a.get('clock_out_time')]) / len(attendance) * 100 if attendance else 100
+            "attendance_rate": len([a for a in attendance.values() if a['status'] == 'present']) / len(participants) * 100 if participants else 100
         }
     }
-    
-    # Create prompt for GPT-5
-    prompt = f"""Generate a comprehensive Defensive Driving/Riding Training Report based on the following data:
+    return training_data
+
+
+def training_report_content_prompt(training_data: dict) -> str:
+    return f"""Generate a comprehensive Defensive Driving/Riding Training Report based on the following data:
 
 TRAINING DETAILS:
 - Program: {training_data['program']['name']}
@@ -5252,50 +8397,62 @@ ABSOLUTE CRITICAL RULES FOR VEHICLE INSPECTION SECTION:
 4. NEVER write "undefined" or leave item unnamed
 5. Be intelligent in extracting the core item name from any description"""
 
-    # Call GPT-5
-    try:
-        api_key = os.getenv('EMERGENT_LLM_KEY')
-        llm = LlmChat(api_key=api_key)
-        
-        messages = [UserMessage(content=prompt)]
-        response = llm.chat(messages=messages, model="gpt-4o")
-        
-        return response.content
-    except Exception as e:
-        logging.error(f"GPT-5 report generation failed: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Report generation failed: {str(e)}")
 
-@api_router.post("/reports/generate")
-async def generate_report(request: ReportGenerateRequest, current_user: User = Depends(get_current_user)):
-    """Generate AI training report (Coordinator only)"""
-    if current_user.role not in ["coordinator", "admin"]:
-        raise HTTPException(status_code=403, detail="Only coordinators can generate reports")
-    
-    # Get session details
-    session = await db.sessions.find_one({"id": request.session_id}, {"_id": 0})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    # Generate report content
-    content = await generate_training_report_content(
-        request.session_id,
-        session['program_id'],
-        session['company_id']
+async def generate_training_report_content(session_id: str, program_id: str, company_id: str) -> str:
+    """Comprehensive Markdown training report from the LLM, cached per session data snapshot"""
+    training_data = await training_report_content_inputs(session_id, program_id, company_id)
+    return await complete_llm(
+        llm_cache_key("training_report_content", training_data),
+        AI_REPORT_SYSTEM_MESSAGE,
+        training_report_content_prompt(training_data)
     )
-    
-    # Save as draft
+
+
+async def save_report_draft(session: dict, content: str, generated_by: str) -> dict:
     report = TrainingReport(
-        session_id=request.session_id,
+        session_id=session['id'],
         program_id=session['program_id'],
         company_id=session['company_id'],
-        generated_by=current_user.id,
+        generated_by=generated_by,
         content=content,
         status="draft"
     )
-    
     await db.training_reports.insert_one(report.model_dump())
+    return report.model_dump()
+
+
+async def report_draft_job(payload: dict) -> dict:
+    """Job handler: generate the report content and save it as a draft"""
+    session = await db.sessions.find_one({"id": payload["session_id"]}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    content = await generate_training_report_content(session['id'], session['program_id'], session['company_id'])
+    return await save_report_draft(session, content, payload["generated_by"])
+
+
+register_job_handler("report_draft", report_draft_job, concurrency=LLM_CONCURRENCY, max_attempts=2)
+
+
+@api_router.post("/reports/generate", status_code=202)
+async def generate_report(request: ReportGenerateRequest, response: Response, current_user: User = Depends(get_current_user)):
+    """Queue an AI training report draft (Coordinator only); unchanged session data is saved from the cache at once"""
+    if current_user.role not in ["coordinator", "admin"]:
+        raise HTTPException(status_code=403, detail="Only coordinators can generate reports")
     
-    return report
+    # Get session details
+    session = await db.sessions.find_one({"id": request.session_id}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    training_data = await training_report_content_inputs(session['id'], session['program_id'], session['company_id'])
+    content = await cached_llm_text(llm_cache_key("training_report_content", training_data))
+    if content is not None:
+        response.status_code = 200
+        report = await save_report_draft(session, content, current_user.id)
+        return {"job_id": None, "status": "succeeded", "result": report, "message": "Report draft created from cache"}
+    
+    job = await enqueue_job("report_draft", {"session_id": session['id'], "generated_by": current_user.id}, current_user.id)
+    return {**job_response(job), "message": "Report generation queued"}
 
 @api_router.get("/reports/session/{session_id}")
 async def get_session_report(session_id: str, current_user: User = Depends(get_current_user)):
@@ -5362,6 +8519,247 @@ async def publish_report(report_id: str, current_user: User = Depends(get_curren
     
     return {"message": "Report published successfully", "published_to": supervisor_ids}
 
+# ============ ANALYTICS ============
+
+# Per-session analytics are keyed by the session's data_version, so entries never go stale;
+# the TTL only bounds memory. Cross-session results have no single version and expire quickly.
+session_analytics_cache = TTLCache(maxsize=1024, ttl=3600)
+cross_session_analytics_cache = TTLCache(maxsize=128, ttl=300)
+
+ANALYTICS_GROUP_FIELDS = {
+    "company": "$session.company_id",
+    "program": "$session.program_id",
+    "trainer": "$session.trainer_assignments.trainer_id",
+}
+
+def _pre_post_stages(match: dict) -> List[dict]:
+    """Pipeline stages reducing test_results to one pre/post pair per (session, participant).
+
+    If a participant has several attempts of the same test type, the best score is used.
+    """
+    is_pre = {"$eq": ["$test_type", "pre"]}
+    is_post = {"$eq": ["$test_type", "post"]}
+    return [
+        {"$match": {**match, "test_type": {"$in": ["pre", "post"]}}},
+        {"$group": {
+            "_id": {"session_id": "$session_id", "participant_id": "$participant_id"},
+            "pre_score": {"$max": {"$cond": [is_pre, "$score", None]}},
+            "post_score": {"$max": {"$cond": [is_post, "$score", None]}},
+            "pre_passed": {"$max": {"$cond": [is_pre, "$passed", None]}},
+            "post_passed": {"$max": {"$cond": [is_post, "$passed", None]}},
+        }},
+        {"$addFields": {
+            "delta": {"$cond": [
+                {"$and": [{"$ne": ["$pre_score", None]}, {"$ne": ["$post_score", None]}]},
+                {"$subtract": ["$post_score", "$pre_score"]},
+                None
+            ]}
+        }},
+    ]
+
+def _metrics_group_stage(group_id) -> dict:
+    """$group stage computing averages, pass counts and the improvement distribution.
+
+    The distribution buckets follow the remark thresholds used in the DOCX report.
+    """
+    def count_if(condition):
+        return {"$sum": {"$cond": [condition, 1, 0]}}
+
+    has_delta = {"$ne": ["$delta", None]}
+    return {"$group": {
+        "_id": group_id,
+        "participants": {"$sum": 1},
+        "pre_count": count_if({"$ne": ["$pre_score", None]}),
+        "post_count": count_if({"$ne": ["$post_score", None]}),
+        "paired_count": count_if(has_delta),
+        "pre_avg": {"$avg": "$pre_score"},
+        "post_avg": {"$avg": "$post_score"},
+        "delta_avg": {"$avg": "$delta"},
+        "pre_passed": count_if({"$eq": ["$pre_passed", True]}),
+        "post_passed": count_if({"$eq": ["$post_passed", True]}),
+        "improved": count_if({"$and": [has_delta, {"$gt": ["$delta", 0]}]}),
+        "excellent": count_if({"$and": [has_delta, {"$gte": ["$delta", 20]}]}),
+        "good": count_if({"$and": [has_delta, {"$gte": ["$delta", 10]}, {"$lt": ["$delta", 20]}]}),
+        "satisfactory": count_if({"$and": [has_delta, {"$gte": ["$delta", 0]}, {"$lt": ["$delta", 10]}]}),
+        "needs_attention": count_if({"$and": [has_delta, {"$gte": ["$delta", -10]}, {"$lt": ["$delta", 0]}]}),
+        "requires_support": count_if({"$and": [has_delta, {"$lt": ["$delta", -10]}]}),
+    }}
+
+def _format_metrics(raw: Optional[dict]) -> dict:
+    """Turn a metrics $group result into the API shape (rounded averages and pass rates)"""
+    raw = raw or {}
+
+    def rate(count, total):
+        return round(count / total * 100, 1) if total else 0.0
+
+    def avg(value):
+        return round(value, 1) if value is not None else None
+
+    pre_count = raw.get("pre_count", 0)
+    post_count = raw.get("post_count", 0)
+    paired_count = raw.get("paired_count", 0)
+    return {
+        "participants": raw.get("participants", 0),
+        "pre_test": {
+            "completed": pre_count,
+            "average": avg(raw.get("pre_avg")),
+            "passed": raw.get("pre_passed", 0),
+            "pass_rate": rate(raw.get("pre_passed", 0), pre_count),
+        },
+        "post_test": {
+            "completed": post_count,
+            "average": avg(raw.get("post_avg")),
+            "passed": raw.get("post_passed", 0),
+            "pass_rate": rate(raw.get("post_passed", 0), post_count),
+        },
+        "improvement": {
+            "paired": paired_count,
+            "average_delta": avg(raw.get("delta_avg")),
+            "improved": raw.get("improved", 0),
+            "improved_rate": rate(raw.get("improved", 0), paired_count),
+            "distribution": {
+                "excellent": raw.get("excellent", 0),
+                "good": raw.get("good", 0),
+                "satisfactory": raw.get("satisfactory", 0),
+                "needs_attention": raw.get("needs_attention", 0),
+                "requires_support": raw.get("requires_support", 0),
+            },
+        },
+    }
+
+async def compute_session_analytics(session_id: str, version: int) -> dict:
+    """Pre/post metrics for one session, cached per session data version"""
+    cache_key = (session_id, version)
+    cached = session_analytics_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    pipeline = _pre_post_stages({"session_id": session_id}) + [_metrics_group_stage(None)]
+    rows = await db.test_results.aggregate(pipeline).to_list(1)
+    
+    analytics = {
+        "session_id": session_id,
+        "version": version,
+        **_format_metrics(rows[0] if rows else None)
+    }
+    session_analytics_cache[cache_key] = analytics
+    return analytics
+
+@api_router.get("/sessions/{session_id}/analytics")
+async def get_session_analytics(session_id: str, current_user: User = Depends(get_current_user)):
+    """Get pre/post improvement analytics for a session"""
+    if current_user.role not in ["admin", "coordinator", "trainer"]:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    
+    version = await get_session_version(session_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    return await compute_session_analytics(session_id, version)
+
+@api_router.get("/analytics/improvement")
+async def get_improvement_analytics(
+    group_by: str = "company",
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    company_id: Optional[str] = None,
+    program_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Cross-session pre/post analytics grouped by company, program or trainer, per year"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access only")
+    
+    if group_by not in ANALYTICS_GROUP_FIELDS:
+        raise HTTPException(status_code=400, detail="group_by must be 'company', 'program' or 'trainer'")
+    
+    cache_key = (group_by, year_from, year_to, company_id, program_id)
+    cached = cross_session_analytics_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    session_query = {}
+    if company_id:
+        session_query["company_id"] = company_id
+    if program_id:
+        session_query["program_id"] = program_id
+    if year_from or year_to:
+        date_range = {}
+        if year_from:
+            date_range["$gte"] = f"{year_from}-01-01"
+        if year_to:
+            date_range["$lt"] = f"{year_to + 1}-01-01"
+        session_query["start_date"] = date_range
+    
+    # Filter sessions first so the test_results scan can use the session_id index
+    results_match = {}
+    if session_query:
+        sessions = await db.sessions.find(session_query, {"_id": 0, "id": 1}).to_list(None)
+        results_match["session_id"] = {"$in": [s["id"] for s in sessions]}
+    
+    pipeline = _pre_post_stages(results_match) + [
+        {"$lookup": {
+            "from": "sessions",
+            "localField": "_id.session_id",
+            "foreignField": "id",
+            "as": "session"
+        }},
+        {"$unwind": "$session"},
+    ]
+    if group_by == "trainer":
+        pipeline.append({"$unwind": "$session.trainer_assignments"})
+    pipeline += [
+        _metrics_group_stage({
+            "key": ANALYTICS_GROUP_FIELDS[group_by],
+            "year": {"$substrCP": ["$session.start_date", 0, 4]}
+        }),
+        {"$sort": {"_id.key": 1, "_id.year": 1}},
+    ]
+    rows = await db.test_results.aggregate(pipeline).to_list(None)
+    
+    # Resolve group names with a single lookup
+    keys = list({row["_id"].get("key") for row in rows if row["_id"].get("key")})
+    if group_by == "company":
+        docs = await db.companies.find({"id": {"$in": keys}}, {"_id": 0, "id": 1, "name": 1}).to_list(None)
+        names = {d["id"]: d.get("name") for d in docs}
+    elif group_by == "program":
+        docs = await db.programs.find({"id": {"$in": keys}}, {"_id": 0, "id": 1, "name": 1}).to_list(None)
+        names = {d["id"]: d.get("name") for d in docs}
+    else:
+        docs = await db.users.find({"id": {"$in": keys}}, {"_id": 0, "id": 1, "full_name": 1}).to_list(None)
+        names = {d["id"]: d.get("full_name") for d in docs}
+    
+    groups = {}
+    for row in rows:
+        key = row["_id"].get("key")
+        group = groups.setdefault(key, {"id": key, "name": names.get(key, "Unknown"), "years": []})
+        year_metrics = {"year": row["_id"].get("year"), **_format_metrics(row)}
+        
+        # Year-on-year change against the previous year present for this group
+        if group["years"]:
+            previous = group["years"][-1]
+            year_metrics["change_vs_previous"] = {
+                "post_average": (
+                    round(year_metrics["post_test"]["average"] - previous["post_test"]["average"], 1)
+                    if year_metrics["post_test"]["average"] is not None and previous["post_test"]["average"] is not None
+                    else None
+                ),
+                "post_pass_rate": round(year_metrics["post_test"]["pass_rate"] - previous["post_test"]["pass_rate"], 1),
+                "average_delta": (
+                    round(year_metrics["improvement"]["average_delta"] - previous["improvement"]["average_delta"], 1)
+                    if year_metrics["improvement"]["average_delta"] is not None and previous["improvement"]["average_delta"] is not None
+                    else None
+                ),
+            }
+        group["years"].append(year_metrics)
+    
+    result = {
+        "group_by": group_by,
+        "groups": sorted(groups.values(), key=lambda g: (g["name"] or "").lower())
+    }
+    cross_session_analytics_cache[cache_key] = result
+    return result
+
 # ============ SUPERVISOR ENDPOINTS ============
 
 @api_router.get("/supervisor/sessions")
@@ -5383,19 +8781,25 @@ async def get_supervisor_session_attendance(session_id: str, current_user: User
     if current_user.role != "pic_supervisor":
         raise HTTPException(status_code=403, detail="Only supervisors can access this")
     
-    # Verify supervisor has access to this session
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
-    if not session or current_user.id not in session.get('supervisor_ids', []):
+    # Verify supervisor has access to this session (membership checked in the query itself)
+    session = await db.sessions.find_one(
+        {"id": session_id, "supervisor_ids": current_user.id},
+        {"_id": 0, "id": 1}
+    )
+    if not session:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
+    cached = supervisor_attendance_cache.get(session_id)
+    if cached is not None:
+        return cached
+    
     # Get attendance records
-    attendance = await db.attendance.find({
-        "session_id": session_id
-    }, {"_id": 0}).to_list(100)
+    attendance = await get_attendance_rows(session_id)
     
     # Get participant details
+    participant_map = await get_participant_map({r['participant_id'] for r in attendance})
     for record in attendance:
-        participant = await db.users.find_one({"id": record['participant_id']}, {"_id": 0, "password": 0})
+        participant = participant_map.get(record['participant_id'])
         if participant:
             record['participant_name'] = participant.get('full_name', 'Unknown')
             record['participant_email'] = participant.get('email', '')
@@ -5403,6 +8807,7 @@ async def get_supervisor_session_attendance(session_id: str, current_user: User
             record['participant_name'] = f"Participant {record['participant_id']}"
             record['participant_email'] = ''
     
+    supervisor_attendance_cache[session_id] = attendance
     return attendance
 
 # Include router
@@ -5448,16 +8853,19 @@ async def setup_admin_account():
             await db.test_results.create_index([("session_id", 1), ("participant_id", 1)])
             await db.test_results.create_index("test_type")
             
-            # Attendance collection indexes
+            # Attendance collection indexes (the unique key is built by ensure_attendance_store)
             await db.attendance.create_index([("session_id", 1), ("participant_id", 1)])
             await db.attendance.create_index([("session_id", 1), ("date", 1)])
             
             # Participant access collection indexes
             await db.participant_access.create_index([("session_id", 1), ("participant_id", 1)], unique=True)
+            await db.participant_access.create_index([("certificate_uploaded_at", -1), ("_id", -1)])
             
             # Feedback collection indexes
             await db.course_feedback.create_index([("session_id", 1), ("participant_id", 1)])
             
+            # Certificates: the unique (session, participant) key is built by ensure_certificate_store
+            
             # Vehicle issues collection indexes
             await db.vehicle_issues.create_index([("session_id", 1), ("participant_id", 1)])
             
@@ -5512,6 +8920,110 @@ async def setup_admin_account():
         logging.error(f"❌ Failed to setup admin account: {str(e)}")
 
 
+@app.on_event("startup")
+async def ensure_attendance_store():
+    """
+    Fold in the legacy attendance collections and build the unique (participant, session, date)
+    index. Clock-in/out are upserts on that key and would silently create duplicate rows without
+    it, so duplicates found here are merged and the app refuses to start if the index still fails.
+    """
+    try:
+        await migrate_attendance_collections()
+    except Exception as migration_error:
+        logging.warning(f"⚠️  Attendance migration failed, will retry next start: {str(migration_error)}")
+    
+    key = [("participant_id", 1), ("session_id", 1), ("date", 1)]
+    try:
+        await db.attendance.create_index(key, unique=True)
+    except OperationFailure as index_error:
+        merged = await merge_duplicate_attendance_rows()
+        logging.warning(f"⚠️  Unique attendance index failed ({index_error}); merged {merged} duplicate rows, retrying")
+        try:
+            await db.attendance.create_index(key, unique=True)
+        except OperationFailure as retry_error:
+            logging.error(f"❌ Unique attendance index could not be created: {retry_error}")
+            raise RuntimeError("Unique attendance index is required for atomic clock-in/out") from retry_error
+
+
+@app.on_event("startup")
+async def ensure_certificate_store():
+    """
+    Build the unique (session, participant) certificate index that certificate_upsert relies on.
+    The single and batch certificate jobs can upsert the same participant at once, so rows they
+    duplicated before the index existed are merged first, and the app refuses to start without it.
+    """
+    key = [("session_id", 1), ("participant_id", 1)]
+    index = (await db.certificates.index_information()).get("session_id_1_participant_id_1")
+    if index and not index.get("unique"):
+        # Built without unique=True by earlier versions; same name, so it has to go first
+        await db.certificates.drop_index("session_id_1_participant_id_1")
+    try:
+        await db.certificates.create_index(key, unique=True)
+    except OperationFailure as index_error:
+        merged = await merge_duplicate_certificates()
+        logging.warning(f"⚠️  Unique certificate index failed ({index_error}); merged {merged} duplicate rows, retrying")
+        try:
+            await db.certificates.create_index(key, unique=True)
+        except OperationFailure as retry_error:
+            logging.error(f"❌ Unique certificate index could not be created: {retry_error}")
+            raise RuntimeError("Unique certificate index is required for certificate upserts") from retry_error
+
+
+@app.on_event("startup")
+async def start_background_jobs():
+    llm_provider.check()
+    try:
+        await db.jobs.create_index("id", unique=True)
+        await db.jobs.create_index("status")
+        await db.jobs.create_index([("status", 1), ("lease_expires_at", 1)])
+        await db.jobs.create_index("finished_at", expireAfterSeconds=JOB_RETENTION_DAYS * 86400)
+        await db.llm_cache.create_index("key", unique=True)
+        await db.llm_cache.create_index("created_at", expireAfterSeconds=LLM_CACHE_TTL_DAYS * 86400)
+    except Exception as e:
+        logging.warning(f"⚠️  Job index creation warning: {str(e)}")
+    await document_converter.start()
+    await start_job_workers()
+    logging.info(f"✅ Job workers started for: {', '.join(job_handlers) or 'none'}")
+
+@app.on_event("startup")
+async def start_storage_gc():
+    try:
+        await db.blobs.create_index("key", unique=True)
+        await db.blobs.create_index("last_written_at")
+        await db.maintenance.create_index("id", unique=True)
+    except Exception as e:
+        logging.warning(f"⚠️  Blob index creation warning: {str(e)}")
+    if BLOB_GC_INTERVAL_HOURS > 0:
+        app.state.storage_gc = asyncio.create_task(storage_gc_loop())
+        logging.info(f"✅ Storage GC scheduled every {BLOB_GC_INTERVAL_HOURS:g}h ({BLOB_STORE_BACKEND} blob store)")
+
+@app.on_event("startup")
+async def start_session_event_relay():
+    """Relay session events between API workers when the mongo events backend is enabled"""
+    if SESSION_EVENTS_BACKEND != 'mongo':
+        return
+    try:
+        # Events are only useful live; let Mongo expire them after an hour
+        await db.session_events.create_index("created_at", expireAfterSeconds=3600)
+    except Exception as e:
+        logging.warning(f"⚠️  session_events TTL index not created: {str(e)}")
+    app.state.session_event_relay = asyncio.create_task(watch_session_events())
+    logging.info("✅ Session event relay started (mongo change stream)")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    relay = getattr(app.state, "session_event_relay", None)
+    if relay:
+        relay.cancel()
+    storage_gc = getattr(app.state, "storage_gc", None)
+    if storage_gc:
+        storage_gc.cancel()
+    for task in [*job_worker_tasks, *job_retry_tasks]:
+        task.cancel()
+    draft_tasks = [run.task for run in ai_draft_runs.values() if run.task]
+    for task in draft_tasks:
+        task.cancel()
+    # Let cancelled drafts save their "failed" state before the client closes
+    await asyncio.gather(*draft_tasks, return_exceptions=True)
+    await document_converter.stop()
     client.close()
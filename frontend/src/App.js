@@ -40,6 +40,60 @@ axiosInstance.interceptors.request.use(
   }
 );
 
+// Poll a background job until it finishes; resolves with the job result
+export const waitForJob = async (jobId, { interval = 1000, timeout = 120000 } = {}) => {
+  const deadline = Date.now() + timeout;
+  while (Date.now() < deadline) {
+    const { data: job } = await axiosInstance.get(`/jobs/${jobId}`);
+    if (job.status === "succeeded") return job.result;
+    if (job.status === "failed") {
+      const error = new Error(job.error || "Job failed");
+      error.response = { data: { detail: job.error } };
+      throw error;
+    }
+    await new Promise((resolve) => setTimeout(resolve, interval));
+  }
+  throw new Error("Timed out waiting for job");
+};
+
+// Follow a text stream served as Server-Sent Events ("chunk" / "reset" / "done" / "failed").
+// onText gets the text so far; resolves with the full text. EventSource reconnects by itself and
+// the server resumes from the last event id, so a dropped connection does not lose progress.
+export const streamText = (path, onText) => new Promise((resolve, reject) => {
+  const token = localStorage.getItem("token");
+  const source = new EventSource(`${API}${path}?token=${encodeURIComponent(token)}`);
+  let text = "";
+  source.addEventListener("chunk", (event) => {
+    text += JSON.parse(event.data).text;
+    onText(text);
+  });
+  source.addEventListener("reset", () => {
+    text = "";
+    onText(text);
+  });
+  source.addEventListener("done", () => {
+    source.close();
+    resolve(text);
+  });
+  source.addEventListener("failed", (event) => {
+    source.close();
+    const { detail } = JSON.parse(event.data);
+    const error = new Error(detail);
+    error.response = { data: { detail } };
+    reject(error);
+  });
+  source.onerror = () => {
+    // Retries are automatic; CLOSED means the server refused the stream outright
+    if (source.readyState === EventSource.CLOSED) reject(new Error("Stream unavailable"));
+  };
+});
+
+// Checklist photos are served resized with ?w=; other image sources pass through unchanged
+export const photoVariant = (url, width) => {
+  if (!url || !url.includes("/api/static/checklist-photos/")) return url;
+  return `${url}${url.includes("?") ? "&" : "?"}w=${width}`;
+};
+
 function App() {
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
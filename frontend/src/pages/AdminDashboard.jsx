@@ -114,6 +114,8 @@ const AdminDashboard = ({ user, onLogout }) => {
 
   // Certificates Repository states
   const [allCertificates, setAllCertificates] = useState([]);
+  const [certificatesTotal, setCertificatesTotal] = useState(0);
+  const [certificatesCursor, setCertificatesCursor] = useState(null);
   const [loadingCertificates, setLoadingCertificates] = useState(false);
   const [certificatesSearch, setCertificatesSearch] = useState("");
   const [filterCertSession, setFilterCertSession] = useState("all");
@@ -747,11 +749,21 @@ const AdminDashboard = ({ user, onLogout }) => {
 
 
   // Certificates Repository functions
-  const loadAllCertificates = async () => {
+  const loadAllCertificates = async (loadMore = false) => {
     setLoadingCertificates(true);
     try {
-      const response = await axiosInstance.get("/certificates/repository");
-      setAllCertificates(response.data || []);
+      // Filtering and paging happen server-side
+      const params = { limit: 50 };
+      if (certificatesSearch.trim()) params.search = certificatesSearch.trim();
+      if (filterCertSession !== "all") params.session_id = filterCertSession;
+      if (filterCertProgram !== "all") params.program_id = filterCertProgram;
+      if (loadMore && certificatesCursor) params.cursor = certificatesCursor;
+      
+      const response = await axiosInstance.get("/certificates/repository", { params });
+      const { items = [], total = 0, next_cursor = null } = response.data || {};
+      setAllCertificates((prev) => (loadMore ? [...prev, ...items] : items));
+      setCertificatesTotal(total);
+      setCertificatesCursor(next_cursor);
     } catch (error) {
       console.error("Failed to load certificates:", error);
       toast.error(error.response?.data?.detail || "Failed to load certificates");
@@ -823,6 +835,13 @@ const AdminDashboard = ({ user, onLogout }) => {
     setReportDetailsOpen(true);
   };
 
+  // Reload the certificates repository when its tab is open and the filters change (debounced for search)
+  useEffect(() => {
+    if (activeTab !== "certificates") return;
+    const timer = setTimeout(() => loadAllCertificates(), 400);
+    return () => clearTimeout(timer);
+  }, [activeTab, certificatesSearch, filterCertSession, filterCertProgram]);
+
   // Load reports when Reports tab is selected
   useEffect(() => {
     if (activeTab === "reports" && allReports.length === 0) {
@@ -2883,7 +2902,7 @@ const AdminDashboard = ({ user, onLogout }) => {
                     <CardTitle>Certificates Repository</CardTitle>
                     <CardDescription>View all uploaded participant certificates</CardDescription>
                   </div>
-                  <Button onClick={loadAllCertificates} disabled={loadingCertificates}>
+                  <Button onClick={() => loadAllCertificates()} disabled={loadingCertificates}>
                     {loadingCertificates ? "Loading..." : "Refresh"}
                   </Button>
                 </div>
@@ -2924,7 +2943,7 @@ const AdminDashboard = ({ user, onLogout }) => {
                       <SelectContent>
                         <SelectItem value="all">All Programs</SelectItem>
                         {programs.map((program) => (
-                          <SelectItem key={program.id} value={program.name}>
+                          <SelectItem key={program.id} value={program.id}>
                             {program.name}
                           </SelectItem>
                         ))}
@@ -2947,7 +2966,7 @@ const AdminDashboard = ({ user, onLogout }) => {
                 </div>
 
                 {/* Certificates Table */}
-                {loadingCertificates ? (
+                {loadingCertificates && allCertificates.length === 0 ? (
                   <div className="text-center py-8">
                     <p className="text-gray-500">Loading certificates...</p>
                   </div>
@@ -2973,22 +2992,6 @@ const AdminDashboard = ({ user, onLogout }) => {
                       </thead>
                       <tbody>
                         {allCertificates
-                          .filter((cert) => {
-                            // Search filter
-                            const searchLower = certificatesSearch.toLowerCase();
-                            const matchesSearch = !certificatesSearch || 
-                              cert.participant_name?.toLowerCase().includes(searchLower) ||
-                              cert.participant_id_number?.toLowerCase().includes(searchLower) ||
-                              cert.participant_email?.toLowerCase().includes(searchLower);
-                            
-                            // Session filter
-                            const matchesSession = filterCertSession === "all" || cert.session_id === filterCertSession;
-                            
-                            // Program filter
-                            const matchesProgram = filterCertProgram === "all" || cert.program_name === filterCertProgram;
-                            
-                            return matchesSearch && matchesSession && matchesProgram;
-                          })
                           .map((cert, index) => (
                             <tr key={index} className="border-b hover:bg-gray-50">
                               <td className="p-3">
@@ -3035,26 +3038,21 @@ const AdminDashboard = ({ user, onLogout }) => {
                       </tbody>
                     </table>
                     
+                    {certificatesCursor && (
+                      <div className="mt-4 text-center">
+                        <Button variant="outline" onClick={() => loadAllCertificates(true)} disabled={loadingCertificates}>
+                          {loadingCertificates ? "Loading..." : "Load more"}
+                        </Button>
+                      </div>
+                    )}
+                    
                     {/* Summary */}
                     <div className="mt-4 p-4 bg-blue-50 rounded-lg border border-blue-200">
                       <p className="text-sm text-gray-700">
-                        <span className="font-semibold">Total Certificates:</span> {allCertificates.length}
-                        {certificatesSearch || filterCertSession !== "all" || filterCertProgram !== "all" ? (
-                          <span className="ml-2">
-                            | <span className="font-semibold">Filtered:</span> {
-                              allCertificates.filter((cert) => {
-                                const searchLower = certificatesSearch.toLowerCase();
-                                const matchesSearch = !certificatesSearch || 
-                                  cert.participant_name?.toLowerCase().includes(searchLower) ||
-                                  cert.participant_id_number?.toLowerCase().includes(searchLower) ||
-                                  cert.participant_email?.toLowerCase().includes(searchLower);
-                                const matchesSession = filterCertSession === "all" || cert.session_id === filterCertSession;
-                                const matchesProgram = filterCertProgram === "all" || cert.program_name === filterCertProgram;
-                                return matchesSearch && matchesSession && matchesProgram;
-                              }).length
-                            }
-                          </span>
-                        ) : null}
+                        <span className="font-semibold">
+                          {certificatesSearch || filterCertSession !== "all" || filterCertProgram !== "all" ? "Matching" : "Total"} Certificates:
+                        </span> {certificatesTotal}
+                        <span className="ml-2">| <span className="font-semibold">Showing:</span> {allCertificates.length}</span>
                       </p>
                     </div>
                   </div>
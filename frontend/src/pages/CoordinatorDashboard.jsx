@@ -1,6 +1,6 @@
 import { useState, useEffect } from "react";
 import { useNavigate } from "react-router-dom";
-import { axiosInstance } from "../App";
+import { axiosInstance, waitForJob, streamText, photoVariant } from "../App";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { Label } from "@/components/ui/label";
@@ -467,10 +467,19 @@ const CoordinatorDashboard = ({ user, onLogout }) => {
 
     setGeneratingReport(true);
     try {
-      const response = await axiosInstance.post(`/training-reports/${selectedSession.id}/generate-ai-report`);
-      
+      // Show the draft as it is written; fall back to the background job if streaming is unavailable
+      let generatedReport;
+      try {
+        generatedReport = await streamText(`/training-reports/${selectedSession.id}/ai-report/stream`, setAiGeneratedReport);
+      } catch (streamError) {
+        if (streamError.response) throw streamError;
+        const response = await axiosInstance.post(`/training-reports/${selectedSession.id}/generate-ai-report`);
+        const result = response.data.result || await waitForJob(response.data.job_id, { timeout: 300000 });
+        generatedReport = result.generated_report;
+      }
+
       // Add checklist issues section to the AI report
-      let fullReport = response.data.generated_report;
+      let fullReport = generatedReport;
       
       if (checklistIssues.length > 0) {
         fullReport += "\n\n## VEHICLE INSPECTION ISSUES\n\n";
@@ -509,12 +518,14 @@ const CoordinatorDashboard = ({ user, onLogout }) => {
 
     setGeneratingDOCX(true);
     try {
+      // Report is built in the background; wait for the job to finish
       const response = await axiosInstance.post(`/training-reports/${selectedSession.id}/generate-docx`);
+      const result = await waitForJob(response.data.job_id, { timeout: 300000 });
       
       setProfessionalReportStatus(prev => ({
         ...prev,
         docx_generated: true,
-        docx_filename: response.data.filename
+        docx_filename: result.filename
       }));
       
       toast.success("Professional report generated! Click 'Download DOCX' to edit it.");
@@ -525,6 +536,26 @@ const CoordinatorDashboard = ({ user, onLogout }) => {
     }
   };
 
+  const handlePreviewReport = async () => {
+    if (!selectedSession) {
+      toast.error("Please select a session first");
+      return;
+    }
+    
+    try {
+      // Rendered from the cached report model; no DOCX is generated
+      const response = await axiosInstance.get(`/training-reports/${selectedSession.id}/preview`, {
+        params: { format: "html" },
+        responseType: 'text'
+      });
+      const url = window.URL.createObjectURL(new Blob([response.data], { type: 'text/html' }));
+      window.open(url, '_blank');
+      setTimeout(() => window.URL.revokeObjectURL(url), 60000);
+    } catch (error) {
+      toast.error(error.response?.data?.detail || "Failed to load report preview");
+    }
+  };
+
   const handleDownloadDOCX = async () => {
     try {
       const response = await axiosInstance.get(`/training-reports/${selectedSession.id}/download-docx`, {
@@ -1416,7 +1447,8 @@ const CoordinatorDashboard = ({ user, onLogout }) => {
                                           <div className="mt-2">
                                             <p className="text-xs text-gray-600 mb-1">Photo:</p>
                                             <img 
-                                              src={item.photo_url || item.photo} 
+                                              src={photoVariant(item.photo_url || item.photo, 320)} 
+                                              loading="lazy"
                                               alt={item.item || 'Vehicle item'} 
                                               className="w-32 h-32 object-cover rounded border-2 border-red-300 cursor-pointer hover:scale-105 transition-transform"
                                               onClick={() => window.open(item.photo_url || item.photo, '_blank')}
@@ -1673,6 +1705,11 @@ const CoordinatorDashboard = ({ user, onLogout }) => {
                                 <p className="text-xs text-green-700 mt-1">✓ Report generated: {professionalReportStatus.docx_filename}</p>
                               )}
                             </div>
+                            <div className="flex gap-2">
+                            <Button variant="outline" onClick={handlePreviewReport}>
+                              <Eye className="w-4 h-4 mr-2" />
+                              Preview
+                            </Button>
                             <Button
                               onClick={handleGenerateProfessionalReport}
                               disabled={generatingDOCX || professionalReportStatus.pdf_submitted}
@@ -1690,6 +1727,7 @@ const CoordinatorDashboard = ({ user, onLogout }) => {
                                 </>
                               )}
                             </Button>
+                            </div>
                           </div>
                         </CardContent>
                       </Card>
@@ -2181,7 +2219,8 @@ const CoordinatorDashboard = ({ user, onLogout }) => {
                                 if (!selectedSession) return;
                                 setGeneratingDOCX(true);
                                 try {
-                                  await axiosInstance.post(`/training-reports/${selectedSession.id}/generate-docx`);
+                                  const response = await axiosInstance.post(`/training-reports/${selectedSession.id}/generate-docx`);
+                                  await waitForJob(response.data.job_id, { timeout: 300000 });
                                   toast.success("Report generated! Click download to get the file.");
                                   setProfessionalReportStatus({...professionalReportStatus, docx_generated: true});
                                 } catch (error) {
@@ -1,6 +1,6 @@
 import { useState, useEffect } from "react";
 import { useNavigate } from "react-router-dom";
-import { axiosInstance } from "../App";
+import { axiosInstance, waitForJob, photoVariant } from "../App";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { Label } from "@/components/ui/label";
@@ -111,7 +111,9 @@ const ParticipantDashboard = ({ user, onLogout }) => {
   const handleDownloadCertificate = async (sessionId) => {
     try {
       const response = await axiosInstance.post(`/certificates/generate/${sessionId}/${user.id}`);
-      const certificateUrl = response.data.certificate_url;
+      // Returned inline when the certificate is already up to date, otherwise rendered in the background
+      if (!response.data.result) toast.info("Preparing your certificate...");
+      const { certificate_url: certificateUrl } = response.data.result || await waitForJob(response.data.job_id);
       
       // Fetch the PDF as blob
       const pdfResponse = await axiosInstance.get(certificateUrl, {
@@ -179,7 +181,7 @@ const ParticipantDashboard = ({ user, onLogout }) => {
     try {
       // First generate/get the certificate
       const response = await axiosInstance.post(`/certificates/generate/${sessionId}/${user.id}`);
-      const certificateUrl = response.data.certificate_url;
+      const { certificate_url: certificateUrl } = response.data.result || await waitForJob(response.data.job_id);
       
       // Open PDF in new tab - simple and reliable
       window.open(`${process.env.REACT_APP_BACKEND_URL}${certificateUrl}`, '_blank');
@@ -872,8 +874,9 @@ const ParticipantDashboard = ({ user, onLogout }) => {
                                     <div className="mt-3">
                                       <p className="text-xs text-gray-500 mb-1">Photo:</p>
                                       <img
-                                        src={itemPhoto}
+                                        src={photoVariant(itemPhoto, 400)}
                                         alt={itemName}
+                                        loading="lazy"
                                         className="w-48 h-48 object-cover rounded-lg border-2 border-gray-200 shadow-sm"
                                       />
                                     </div>
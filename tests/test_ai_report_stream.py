@@ -0,0 +1,91 @@
+"""Streamed AI report drafts over SSE: chunks, resuming with Last-Event-ID, and reset"""
+import asyncio
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def draft_tasks_done():
+    """Wait for draft runs still saving after their last event"""
+    await asyncio.gather(*(run.task for run in list(server.ai_draft_runs.values())))
+
+
+@pytest.fixture
+async def draft_tasks():
+    """Lets no draft run outlive the test database"""
+    yield
+    await draft_tasks_done()
+
+
+async def stream(client, session_id: str, token: str, last_event_id: str = None) -> list:
+    """The events of one SSE response, as (type, id, data)"""
+    headers = {"Last-Event-ID": last_event_id} if last_event_id else {}
+    response = await client.get(
+        f"/api/training-reports/{session_id}/ai-report/stream", params={"token": token}, headers=headers
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = []
+    for block in response.text.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if fields:
+            events.append((fields["event"], fields["id"], json.loads(fields["data"])))
+    return events
+
+
+def streamed_text(events: list) -> str:
+    return "".join(data["text"] for kind, _, data in events if kind == "chunk")
+
+
+async def test_draft_streams_then_completes(db, client, coordinator, training_session, draft_tasks):
+    _, token = coordinator
+    
+    events = await stream(client, training_session, token)
+    
+    text = streamed_text(events)
+    kind, event_id, data = events[-1]
+    assert kind == "done"
+    assert data["length"] == len(text)
+    assert text.startswith("# TRAINING COMPLETION REPORT")
+    run_id = event_id.split(":")[0]
+    assert all(event[1].startswith(f"{run_id}:") for event in events)
+    
+    await draft_tasks_done()
+    draft = await server.saved_ai_draft(training_session)
+    assert draft["ai_draft"] == text
+    assert draft["ai_draft_status"] == "complete"
+    assert draft["ai_draft_run"] == run_id
+    inputs = await server.ai_report_inputs(training_session)
+    assert await server.cached_llm_text(server.llm_cache_key("ai_report", inputs)) == text
+
+
+async def test_reconnect_resumes_from_last_event_id(db, client, coordinator, training_session, draft_tasks):
+    _, token = coordinator
+    first = await stream(client, training_session, token)
+    text = streamed_text(first)
+    run_id = first[-1][1].split(":")[0]
+    await draft_tasks_done()
+    
+    resumed = await stream(client, training_session, token, last_event_id=f"{run_id}:10")
+    
+    assert [kind for kind, _, _ in resumed] == ["chunk", "done"]
+    assert resumed[0][2]["text"] == text[10:]
+    assert resumed[0][1] == f"{run_id}:{len(text)}"
+
+
+async def test_reconnect_to_an_older_run_resets(db, client, coordinator, training_session, draft_tasks):
+    _, token = coordinator
+    first = await stream(client, training_session, token)
+    text = streamed_text(first)
+    run_id = first[-1][1].split(":")[0]
+    await draft_tasks_done()
+    
+    resumed = await stream(client, training_session, token, last_event_id="0123456789ab:10")
+    
+    assert [kind for kind, _, _ in resumed] == ["reset", "chunk", "done"]
+    assert resumed[0][1] == f"{run_id}:0"
+    assert resumed[1][2]["text"] == text
@@ -0,0 +1,79 @@
+"""AI completion reports with the stub provider: the LLM cache and the generate-ai-report route"""
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def provider_calls(monkeypatch):
+    """Prompts the LLM provider was asked to complete"""
+    calls = []
+    complete = server.llm_provider.complete
+    
+    async def counting_complete(system_message, prompt, model):
+        calls.append(prompt)
+        return await complete(system_message, prompt, model)
+    
+    monkeypatch.setattr(server.llm_provider, "complete", counting_complete)
+    return calls
+
+
+async def test_completion_is_cached(db, provider_calls):
+    key = server.llm_cache_key("test", {"value": 1})
+    
+    first = await server.complete_llm(key, "system", "Program Name: Defensive Driving")
+    second = await server.complete_llm(key, "system", "Program Name: Defensive Driving")
+    
+    assert first == second
+    assert "- Program Name: Defensive Driving" in first
+    assert len(provider_calls) == 1
+    assert await server.cached_llm_text(key) == first
+    assert await server.cached_llm_text(server.llm_cache_key("test", {"value": 2})) is None
+
+
+async def test_generate_route_queues_then_serves_the_cache(db, client, coordinator, training_session, provider_calls):
+    _, token = coordinator
+    headers = {"Authorization": f"Bearer {token}"}
+    url = f"/api/training-reports/{training_session}/generate-ai-report"
+    
+    queued = await client.post(url, headers=headers)
+    assert queued.status_code == 202
+    job_id = queued.json()["job_id"]
+    assert server._job_queue("ai_report").get_nowait() == job_id
+    server.job_handlers["ai_report"].pending.discard(job_id)
+    
+    await server._run_job("ai_report", job_id)
+    job = (await client.get(f"/api/jobs/{job_id}", headers=headers)).json()
+    assert job["status"] == "succeeded"
+    report = job["result"]["generated_report"]
+    assert "- Company: Acme Logistics" in report
+    assert job["result"]["cached"] is False
+    
+    cached = await client.post(url, headers=headers)
+    assert cached.status_code == 200
+    body = cached.json()
+    assert body["job_id"] is None
+    assert body["result"]["generated_report"] == report
+    assert body["result"]["cached"] is True
+    assert len(provider_calls) == 1
+    
+    # Different session data is a different prompt, so it is generated again
+    await db.sessions.update_one({"id": training_session}, {"$set": {"location": "Klang"}})
+    requeued = await client.post(url, headers=headers)
+    assert requeued.status_code == 202
+    server.job_handlers["ai_report"].pending.discard(server._job_queue("ai_report").get_nowait())
+
+
+async def test_generate_route_is_for_coordinators(db, client, training_session):
+    participant = server.User(full_name="Test Participant", id_number="P-1", role="participant")
+    await db.users.insert_one(participant.model_dump())
+    token = server.create_access_token({"sub": participant.id})
+    
+    response = await client.post(
+        f"/api/training-reports/{training_session}/generate-ai-report",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    
+    assert response.status_code == 403
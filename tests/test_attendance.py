@@ -0,0 +1,25 @@
+"""Attendance store: merging duplicate day rows before the unique index is built"""
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_merge_keeps_clock_times_and_the_latest_mark(db):
+    key = {"participant_id": "p1", "session_id": "s1", "date": "2026-03-02"}
+    await db.attendance.insert_many([
+        {**key, "clock_in": "2026-03-02T08:05:00+08:00", "clock_out": None, "status": None},
+        {**key, "clock_in": "2026-03-02T08:01:00+08:00", "clock_out": "2026-03-02T17:00:00+08:00",
+         "status": "absent", "marked_by": "c1", "marked_at": "2026-03-02T09:00:00+08:00"},
+        {**key, "clock_in": None, "clock_out": None,
+         "status": "present", "marked_by": "c2", "marked_at": "2026-03-02T10:00:00+08:00"},
+    ])
+    
+    assert await server.merge_duplicate_attendance_rows() == 2
+    
+    rows = await db.attendance.find(key, {"_id": 0}).to_list(None)
+    assert len(rows) == 1
+    assert rows[0]["clock_in"] == "2026-03-02T08:01:00+08:00"
+    assert rows[0]["clock_out"] == "2026-03-02T17:00:00+08:00"
+    assert (rows[0]["status"], rows[0]["marked_by"], rows[0]["marked_at"]) == ("present", "c2", "2026-03-02T10:00:00+08:00")
@@ -0,0 +1,77 @@
+"""Content-addressed blob store and collect_garbage: references, grace window and leftovers"""
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def age(db, key: str, hours: float):
+    """Pretend the blob was last written hours ago"""
+    written = datetime.now(timezone.utc) - timedelta(hours=hours)
+    await db.blobs.update_one({"key": key}, {"$set": {"last_written_at": written}})
+
+
+async def test_identical_content_is_stored_once(db, static_dir):
+    first = await server.put_blob(b"same bytes", "pdf")
+    second = await server.put_blob(b"same bytes", "pdf")
+    
+    assert first == second
+    assert server.BLOB_KEY_PATTERN.match(first)
+    assert server.blob_store.local_path(first).read_bytes() == b"same bytes"
+    assert await db.blobs.count_documents({}) == 1
+
+
+async def test_gc_keeps_referenced_and_recent_blobs(db, static_dir):
+    by_key = await server.put_blob(b"report", "docx")
+    by_url = await server.put_blob(b"certificate", "pdf")
+    orphan = await server.put_blob(b"superseded", "pdf")
+    recent = await server.put_blob(b"still being saved", "pdf")
+    await db.training_reports.insert_one({"id": "r1", "docx_blob": by_key})
+    await db.participant_access.insert_one({"id": "p1", "certificate_url": server.blob_url(by_url, "Certificate.pdf")})
+    for key in (by_key, by_url, orphan):
+        await age(db, key, server.BLOB_GC_GRACE_HOURS + 1)
+    
+    preview = await server.collect_garbage(dry_run=True)
+    assert preview == {"dry_run": True, "blobs_removed": 1, "files_removed": 0, "bytes_freed": len(b"superseded")}
+    assert server.blob_store.exists(orphan)
+    
+    result = await server.collect_garbage()
+    assert result["blobs_removed"] == 1
+    assert not server.blob_store.exists(orphan)
+    assert await db.blobs.find_one({"key": orphan}) is None
+    for key in (by_key, by_url, recent):
+        assert server.blob_store.exists(key)
+        assert await db.blobs.find_one({"key": key}) is not None
+
+
+async def test_rewritten_blob_restarts_grace_window(db, static_dir):
+    key = await server.put_blob(b"regenerated", "pdf")
+    await age(db, key, server.BLOB_GC_GRACE_HOURS + 1)
+    
+    # Storing the same content again (e.g. a regeneration whose reference is not saved yet)
+    await server.put_blob(b"regenerated", "pdf")
+    
+    assert (await server.collect_garbage())["blobs_removed"] == 0
+    assert server.blob_store.exists(key)
+
+
+async def test_gc_removes_only_old_leftover_files(db, static_dir):
+    old_part = static_dir / "uploads_tmp" / "abandoned-upload"
+    old_tmp = static_dir / "blobs" / ".report.pdf.tmp"
+    fresh_part = static_dir / "uploads_tmp" / "in-progress-upload"
+    for path in (old_part, old_tmp, fresh_part):
+        path.write_bytes(b"x" * 10)
+    stale = time.time() - (server.BLOB_GC_GRACE_HOURS + 1) * 3600
+    for path in (old_part, old_tmp):
+        os.utime(path, (stale, stale))
+    
+    result = await server.collect_garbage()
+    
+    assert result == {"dry_run": False, "blobs_removed": 0, "files_removed": 2, "bytes_freed": 20}
+    assert not old_part.exists() and not old_tmp.exists()
+    assert fresh_part.exists()
@@ -0,0 +1,52 @@
+"""Certificate rows: one per (session, participant), enforced by a unique index"""
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_duplicates_are_merged_before_the_unique_index(db):
+    await db.certificates.create_index([("session_id", 1), ("participant_id", 1)])
+    await db.certificates.insert_many([
+        {"id": "first", "session_id": "s1", "participant_id": "p1", "certificate_url": "/old.pdf",
+         "content_key": "old", "issue_date": "2026-03-01T10:00:00+08:00"},
+        {"id": "second", "session_id": "s1", "participant_id": "p1", "certificate_url": "/new.pdf",
+         "content_key": "new", "issue_date": "2026-03-02T10:00:00+08:00"},
+        {"id": "other", "session_id": "s1", "participant_id": "p2", "certificate_url": "/p2.pdf",
+         "content_key": "p2", "issue_date": "2026-03-01T10:00:00+08:00"},
+    ])
+    
+    await server.ensure_certificate_store()
+    
+    rows = await db.certificates.find({"participant_id": "p1"}, {"_id": 0}).to_list(None)
+    assert len(rows) == 1
+    assert rows[0]["id"] == "first"
+    assert rows[0]["certificate_url"] == "/new.pdf" and rows[0]["content_key"] == "new"
+    assert await db.certificates.count_documents({"participant_id": "p2"}) == 1
+    with pytest.raises(DuplicateKeyError):
+        await db.certificates.insert_one({"id": "third", "session_id": "s1", "participant_id": "p1"})
+
+
+async def test_upsert_racing_an_insert_updates_that_row(db):
+    await server.ensure_certificate_store()
+    rendered = {"certificate_url": "/api/blobs/x.pdf", "content_key": "k"}
+    # The other job's upsert inserted the row first
+    await db.certificates.insert_one({"id": "existing", "session_id": "s1", "participant_id": "p1"})
+    
+    class InsertOnce:
+        """Fails the first bulk write the way a lost upsert race does"""
+        calls = 0
+        
+        async def bulk_write(self, operations, ordered=True):
+            self.calls += 1
+            if self.calls == 1:
+                raise server.BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "errmsg": "E11000"}]})
+            return await db.certificates.bulk_write(operations, ordered=ordered)
+    
+    failed = await server._bulk_upsert(InsertOnce(), [server.certificate_upsert("p1", "s1", "Program", rendered)])
+    
+    assert failed == {}
+    rows = await db.certificates.find({"participant_id": "p1"}, {"_id": 0}).to_list(None)
+    assert [(row["id"], row["certificate_url"]) for row in rows] == [("existing", "/api/blobs/x.pdf")]
@@ -0,0 +1,184 @@
+"""Background job queue: atomic claims, retries, permanent failures and lease recovery"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def job_type(monkeypatch):
+    """Registers a "test" job type whose behaviour each test sets through outcomes"""
+    outcomes = []
+    calls = []
+    
+    async def handler(payload):
+        calls.append(payload)
+        outcome = outcomes.pop(0) if outcomes else None
+        if isinstance(outcome, Exception):
+            raise outcome
+        return {"value": payload["value"]}
+    
+    monkeypatch.setitem(server.job_handlers, "test", server.JobHandler(handler, concurrency=1, max_attempts=2))
+    monkeypatch.setattr(server, "JOB_RETRY_BASE_SECONDS", 0)
+    return outcomes, calls
+
+
+def take() -> str:
+    """Take the next id off the worker queue, as _job_worker does"""
+    job_id = server._job_queue("test").get_nowait()
+    server.job_handlers["test"].pending.discard(job_id)
+    return job_id
+
+
+async def cancel_retry_timers():
+    tasks = list(server.job_retry_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def enqueue(value="x"):
+    job = await server.enqueue_job("test", {"value": value}, "tester")
+    # Tests drive _run_job themselves; drop the id the enqueue put on the worker queue
+    assert take() == job["id"]
+    return job
+
+
+async def test_claim_runs_a_job_once(db, job_type):
+    _, calls = job_type
+    job = await enqueue()
+    
+    await asyncio.gather(server._run_job("test", job["id"]), server._run_job("test", job["id"]))
+    
+    stored = await db.jobs.find_one({"id": job["id"]}, {"_id": 0})
+    assert len(calls) == 1
+    assert stored["status"] == "succeeded"
+    assert stored["result"] == {"value": "x"}
+    assert stored["attempts"] == 1
+    assert "worker_id" not in stored and "lease_expires_at" not in stored
+    assert stored["finished_at"] is not None
+
+
+async def test_failed_attempt_is_retried(db, job_type):
+    outcomes, calls = job_type
+    outcomes.append(RuntimeError("mongo blip"))
+    job = await enqueue()
+    
+    await server._run_job("test", job["id"])
+    stored = await db.jobs.find_one({"id": job["id"]}, {"_id": 0})
+    assert stored["status"] == "queued"
+    assert stored["error"] == "mongo blip"
+    
+    assert take() == job["id"]
+    await server._run_job("test", job["id"])
+    
+    stored = await db.jobs.find_one({"id": job["id"]}, {"_id": 0})
+    assert len(calls) == 2
+    assert stored["status"] == "succeeded"
+    assert stored["attempts"] == 2
+    assert stored["error"] is None
+
+
+async def test_attempts_are_capped(db, job_type):
+    outcomes, _ = job_type
+    outcomes.extend([RuntimeError("first"), RuntimeError("second")])
+    job = await enqueue()
+    
+    await server._run_job("test", job["id"])
+    take()
+    await server._run_job("test", job["id"])
+    
+    stored = await db.jobs.find_one({"id": job["id"]}, {"_id": 0})
+    assert stored["status"] == "failed"
+    assert stored["error"] == "second"
+    assert stored["attempts"] == 2
+
+
+async def test_http_exception_is_not_retried(db, job_type):
+    outcomes, calls = job_type
+    outcomes.append(HTTPException(status_code=404, detail="Session not found"))
+    job = await enqueue()
+    
+    await server._run_job("test", job["id"])
+    
+    stored = await db.jobs.find_one({"id": job["id"]}, {"_id": 0})
+    assert len(calls) == 1
+    assert stored["status"] == "failed"
+    assert stored["error"] == "Session not found"
+    assert not server.job_retry_tasks
+
+
+async def test_recovery_requeues_only_expired_leases(db, job_type):
+    now = datetime.now(timezone.utc)
+    await db.jobs.insert_many([
+        {"id": "live", "type": "test", "status": "running", "worker_id": "sibling",
+         "lease_expires_at": now + timedelta(seconds=30), "payload": {"value": "live"}},
+        {"id": "dead", "type": "test", "status": "running", "worker_id": "crashed",
+         "lease_expires_at": now - timedelta(seconds=1), "payload": {"value": "dead"}},
+    ])
+    
+    await server.recover_jobs(include_fresh=True)
+    
+    live = await db.jobs.find_one({"id": "live"}, {"_id": 0})
+    dead = await db.jobs.find_one({"id": "dead"}, {"_id": 0})
+    assert live["status"] == "running" and live["worker_id"] == "sibling"
+    assert dead["status"] == "queued" and "worker_id" not in dead
+    assert take() == "dead"
+    assert server._job_queue("test").empty()
+
+
+async def test_recovery_does_not_queue_a_held_job_twice(db, job_type):
+    job = await enqueue()
+    overdue = datetime.now(timezone.utc) - timedelta(seconds=server.JOB_LEASE_SECONDS + 1)
+    await db.jobs.update_one({"id": job["id"]}, {"$set": {"available_at": overdue}})
+    
+    await server.recover_jobs()
+    await server.recover_jobs()
+    
+    assert take() == job["id"]
+    assert server._job_queue("test").empty()
+
+
+async def test_retry_backoff_survives_a_restart(db, job_type, monkeypatch):
+    monkeypatch.setattr(server, "JOB_RETRY_BASE_SECONDS", 60)
+    outcomes, calls = job_type
+    outcomes.append(RuntimeError("mongo blip"))
+    job = await enqueue()
+    await server._run_job("test", job["id"])
+    assert server._job_queue("test").empty()
+    assert len(server.job_retry_tasks) == 1
+    
+    # A restart finds the job queued but not yet due
+    await cancel_retry_timers()
+    server.job_handlers["test"].pending.clear()
+    await server.recover_jobs(include_fresh=True)
+    assert server._job_queue("test").empty()
+    assert len(server.job_retry_tasks) == 1
+    
+    # Even if its id turns up early, it cannot be claimed before available_at
+    await server._run_job("test", job["id"])
+    assert len(calls) == 1
+    assert (await db.jobs.find_one({"id": job["id"]}, {"_id": 0}))["status"] == "queued"
+    await cancel_retry_timers()
+
+
+async def test_lost_lease_does_not_record_outcome(db, job_type):
+    job = await enqueue()
+    
+    async def taken_over(payload):
+        # The lease expired and another process claimed the job while this one was still busy
+        await db.jobs.update_one({"id": job["id"]}, {"$set": {"worker_id": "other-process"}})
+        return {"value": "late"}
+    
+    server.job_handlers["test"].func = taken_over
+    await server._run_job("test", job["id"])
+    
+    stored = await db.jobs.find_one({"id": job["id"]}, {"_id": 0})
+    assert stored["status"] == "running"
+    assert stored["worker_id"] == "other-process"
+    assert stored["result"] is None
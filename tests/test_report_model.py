@@ -0,0 +1,30 @@
+"""Training report model cache: user edits must reach previews without waiting for the TTL"""
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def admin(db):
+    user = server.User(full_name="Test Admin", id_number="A-1", role="admin", email="admin@example.com")
+    await db.users.insert_one(user.model_dump())
+    return {"Authorization": f"Bearer {server.create_access_token({'sub': user.id})}"}
+
+
+async def test_user_edit_invalidates_their_sessions(db, client, admin, training_session, monkeypatch):
+    monkeypatch.setattr(server, "report_model_cache", server.TTLCache(maxsize=8, ttl=3600))
+    await db.users.insert_one({"id": "p1", "full_name": "Ali Bin Abu", "id_number": "900101", "role": "participant"})
+    await db.sessions.insert_one({"id": "session-2", "participant_ids": ["p9"]})
+    
+    before = await server.get_report_model(training_session, "Coordinator")
+    response = await client.put("/api/users/p1", json={"full_name": "Ali Bin Abu Bakar"}, headers=admin)
+    assert response.status_code == 200
+    after = await server.get_report_model(training_session, "Coordinator")
+    
+    assert before is not after
+    assert await server.get_session_version(training_session) == 1
+    assert await server.get_session_version("session-2") == 0
+    assert "Ali Bin Abu Bakar" in repr(after)
+    assert "Ali Bin Abu Bakar" not in repr(before)